@@ -0,0 +1,294 @@
+# ==============================================================================
+# SaeRo 문서 생성 파이프라인 벤치마크
+# ==============================================================================
+# 합성 마크업(문단/인라인 태그, 단순 표, 24열 복합 표, 그림)을 만들어 main.py 의 문서 생성 단계를
+# 백엔드별로 측정하고, 실행 시간/최대 RSS/단계별 시간을 JSON 으로 출력한다. 결과 파일끼리 --compare 로 비교할 수 있다.
+#
+#   python benchmark.py --preset medium --output bench.json
+#   python benchmark.py --preset medium --compare bench.json
+#
+# 그림은 로컬 스텁 HTTP 서버에서 내려주므로 네트워크가 필요 없다. 측정마다 새 프로세스를 띄워 캐시와 RSS 가 섞이지 않게 한다.
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from multiprocessing import get_context
+
+PRESETS = {
+    'small': dict(paragraphs=200, tables=5, table_rows=20, complex_tables=2, complex_rows=20, images=10, image_variants=5),
+    'medium': dict(paragraphs=2000, tables=20, table_rows=50, complex_tables=10, complex_rows=50, images=40, image_variants=12),
+    'large': dict(paragraphs=10000, tables=60, table_rows=200, complex_tables=30, complex_rows=200, images=150, image_variants=30),
+}
+WRITERS = ('python-docx', 'stream', 'incremental')
+WORDS = ['보고서', '예산', '집행', '현황', '계획', '검토', '결과', '사업', '추진', '일정', 'SaeRo', '2024년', '1분기', '담당자', '비고']
+INLINE_TAGS = ['{>>}', '{<<}', '{탭}', '{줄바꿈}', '{문단바꿈}']
+LINE_PREFIXES = ['', '', '', '{왼쪽}', '{가운데}', '{오른쪽}', '{양쪽}', '{균등}', '{1.5줄}', '{11pt}',
+                 '{들여쓰기,1번줄:1.0,2번줄이하:0.5}', '{제목1.1}', '{제목2.2}', '{제목3.3}']
+
+# ==============================================================================
+# 1. 합성 마크업 생성
+# ==============================================================================
+def words(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n))
+
+def paragraph_line(rng):
+    prefix = rng.choice(LINE_PREFIXES)
+    if prefix.startswith('{제목'): return prefix + words(rng, 4)
+    parts = [prefix]
+    for _ in range(rng.randint(1, 6)):
+        parts.append(words(rng, rng.randint(2, 12)))
+        if rng.random() < 0.5: parts.append(rng.choice(INLINE_TAGS))
+    return ''.join(parts)
+
+def simple_table(rng, rows, image_ref):
+    cols = rng.randint(3, 8)
+    lines = ['{표시작1}' if rng.random() < 0.7 else '{표시작1,테두리없음,글꼴=바탕,크기=9}']
+    lines.append('{제목행}{회색}' + '|'.join(f"항목{c + 1}" for c in range(cols)))
+    for r in range(rows):
+        cells = [words(rng, rng.randint(1, 4)) if rng.random() > 0.2 else '' for _ in range(cols)]
+        if rng.random() < 0.05: cells[rng.randrange(cols)] = f"{{그림:{image_ref(rng)}}}"
+        lines.append(('{남색}' if r % 10 == 9 else '') + '|'.join(cells))
+    lines.append('{표끝1}')
+    return lines
+
+def complex_table(rng, rows):
+    # 24열 복합 표: {N}/{-} 열 지정과 빈 칸(병합)을 섞는다.
+    lines = ['{표시작2}', '{제목행}구분{1}|내용{5}|금액{17}|비고{-}']
+    for _ in range(rows):
+        segments, col = [], 1
+        while col <= 24:
+            span = rng.choice([1, 2, 3, 4, 6])
+            if rng.random() < 0.7: segments.append(f"{words(rng, rng.randint(1, 3))}{{{col}}}")
+            col += span
+        if rng.random() < 0.3: segments.append('합계{-}')
+        lines.append('|'.join(segments))
+    lines.append('{표끝2}')
+    return lines
+
+def generate_markup(params, image_base_url, seed=0):
+    rng = random.Random(seed)
+    variants = max(1, params['image_variants'])
+    def image_ref(r):
+        k = r.randrange(variants)
+        return f"{image_base_url}/img/{k}.{('jpg', 'png', 'png')[k % 3]}"
+    blocks = [[paragraph_line(rng)] for _ in range(params['paragraphs'])]
+    blocks += [simple_table(rng, params['table_rows'], image_ref) for _ in range(params['tables'])]
+    blocks += [complex_table(rng, params['complex_rows']) for _ in range(params['complex_tables'])]
+    blocks += [[f"{{그림:{image_ref(rng)}}}"] for _ in range(params['images'])]
+    blocks += [['{페이지바꿈}'] for _ in range(max(1, params['paragraphs'] // 100))]
+    rng.shuffle(blocks)
+    return '\n'.join(line for block in blocks for line in block)
+
+# ==============================================================================
+# 2. 그림 스텁 서버
+# ==============================================================================
+def stub_image(name):
+    # /img/<번호>.<jpg|png> → 번호별로 고정된 이미지 (사진형 JPEG, 큰 PNG 스크린샷, 작은 로고 PNG)
+    from PIL import Image, ImageDraw, ImageFilter
+    stem, ext = os.path.splitext(name)
+    rng = random.Random(int(stem))
+    buf = io.BytesIO()
+    if ext == '.jpg':
+        size = (rng.choice([1600, 2400, 4000]), rng.choice([1200, 1800, 3000]))
+        img = Image.frombytes('RGB', (size[0] // 8, size[1] // 8), rng.randbytes(size[0] // 8 * size[1] // 8 * 3))
+        img.resize(size, Image.BILINEAR).filter(ImageFilter.GaussianBlur(2)).save(buf, 'JPEG', quality=92)
+    else:
+        size = rng.choice([(1920, 1080), (1200, 800), (160, 60)])
+        img = Image.new('RGB', size, (255, 255, 255))
+        draw = ImageDraw.Draw(img)
+        for _ in range(40):
+            x, y = rng.randrange(size[0]), rng.randrange(size[1])
+            draw.rectangle([x, y, x + rng.randint(5, 300), y + rng.randint(5, 120)],
+                           fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        img.save(buf, 'PNG')
+    return buf.getvalue()
+
+class StubImageHandler(BaseHTTPRequestHandler):
+    images = {}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        name = self.path.split('?')[0].rsplit('/', 1)[-1]
+        try:
+            with self.lock:
+                if name not in self.images: self.images[name] = stub_image(name)
+            data = self.images[name]
+        except (ValueError, OSError):
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg' if name.endswith('.jpg') else 'image/png')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+def start_stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubImageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+# ==============================================================================
+# 3. 측정 (각각 새 프로세스에서 실행)
+# ==============================================================================
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def run_pipeline(text, writer, settings):
+    import main
+    stages = {}
+    def stage(name, fn, *args):
+        started = time.perf_counter()
+        result = fn(*args)
+        stages[name] = round(time.perf_counter() - started, 4)
+        return result
+    rss_after_import = peak_rss_mb()
+    started = time.perf_counter()
+    images = stage('prefetch', main.prefetch_images, text)
+    output = io.BytesIO()
+    settings = dict(settings, docx_writer=writer)
+    if writer == 'python-docx':
+        nodes = stage('parse', main.parse_markup, text)
+        doc, section = stage('base', main.create_base_document, settings)
+        stage('render', main.render_nodes, doc, section, nodes, images)
+        stage('package', doc.save, output)
+    elif writer == 'stream':
+        nodes = stage('parse', main.parse_markup, text)
+        template = stage('base', main.get_docx_template, settings)
+        stage('render', main.DocxStreamWriter(template, images).write, nodes, output)
+    else:
+        template = stage('base', main.get_docx_template, settings)
+        stage('render', main.DocxStreamWriter(template, images).write_segments, text, output)
+    wall = time.perf_counter() - started
+    result = {'wall_seconds': round(wall, 4), 'stages': stages, 'output_bytes': len(output.getvalue())}
+    if writer == 'incremental':
+        # 한 문단만 바꾼 뒤 다시 생성 (구간 캐시 사용)
+        lines = text.split('\n')
+        lines.insert(len(lines) // 2, '수정된 문단')
+        started = time.perf_counter()
+        main.DocxStreamWriter(template, main.prefetch_images('\n'.join(lines))).write_segments('\n'.join(lines), io.BytesIO())
+        result['stages']['render_after_edit'] = round(time.perf_counter() - started, 4)
+    result.update(peak_rss_mb=peak_rss_mb(), rss_after_import_mb=rss_after_import)
+    return result
+
+def run_micro(params, seed):
+    import main
+    rng = random.Random(seed)
+    rows = max(params['complex_rows'], 1) * max(params['complex_tables'], 1)
+    lines = complex_table(rng, rows)
+    started = time.perf_counter()
+    main.parse_complex_table_data(lines[2:-1], main.COMPLEX_TABLE_COLS)
+    parse_seconds = time.perf_counter() - started
+    # 빈 칸 병합은 plan_table 에서, XML 직렬화는 table_xml 에서 한다 (두 백엔드 공통).
+    node = main.parse_markup('\n'.join(lines))[0]
+    template = main.get_docx_template({})
+    pictures = main.DocxStreamWriter(template, {}).pictures
+    started = time.perf_counter()
+    plan = main.plan_table(node, template.layout, pictures)
+    plan_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    main.table_xml(node, plan, template.layout)
+    xml_seconds = time.perf_counter() - started
+    return {'parse_complex_table_data': {'rows': rows, 'seconds': round(parse_seconds, 4)},
+            'plan_table': {'rows': rows, 'seconds': round(plan_seconds, 4)},
+            'table_xml': {'rows': rows, 'seconds': round(xml_seconds, 4)},
+            'peak_rss_mb': peak_rss_mb()}
+
+def in_fresh_process(fn, *args):
+    with get_context('spawn').Pool(1, maxtasksperchild=1) as pool:
+        return pool.apply(fn, args)
+
+# ==============================================================================
+# 4. 실행 / 비교
+# ==============================================================================
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def summarize(runs):
+    stages = {name: round(statistics.median(run['stages'][name] for run in runs), 4) for name in runs[0]['stages']}
+    return {'wall_seconds': round(statistics.median(run['wall_seconds'] for run in runs), 4),
+            'wall_seconds_runs': [run['wall_seconds'] for run in runs],
+            'peak_rss_mb': max(run['peak_rss_mb'] for run in runs),
+            'rss_after_import_mb': max(run['rss_after_import_mb'] for run in runs),
+            'stages': stages, 'output_bytes': runs[0]['output_bytes']}
+
+def compare(current, previous):
+    # 백엔드별 (이번 / 이전) 비율. 1보다 크면 느려졌거나 메모리가 늘어난 것.
+    comparison = {}
+    for writer, result in current['results'].items():
+        before = previous.get('results', {}).get(writer)
+        if not before: continue
+        comparison[writer] = {key: round(result[key] / before[key], 3) if before.get(key) else None
+                              for key in ('wall_seconds', 'peak_rss_mb', 'output_bytes')}
+        comparison[writer]['stages'] = {name: round(value / before['stages'][name], 3)
+                                        for name, value in result['stages'].items() if before['stages'].get(name)}
+    return comparison
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="SaeRo 문서 생성 벤치마크")
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small')
+    for key in PRESETS['small']:
+        parser.add_argument('--' + key.replace('_', '-'), type=int, dest=key)
+    parser.add_argument('--writers', default=','.join(WRITERS), help="쉼표로 구분 (python-docx,stream,incremental)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="결과 JSON 파일 (없으면 표준 출력)")
+    parser.add_argument('--compare', help="비교할 이전 결과 JSON 파일")
+    parser.add_argument('--save-markup', help="생성한 마크업을 파일로 저장")
+    args = parser.parse_args()
+
+    params = dict(PRESETS[args.preset])
+    params.update({key: getattr(args, key) for key in params if getattr(args, key) is not None})
+    server, base_url = start_stub_server()
+    text = generate_markup(params, base_url, args.seed)
+    # 첫 백엔드의 prefetch 시간에 스텁 이미지 생성 시간이 섞이지 않도록 미리 만들어 둔다.
+    for name in {line.rsplit('/img/', 1)[1].split('}')[0] for line in text.split('\n') if '/img/' in line}:
+        StubImageHandler.images[name] = stub_image(name)
+    if args.save_markup:
+        with open(args.save_markup, 'w', encoding='utf-8') as f: f.write(text)
+
+    report = {
+        'meta': {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'git_commit': git_commit(), 'python': platform.python_version(),
+                 'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'preset': args.preset, 'params': params,
+                 'seed': args.seed, 'repeat': args.repeat,
+                 'corpus': {'chars': len(text), 'lines': text.count('\n') + 1, 'image_markers': text.count('{그림:')}},
+        'results': {},
+    }
+    for writer in [w.strip() for w in args.writers.split(',') if w.strip()]:
+        runs = []
+        for i in range(args.repeat):
+            runs.append(in_fresh_process(run_pipeline, text, writer, {}))
+            print(f"[{writer}] {i + 1}/{args.repeat}: {runs[-1]['wall_seconds']}s, 최대 RSS {runs[-1]['peak_rss_mb']}MB", file=sys.stderr)
+        report['results'][writer] = summarize(runs)
+    report['micro'] = in_fresh_process(run_micro, params, args.seed)
+    server.shutdown()
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            report['comparison'] = {'baseline': args.compare, 'ratios': compare(report, json.load(f))}
+        for writer, ratios in report['comparison']['ratios'].items():
+            print(f"[{writer}] 시간 x{ratios['wall_seconds']}, 최대 RSS x{ratios['peak_rss_mb']}", file=sys.stderr)
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f: f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main_cli()
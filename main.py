@@ -1,64 +1,969 @@
 # ==============================================================================
 # 1. 라이브러리 임포트
 # ==============================================================================
+import time
+MODULE_LOAD_STARTED = time.perf_counter()  # 콜드 스타트 측정 기준 (임포트 포함)
 import io
 import os
 import re
+import hashlib
+import itertools
+import posixpath
+import threading
+import zipfile
+import uuid
+import tempfile
+import multiprocessing
 import requests
 import docx
 import json
-import google.generativeai as genai
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from flask import Flask, request, send_file, jsonify
+import atexit
+import queue
+import random
+import unicodedata
+from flask import Flask, Response, g, request, send_file, jsonify, stream_with_context
 from flask_cors import CORS
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, CancelledError, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
 from datetime import datetime, timezone, timedelta
+from requests.adapters import HTTPAdapter
+from urllib.parse import quote
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.middleware.proxy_fix import ProxyFix
 from docx import Document
-from docx.shared import Pt, Cm, RGBColor
+from docx.shared import Pt, Cm, Emu, Twips
 from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_BREAK
 from docx.enum.section import WD_ORIENTATION
-from docx.oxml import OxmlElement
-from docx.oxml.ns import qn
+from docx.oxml import OxmlElement, parse_xml
+from docx.oxml.ns import qn, nsdecls
+from docx.image.image import Image as DocxImage
+from docx.opc.spec import default_content_types
+from lxml import etree
 from PIL import Image
 
 # ==============================================================================
 # 2. Flask 앱 초기화 및 설정
 # ==============================================================================
 app = Flask(__name__)
+# Cloud Run 등 프록시 뒤에서 request.url_root 가 https 가 되도록 X-Forwarded-Proto / X-Forwarded-For 만 믿는다.
+# 호스트는 프록시가 Host 헤더로 그대로 넘겨주므로, 클라이언트가 바꿀 수 있는 X-Forwarded-Host 는 믿지 않는다.
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", 1))  # 0 이면 사용 안 함
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS, x_host=0)
 CORS(app, resources={r"/*": {"origins": "*"}},
-     allow_headers=["Authorization", "Content-Type"],
+     allow_headers=["Authorization", "Content-Type", "If-None-Match"],
+     expose_headers=["ETag"],
      methods=["GET", "POST", "OPTIONS"],
      supports_credentials=True)
 
+# --- 외부 서비스 지연 초기화 ---
+# Sheets/Gemini 클라이언트(와 무거운 gspread, google.generativeai 임포트)는 처음 쓸 때 또는 시작 후 백그라운드 예열에서 만든다.
+# 실패해도 다시 시도하지 않고 None 을 돌려준다 (환경 변수는 실행 중에 바뀌지 않음).
+STARTUP_WARMUP = os.environ.get("STARTUP_WARMUP", "1") not in ("0", "false", "False", "")
+STARTUP_REPORT = {'import_seconds': None, 'ready_seconds': None, 'components': {}}
+SERVICES = {}
+SERVICE_LOCKS = {'sheets': threading.Lock(), 'gemini': threading.Lock()}
+
+def lazy_service(name, factory):
+    if name in SERVICES: return SERVICES[name]
+    with SERVICE_LOCKS[name]:
+        if name not in SERVICES:
+            started = time.perf_counter()
+            try:
+                SERVICES[name], error = factory(), None
+            except Exception as e:
+                SERVICES[name], error = None, str(e)
+            STARTUP_REPORT['components'][name] = {'ready': SERVICES[name] is not None,
+                                                  'seconds': round(time.perf_counter() - started, 3), 'error': error}
+    return SERVICES[name]
+
 # --- Google Sheets 설정 ---
 SHEET_API_SCOPES = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-# 환경 변수에서 서비스 계정 키(JSON 내용)를 직접 읽어옴
-try:
-    creds_json_str = os.environ.get("GOOGLE_SHEETS_CREDENTIALS")
-    if not creds_json_str:
-        raise ValueError("환경 변수 'GOOGLE_SHEETS_CREDENTIALS'가 설정되지 않았습니다.")
-    creds_dict = json.loads(creds_json_str)
-    SHEET_CREDS = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SHEET_API_SCOPES)
-    SHEET_CLIENT = gspread.authorize(SHEET_CREDS)
-    print("Google Sheets API가 성공적으로 초기화되었습니다.")
-except Exception as e:
-    SHEET_CLIENT = None
-    print(f"!!! Google Sheets API 초기화 오류: {e}")
+
+def create_sheet_client():
+    # 환경 변수에서 서비스 계정 키(JSON 내용)를 직접 읽어옴
+    try:
+        import gspread
+        from oauth2client.service_account import ServiceAccountCredentials
+        creds_json_str = os.environ.get("GOOGLE_SHEETS_CREDENTIALS")
+        if not creds_json_str:
+            raise ValueError("환경 변수 'GOOGLE_SHEETS_CREDENTIALS'가 설정되지 않았습니다.")
+        creds_dict = json.loads(creds_json_str)
+        sheet_creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SHEET_API_SCOPES)
+        client = gspread.authorize(sheet_creds)
+        client.set_timeout(SHEETS_TIMEOUT)
+        print("Google Sheets API가 성공적으로 초기화되었습니다.")
+        return client
+    except Exception as e:
+        print(f"!!! Google Sheets API 초기화 오류: {e}")
+        raise
+
+def get_sheet_client():
+    return lazy_service('sheets', create_sheet_client)
+
+# --- 사용자 목록(/check-user) 캐시 설정 ---
+USER_SHEET_KEY = "10FWgDt04ox83Fc2iDM66seswL1k2W-rfhOE1GHrjZtI"
+USER_SHEET_NAME = "시트1"
+USER_DIRECTORY_CHECK_INTERVAL = float(os.environ.get("USER_DIRECTORY_CHECK_INTERVAL", 30))  # 시트 변경 확인 주기(초)
+USER_DIRECTORY_MAX_AGE = float(os.environ.get("USER_DIRECTORY_MAX_AGE", 600))  # 변경이 없어도 다시 읽는 주기(초)
+USER_DIRECTORY_MISS_REFRESH = float(os.environ.get("USER_DIRECTORY_MISS_REFRESH", 30))
+USER_DIRECTORY_MISS_WAIT = float(os.environ.get("USER_DIRECTORY_MISS_WAIT", 2))
+USER_DIRECTORY_LOAD_TIMEOUT = float(os.environ.get("USER_DIRECTORY_LOAD_TIMEOUT", 30))
+
+# --- Gemini 사용량 로깅 설정 ---
+# 요청 경로에서는 큐에 넣기만 하고, 백그라운드 스레드가 모아서 append_rows로 한 번에 기록한다.
+USAGE_LOG_SHEET_KEY = os.environ.get("USAGE_LOG_SHEET_KEY", USER_SHEET_KEY)
+USAGE_LOG_SHEET_NAME = os.environ.get("USAGE_LOG_SHEET_NAME", "Gemini사용량")
+USAGE_LOG_QUEUE_MAX = int(os.environ.get("USAGE_LOG_QUEUE_MAX", 1000))
+USAGE_LOG_BATCH_SIZE = int(os.environ.get("USAGE_LOG_BATCH_SIZE", 50))
+USAGE_LOG_FLUSH_INTERVAL = float(os.environ.get("USAGE_LOG_FLUSH_INTERVAL", 10))  # 초
+USAGE_LOG_MAX_RETRIES = int(os.environ.get("USAGE_LOG_MAX_RETRIES", 4))
+USAGE_LOG_SPILL_FILE = os.environ.get("USAGE_LOG_SPILL_FILE", os.path.join(tempfile.gettempdir(), "saero-gemini-usage.ndjson"))
+USAGE_LOG_CELL_LIMIT = 50000  # 구글 시트 셀 하나의 최대 글자 수
 
 
 # --- Gemini API 설정 ---
-try:
-    API_KEY = os.environ.get("GEMINI_API_KEY")
-    if not API_KEY:
-        raise ValueError("환경 변수 'GEMINI_API_KEY'가 설정되지 않았습니다.")
+def create_gemini_model():
+    try:
+        import google.generativeai as genai
+        API_KEY = os.environ.get("GEMINI_API_KEY")
+        if not API_KEY:
+            raise ValueError("환경 변수 'GEMINI_API_KEY'가 설정되지 않았습니다.")
+
+        genai.configure(api_key=API_KEY)
+        model = genai.GenerativeModel('gemini-1.5-pro-latest')
+        print("Gemini API 모델이 성공적으로 초기화되었습니다.")
+        return model
+
+    except Exception as e:
+        print(f"!!! Gemini API 초기화 오류: {e}")
+        raise
+
+def get_gemini_model():
+    return lazy_service('gemini', create_gemini_model)
+
+# --- Gemini 대화 세션 설정 ---
+# session_id 별로 대화 기록을 서버에 두어, 클라이언트는 새 메시지만 보낸다.
+CHAT_SESSION_MAX = int(os.environ.get("CHAT_SESSION_MAX", 500))
+CHAT_SESSION_TTL = float(os.environ.get("CHAT_SESSION_TTL", 3600))  # 마지막 사용 후 보관 시간(초)
+
+# --- Gemini 응답 캐시 설정 ---
+# 같은 모델 + 같은 대화 기록 + 같은 메시지(공백/줄바꿈 정규화)면 저장해 둔 답변을 돌려준다.
+# 같은 요청이 동시에 들어오면 Gemini 는 한 번만 호출한다. 요청에 "cache": false 면 사용하지 않고, TTL 이 0 이면 전체를 끈다.
+GEMINI_CACHE_TTL = float(os.environ.get("GEMINI_CACHE_TTL", 600))
+GEMINI_CACHE_MAX_ENTRIES = int(os.environ.get("GEMINI_CACHE_MAX_ENTRIES", 1000))
+GEMINI_CACHE_MAX_BYTES = int(os.environ.get("GEMINI_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+
+# --- 외부 호출 제한 (Gemini, Sheets) ---
+# 서비스별 동시 호출 수와 분당 호출 수(토큰 버킷)를 할당량에 맞춰 제한한다. 자리가 없으면 UPSTREAM_QUEUE_TIMEOUT 초까지 기다린다.
+# 재시도 가능한 오류(429/5xx/시간 초과)는 지수 백오프 + 지터로 다시 시도하고, 연속으로 실패하면 잠시 호출을 막는다(서킷 브레이커).
+GEMINI_MAX_CONCURRENT = int(os.environ.get("GEMINI_MAX_CONCURRENT", 4))
+GEMINI_RATE_PER_MINUTE = float(os.environ.get("GEMINI_RATE_PER_MINUTE", 60))
+GEMINI_TIMEOUT = float(os.environ.get("GEMINI_TIMEOUT", 120))
+SHEETS_MAX_CONCURRENT = int(os.environ.get("SHEETS_MAX_CONCURRENT", 2))
+SHEETS_RATE_PER_MINUTE = float(os.environ.get("SHEETS_RATE_PER_MINUTE", 60))
+SHEETS_TIMEOUT = float(os.environ.get("SHEETS_TIMEOUT", 30))
+UPSTREAM_QUEUE_TIMEOUT = float(os.environ.get("UPSTREAM_QUEUE_TIMEOUT", 15))
+UPSTREAM_MAX_RETRIES = int(os.environ.get("UPSTREAM_MAX_RETRIES", 3))
+UPSTREAM_BACKOFF_BASE = float(os.environ.get("UPSTREAM_BACKOFF_BASE", 1))
+UPSTREAM_BACKOFF_MAX = float(os.environ.get("UPSTREAM_BACKOFF_MAX", 20))
+UPSTREAM_BREAKER_FAILURES = int(os.environ.get("UPSTREAM_BREAKER_FAILURES", 5))  # 연속 실패 횟수
+UPSTREAM_BREAKER_RESET = float(os.environ.get("UPSTREAM_BREAKER_RESET", 30))  # 호출을 막아 두는 시간 (초)
+
+# --- 이미지 다운로드 설정 ---
+# {그림:...} 마커의 이미지를 미리 병렬로 받아 두고, Drive 파일 id/URL 기준으로 캐시한다.
+IMAGE_FETCH_WORKERS = int(os.environ.get("IMAGE_FETCH_WORKERS", 8))
+IMAGE_FETCH_CONNECT_TIMEOUT = float(os.environ.get("IMAGE_FETCH_CONNECT_TIMEOUT", 5))
+IMAGE_FETCH_READ_TIMEOUT = float(os.environ.get("IMAGE_FETCH_READ_TIMEOUT", 30))
+IMAGE_MAX_BYTES = int(os.environ.get("IMAGE_MAX_BYTES", 20 * 1024 * 1024))
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+IMAGE_CACHE_TTL = float(os.environ.get("IMAGE_CACHE_TTL", 600))
+IMAGE_CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", "")
+IMAGE_CACHE_DISK_MAX_BYTES = int(os.environ.get("IMAGE_CACHE_DISK_MAX_BYTES", 1024 * 1024 * 1024))
+# 삽입 전 이미지 최적화: 실제 표시 크기 × DPI 로 줄이고, JPEG/최적화 PNG 로 다시 압축한다 (EXIF 등 메타데이터 제거).
+IMAGE_OPTIMIZE = os.environ.get("IMAGE_OPTIMIZE", "1") not in ("0", "false", "False", "")
+IMAGE_EMBED_DPI = int(os.environ.get("IMAGE_EMBED_DPI", 200))
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", 85))
+IMAGE_OPTIMIZE_CACHE_MAX_BYTES = int(os.environ.get("IMAGE_OPTIMIZE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# --- 문서 출력 백엔드 설정 ---
+# 'python-docx'(기본) 또는 'stream'(WordprocessingML 직접 출력). 요청의 settings['docx_writer'] 로도 선택 가능.
+# 'incremental' 은 stream 과 같은 출력을 내되, 본문을 구간으로 나눠 바뀐 구간만 다시 만든다.
+DOCX_WRITER = os.environ.get("DOCX_WRITER", "python-docx")
+DOCX_WRITERS = ('python-docx', 'stream', 'incremental')
+DOCX_TEMPLATE_CACHE_SIZE = int(os.environ.get("DOCX_TEMPLATE_CACHE_SIZE", 16))
+PROGRESS_REPORT_EVERY = 50
+DOCX_SEGMENT_CACHE_MAX_BYTES = int(os.environ.get("DOCX_SEGMENT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+DOCX_SEGMENT_MAX_LINES = int(os.environ.get("DOCX_SEGMENT_MAX_LINES", 200))  # 일반 문단 구간의 최대 줄 수
+
+# --- 생성 문서 캐시 설정 ---
+# 같은 본문/설정/이미지로 다시 요청하면 만들어 둔 .docx 를 그대로 돌려준다 (ETag 로 304 응답도 지원).
+DOCX_CACHE_MAX_BYTES = int(os.environ.get("DOCX_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+DOCX_CACHE_DIR = os.environ.get("DOCX_CACHE_DIR", "")  # 비어 있으면 디스크 캐시 사용 안 함
+DOCX_CACHE_DISK_MAX_BYTES = int(os.environ.get("DOCX_CACHE_DISK_MAX_BYTES", 1024 * 1024 * 1024))
+
+# --- 문서 생성 작업(비동기) 설정 ---
+# content 가 DOCX_ASYNC_THRESHOLD 글자를 넘으면 /create-docx 는 작업 id 를 반환(202)하고 프로세스 풀에서 생성한다.
+DOCX_ASYNC_THRESHOLD = int(os.environ.get("DOCX_ASYNC_THRESHOLD", 200000))
+DOCX_JOB_WORKERS = int(os.environ.get("DOCX_JOB_WORKERS", 2))
+DOCX_JOB_MAX_PENDING = int(os.environ.get("DOCX_JOB_MAX_PENDING", 20))
+DOCX_JOB_TTL = float(os.environ.get("DOCX_JOB_TTL", 3600))
+DOCX_JOB_DIR = os.environ.get("DOCX_JOB_DIR", os.path.join(tempfile.gettempdir(), "saero-docx-jobs"))
+
+# --- 일괄 문서 생성 설정 ---
+# /create-docx/batch 는 작업 프로세스 풀에서 문서를 만들고, 끝나는 대로 zip 으로 이어서 보낸다.
+DOCX_BATCH_MAX_ITEMS = int(os.environ.get("DOCX_BATCH_MAX_ITEMS", 500))
+DOCX_BATCH_WRITER = os.environ.get("DOCX_BATCH_WRITER", "stream")  # 작업 프로세스마다 기본 문서 템플릿을 재사용
+
+# --- 요청 크기 / 동시 생성 제한 ---
+# 전역 한도(MAX_REQUEST_BYTES)는 모든 라우트에 걸리므로 작게 둔다. JSON 요청은 본문과 결과 .docx 를 모두 메모리에 올린다.
+# 큰 문서를 받는 길은 /create-docx 의 application/x-ndjson 하나뿐이고, 그 라우트에서만 한도를 DOCX_STREAM_MAX_BYTES 로 올린다.
+# (줄 단위로 처리하고 결과 zip 을 만들어지는 대로 돌려준다.)
+MAX_REQUEST_BYTES = int(os.environ.get("MAX_REQUEST_BYTES", 32 * 1024 * 1024))
+DOCX_STREAM_MAX_BYTES = int(os.environ.get("DOCX_STREAM_MAX_BYTES", 512 * 1024 * 1024))
+DOCX_STREAM_MAX_LINE_BYTES = int(os.environ.get("DOCX_STREAM_MAX_LINE_BYTES", 4 * 1024 * 1024))  # NDJSON 한 줄, 마크업 한 줄의 최대 크기
+DOCX_STREAM_SPOOL_BYTES = int(os.environ.get("DOCX_STREAM_SPOOL_BYTES", 16 * 1024 * 1024))  # 본문 XML 이 이보다 크면 임시 파일로 넘긴다
+DOCX_MAX_CONCURRENT = int(os.environ.get("DOCX_MAX_CONCURRENT", 4))  # 요청 스레드에서 동시에 만드는 문서 수 (일괄 생성 포함)
+DOCX_QUEUE_TIMEOUT = float(os.environ.get("DOCX_QUEUE_TIMEOUT", 10))  # 자리가 날 때까지 기다리는 최대 시간 (초)
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
+
+# --- Word 파일 가져오기 (.docx → 마크업) 설정 ---
+# 문서 안의 이미지는 내용 해시 이름으로 IMPORT_IMAGE_DIR 에 저장하고 {그림:<주소>} 로 참조한다.
+# 주소는 IMPORT_IMAGE_BASE_URL(비어 있으면 이 서버의 /imported-images/) 기준이며, 같은 서버에서 문서를 만들 때는 파일을 바로 읽는다.
+# 저장한 이미지는 총량(IMPORT_IMAGE_MAX_BYTES)을 넘거나 마지막으로 쓴 뒤 IMPORT_IMAGE_TTL 이 지나면 지운다.
+# 지워진 이미지는 문서에 오류 문구로 들어가므로, 가져온 문서를 오래 두고 쓰려면 IMPORT_IMAGE_BASE_URL 을 영구 저장소로 둘 것.
+IMPORT_MAX_BYTES = int(os.environ.get("IMPORT_MAX_BYTES", 200 * 1024 * 1024))
+IMPORT_IMAGE_DIR = os.environ.get("IMPORT_IMAGE_DIR", os.path.join(tempfile.gettempdir(), "saero-imported-images"))
+IMPORT_IMAGE_BASE_URL = os.environ.get("IMPORT_IMAGE_BASE_URL", "")
+IMPORT_IMAGE_MAX_BYTES = int(os.environ.get("IMPORT_IMAGE_MAX_BYTES", 1024 * 1024 * 1024))
+IMPORT_IMAGE_TTL = int(os.environ.get("IMPORT_IMAGE_TTL", 30 * 24 * 3600))  # 초, 0 이면 기간 제한 없음
+
+# ==============================================================================
+# 2.4 요청 측정 (단계별 시간, 구조화 로그, /metrics)
+# ==============================================================================
+# 요청마다 단계별 시간을 모아 JSON 로그 한 줄로 남기고, 누적 값은 Prometheus 텍스트 형식으로 /metrics 에 노출한다.
+# 단계 시간은 스레드 로컬에 모으므로 요청 밖(작업 프로세스 등)에서도 그대로 동작한다.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+METRIC_HELP = {
+    'saero_http_requests_total': ('counter', "처리한 HTTP 요청 수"),
+    'saero_http_request_duration_seconds': ('histogram', "HTTP 요청 처리 시간 (스트리밍 응답은 헤더 전송까지)"),
+    'saero_http_requests_in_flight': ('gauge', "처리 중인 HTTP 요청 수"),
+    'saero_http_response_bytes_total': ('counter', "응답 본문 바이트 수"),
+    'saero_stage_duration_seconds': ('histogram', "파이프라인 단계별 처리 시간"),
+    'saero_docx_generated_bytes_total': ('counter', "생성(또는 캐시에서 반환)한 .docx 바이트 수"),
+    'saero_upstream_requests_total': ('counter', "외부 호출 수 (Gemini, Sheets, 이미지)"),
+    'saero_upstream_duration_seconds': ('histogram', "외부 호출 시간"),
+    'saero_requests_rejected_total': ('counter', "크기/동시 처리 제한으로 거절한 요청 수"),
+    'saero_upstream_retries_total': ('counter', "재시도한 외부 호출 수"),
+    'saero_upstream_rejected_total': ('counter', "호출하지 않고 거절한 외부 호출 수 (서킷 열림, 대기 시간 초과)"),
+}
+
+class Metrics:
+    def __init__(self):
+        self._values = {}      # (이름, 라벨) -> 값
+        self._histograms = {}  # (이름, 라벨) -> [버킷별 개수..., 합계, 개수]
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock: self._values[key] = self._values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None: hist = self._histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound: hist[i] += 1
+            hist[-2] += value
+            hist[-1] += 1
+
+    def render(self, extra=()):
+        # extra: 렌더링 시점에 읽는 값 [(이름, 종류, 설명, 라벨 dict, 값)]
+        def label_text(labels):
+            return '{' + ','.join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                                  for k, v in labels) + '}' if labels else ''
+        lines, helped = [], set()
+        def header(name, kind, text):
+            if name not in helped:
+                helped.add(name)
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+        with self._lock:
+            values = sorted(self._values.items())
+            histograms = sorted((k, list(v)) for k, v in self._histograms.items())
+        for (name, labels), value in values:
+            header(name, *METRIC_HELP[name])
+            lines.append(f"{name}{label_text(labels)} {value}")
+        for (name, labels), hist in histograms:
+            header(name, *METRIC_HELP[name])
+            for bound, count in zip(LATENCY_BUCKETS, hist):
+                lines.append(f"{name}_bucket{label_text(labels + (('le', bound),))} {count}")
+            lines.append(f"{name}_bucket{label_text(labels + (('le', '+Inf'),))} {hist[-1]}")
+            lines.append(f"{name}_sum{label_text(labels)} {round(hist[-2], 6)}")
+            lines.append(f"{name}_count{label_text(labels)} {hist[-1]}")
+        for name, kind, text, labels, value in extra:
+            if value is None: continue
+            header(name, kind, text)
+            lines.append(f"{name}{label_text(tuple(sorted(labels.items())))} {value}")
+        return '\n'.join(lines) + '\n'
+
+METRICS = Metrics()
+STAGE_TIMINGS = threading.local()
+
+@contextmanager
+def timed_stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        METRICS.observe('saero_stage_duration_seconds', elapsed, stage=name)
+        stages = getattr(STAGE_TIMINGS, 'stages', None)
+        if stages is not None: stages[name] = round(stages.get(name, 0) + elapsed * 1000, 2)
+
+@contextmanager
+def upstream_call(upstream):
+    # 외부 호출 결과(ok/error)와 시간을 기록한다. 예외는 그대로 전파.
+    started = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except BaseException as e:
+        # 스트리밍 중 클라이언트가 끊은 경우(GeneratorExit)는 외부 오류로 세지 않는다.
+        outcome = 'cancelled' if isinstance(e, GeneratorExit) else 'error'
+        raise
+    finally:
+        METRICS.inc('saero_upstream_requests_total', upstream=upstream, outcome=outcome)
+        METRICS.observe('saero_upstream_duration_seconds', time.perf_counter() - started, upstream=upstream)
+
+# ==============================================================================
+# 2.4.1 외부 호출 제한 (동시 호출 수, 토큰 버킷, 재시도, 서킷 브레이커)
+# ==============================================================================
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+class UpstreamUnavailable(Exception):
+    # 서킷이 열려 있거나 대기 시간 안에 호출 자리를 얻지 못했다. retry_after 초 뒤에 다시 시도하면 된다.
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def upstream_status(error):
+    # google.api_core / gspread 예외는 HTTP 상태 코드를 .code 에, requests 예외는 .response 에 둔다.
+    code = getattr(error, 'code', None)
+    if isinstance(code, int): return code
+    return getattr(getattr(error, 'response', None), 'status_code', None)
+
+def is_retryable(error):
+    if isinstance(error, (TimeoutError, ConnectionError, requests.Timeout, requests.ConnectionError)): return True
+    return upstream_status(error) in RETRYABLE_STATUS
+
+class TokenBucket:
+    # 분당 rate_per_minute 개까지, 최대 burst 개를 몰아서 쓸 수 있다.
+    def __init__(self, rate_per_minute, burst=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(burst or max(1, min(rate_per_minute, 10)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline):
+        # 토큰이 생길 때까지 기다린다. deadline(monotonic) 안에 못 얻으면 False.
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait_for = (1 - self._tokens) / self.rate
+            if now + wait_for > deadline: return False
+            time.sleep(wait_for)
+
+class UpstreamPolicy:
+    def __init__(self, name, max_concurrent, rate_per_minute, timeout):
+        self.name, self.timeout = name, timeout
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._bucket = TokenBucket(rate_per_minute)
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False  # 서킷이 반쯤 열린 상태에서 시험 호출이 진행 중인지
+
+    def _check_circuit(self):
+        with self._lock:
+            if self._opened_at is None: return
+            remaining = self._opened_at + UPSTREAM_BREAKER_RESET - time.monotonic()
+            if remaining <= 0 and not self._trial:
+                self._trial = True
+                return
+        METRICS.inc('saero_upstream_rejected_total', upstream=self.name, reason='circuit_open')
+        raise UpstreamUnavailable(f"{self.name} 호출이 잠시 중단되었습니다 (연속 오류).", max(1.0, remaining))
+
+    def _record(self, error):
+        # 재시도 가능한 오류만 실패로 센다 (잘못된 요청은 외부 서비스가 정상이라는 뜻).
+        with self._lock:
+            self._trial = False
+            if error is not None and is_retryable(error):
+                self._failures += 1
+                if self._failures >= UPSTREAM_BREAKER_FAILURES or self._opened_at is not None:
+                    if self._opened_at is None: print(f"!!! {self.name} 서킷 열림: 연속 {self._failures}회 오류")
+                    self._opened_at = time.monotonic()
+            else:
+                if self._opened_at is not None: print(f"{self.name} 서킷 닫힘")
+                self._failures, self._opened_at = 0, None
+
+    @contextmanager
+    def slot(self):
+        # 호출 자리(동시 호출 수 + 토큰)를 얻어 호출하는 동안 쥐고 있는다. 스트리밍 응답은 이것만 쓰고 재시도하지 않는다.
+        self._check_circuit()
+        deadline = time.monotonic() + UPSTREAM_QUEUE_TIMEOUT
+        with timed_stage(f'{self.name}_queue'):
+            acquired = self._slots.acquire(timeout=UPSTREAM_QUEUE_TIMEOUT)
+            if acquired and not self._bucket.acquire(deadline):
+                self._slots.release()
+                acquired = False
+        if not acquired:
+            with self._lock: self._trial = False
+            METRICS.inc('saero_upstream_rejected_total', upstream=self.name, reason='queue_timeout')
+            raise UpstreamUnavailable(f"{self.name} 호출 대기열이 가득 찼습니다.", UPSTREAM_QUEUE_TIMEOUT)
+        error, cancelled = None, False
+        try:
+            with upstream_call(self.name):
+                yield
+        except GeneratorExit:
+            cancelled = True
+            raise
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._slots.release()
+            if cancelled:
+                with self._lock: self._trial = False
+            else:
+                self._record(error)
 
-    genai.configure(api_key=API_KEY)
-    model = genai.GenerativeModel('gemini-1.5-pro-latest')
-    print("Gemini API 모델이 성공적으로 초기화되었습니다.")
+    def call(self, fn, *args, retries=None, **kwargs):
+        # fn(*args, **kwargs) 를 호출 자리 안에서 실행하고, 재시도 가능한 오류는 백오프 후 다시 시도한다.
+        retries = UPSTREAM_MAX_RETRIES if retries is None else retries
+        for attempt in range(retries + 1):
+            try:
+                with self.slot():
+                    return fn(*args, **kwargs)
+            except UpstreamUnavailable:
+                raise
+            except Exception as e:
+                if attempt >= retries or not is_retryable(e): raise
+                delay = min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * 2 ** attempt) * (0.5 + random.random())
+                METRICS.inc('saero_upstream_retries_total', upstream=self.name)
+                print(f"!!! {self.name} 호출 오류, {delay:.1f}초 후 재시도 ({attempt + 1}/{retries}): {e}")
+                time.sleep(delay)
 
-except Exception as e:
-    print(f"!!! Gemini API 초기화 오류: {e}")
-    model = None
+    def stats_snapshot(self):
+        with self._lock:
+            return {"circuit_open": self._opened_at is not None, "consecutive_failures": self._failures}
+
+GEMINI_UPSTREAM = UpstreamPolicy('gemini', GEMINI_MAX_CONCURRENT, GEMINI_RATE_PER_MINUTE, GEMINI_TIMEOUT)
+SHEETS_UPSTREAM = UpstreamPolicy('sheets', SHEETS_MAX_CONCURRENT, SHEETS_RATE_PER_MINUTE, SHEETS_TIMEOUT)
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    STAGE_TIMINGS.stages = {}
+    g.request_endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    METRICS.inc('saero_http_requests_in_flight', endpoint=g.request_endpoint)
+    g.request_in_flight = True
+
+def release_in_flight(endpoint):
+    METRICS.inc('saero_http_requests_in_flight', -1, endpoint=endpoint)
+
+@app.after_request
+def finish_request_metrics(response):
+    if not hasattr(g, 'request_started'): return response
+    elapsed = time.perf_counter() - g.request_started
+    endpoint = g.request_endpoint
+    # 응답이 닫힐 때(스트리밍 응답은 본문 전송이 끝난 뒤) in-flight 에서 한 번만 뺀다.
+    # send_file 응답(direct_passthrough)은 close 콜백이 불리지 않으므로 teardown 에 맡긴다.
+    if not response.direct_passthrough and g.pop('request_in_flight', None) is not None:
+        response.call_on_close(lambda: release_in_flight(endpoint))
+    METRICS.inc('saero_http_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+    METRICS.observe('saero_http_request_duration_seconds', elapsed, endpoint=endpoint)
+    if response.content_length: METRICS.inc('saero_http_response_bytes_total', response.content_length, endpoint=endpoint)
+    if endpoint not in ('/metrics', '/ready'):  # 수집기/프로브 요청은 로그에서 제외
+        print(json.dumps({"severity": "INFO", "message": f"{request.method} {request.path} {response.status_code}",
+                          "method": request.method, "path": request.path, "endpoint": endpoint,
+                          "status": response.status_code, "duration_ms": round(elapsed * 1000, 2),
+                          "response_bytes": response.content_length, "stages": getattr(STAGE_TIMINGS, 'stages', {})},
+                         ensure_ascii=False))
+    return response
+
+@app.teardown_request
+def end_request_metrics(error=None):
+    # after_request 에서 넘기지 않은 요청만 여기서 뺀다. stream_with_context 응답은 teardown 이 두 번 불리므로 표시를 꺼내 쓴다.
+    if g.pop('request_in_flight', None) is not None:
+        release_in_flight(g.request_endpoint)
+    STAGE_TIMINGS.stages = None
+
+# ==============================================================================
+# 2.5 이미지 다운로드 및 캐시
+# ==============================================================================
+IMAGE_MARKER_PATTERN = re.compile(r'\{그림:([^}]+)\}')
+IMPORTED_IMAGE_NAME_PATTERN = re.compile(r'[0-9a-f]{64}\.[a-z0-9]{1,5}')
+IMPORTED_IMAGE_REF_PATTERN = re.compile(r'/imported-images/([0-9a-f]{64}\.[a-z0-9]{1,5})$')
+DRIVE_FILE_PATTERN = re.compile(r'/file/d/([a-zA-Z0-9_-]+)')
+
+def resolve_image_source(image_url_or_id):
+    # (캐시 키, 다운로드 URL) 반환. Drive 링크는 파일 id를 키로 사용한다.
+    drive_match = DRIVE_FILE_PATTERN.search(image_url_or_id)
+    if drive_match:
+        file_id = drive_match.group(1)
+        return f"drive:{file_id}", f'https://drive.google.com/uc?export=download&id={file_id}'
+    return image_url_or_id, image_url_or_id
+
+class ImageCache:
+    # 메모리 LRU(총 바이트 제한) + 선택적 디스크 LRU(파일 mtime 기준). 항목은 (data, etag, fetched_at).
+    # 디스크에는 이미지 파일과 메타데이터(.json) 한 쌍으로 저장하고, 두 파일 크기의 합으로 용량을 센다.
+    def __init__(self, max_bytes, disk_dir="", disk_max_bytes=0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._disk = OrderedDict()  # 파일 이름(sha256) -> 이미지 + .json 크기
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            files = []
+            for name in os.listdir(disk_dir):
+                if not name.endswith('.json'): continue
+                path = os.path.join(disk_dir, name[:-5])
+                try:
+                    st = os.stat(path)
+                    size = st.st_size + os.path.getsize(path + '.json')
+                except OSError:
+                    continue
+                files.append((st.st_mtime, name[:-5], size))
+            for _, name, size in sorted(files):
+                self._disk[name] = size
+                self._disk_size += size
+
+    def _disk_name(self, key):
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        if not self.disk_dir: return None
+        name = self._disk_name(key)
+        path = os.path.join(self.disk_dir, name)
+        try:
+            with open(path + '.json', encoding='utf-8') as f: meta = json.load(f)
+            with open(path, 'rb') as f: data = f.read()
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            if name in self._disk: self._disk.move_to_end(name)
+        entry = (data, meta.get('etag'), meta.get('fetched_at', 0))
+        self._store(key, entry)
+        return entry
+
+    def put(self, key, data, etag=None):
+        entry = (data, etag, time.time())
+        self._store(key, entry)
+        if self.disk_dir: self._store_disk(key, entry)
+        return entry
+
+    def _store_disk(self, key, entry):
+        data, etag, fetched_at = entry
+        meta = json.dumps({'etag': etag, 'fetched_at': fetched_at}).encode('utf-8')
+        size = len(data) + len(meta)
+        if size > self.disk_max_bytes: return
+        name = self._disk_name(key)
+        path = os.path.join(self.disk_dir, name)
+        try:
+            for target, blob in ((path, data), (path + '.json', meta)):
+                with tempfile.NamedTemporaryFile(dir=self.disk_dir, suffix='.tmp', delete=False) as f:
+                    f.write(blob)
+                os.replace(f.name, target)
+        except OSError as e:
+            print(f"!!! 이미지 디스크 캐시 저장 오류: {e}")
+            return
+        with self._lock:
+            self._disk_size += size - self._disk.pop(name, 0)
+            self._disk[name] = size
+            evicted = []
+            while self._disk_size > self.disk_max_bytes:
+                old_name, old_size = self._disk.popitem(last=False)
+                self._disk_size -= old_size
+                evicted.append(old_name)
+        for old_name in evicted:
+            for suffix in ('', '.json'):
+                try:
+                    os.remove(os.path.join(self.disk_dir, old_name + suffix))
+                except OSError:
+                    pass
+
+    def _store(self, key, entry):
+        if len(entry[0]) > self.max_bytes: return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None: self._size -= len(old[0])
+            self._entries[key] = entry
+            self._size += len(entry[0])
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted[0])
+
+IMAGE_CACHE = ImageCache(IMAGE_CACHE_MAX_BYTES, IMAGE_CACHE_DIR, IMAGE_CACHE_DISK_MAX_BYTES)
+IMAGE_FETCH_EXECUTOR = ThreadPoolExecutor(max_workers=IMAGE_FETCH_WORKERS, thread_name_prefix='image-fetch')
+IMAGE_SESSION = requests.Session()
+IMAGE_SESSION.headers.update({'User-Agent': 'Mozilla/5.0'})
+IMAGE_SESSION.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=IMAGE_FETCH_WORKERS))
+IMAGE_SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=IMAGE_FETCH_WORKERS))
+
+def fetch_image_bytes(image_url_or_id):
+    local = read_imported_image(image_url_or_id)
+    if local is not None: return local
+    key, image_url = resolve_image_source(image_url_or_id)
+    cached = IMAGE_CACHE.get(key)
+    if cached and time.time() - cached[2] < IMAGE_CACHE_TTL:
+        return cached[0]
+    headers = {}
+    if cached and cached[1]: headers['If-None-Match'] = cached[1]
+    timeout = (IMAGE_FETCH_CONNECT_TIMEOUT, IMAGE_FETCH_READ_TIMEOUT)
+    with upstream_call('image'), IMAGE_SESSION.get(image_url, stream=True, headers=headers, timeout=timeout) as response:
+        if response.status_code == 304 and cached:
+            return IMAGE_CACHE.put(key, cached[0], cached[1])[0]
+        response.raise_for_status()
+        content_length = response.headers.get('Content-Length')
+        if content_length and content_length.isdigit() and int(content_length) > IMAGE_MAX_BYTES:
+            raise ValueError(f"이미지 크기 제한 초과 ({int(content_length)} bytes)")
+        buffer = bytearray()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            buffer.extend(chunk)
+            if len(buffer) > IMAGE_MAX_BYTES:
+                raise ValueError(f"이미지 크기 제한 초과 ({IMAGE_MAX_BYTES} bytes)")
+        etag = response.headers.get('ETag')
+    return IMAGE_CACHE.put(key, bytes(buffer), etag)[0]
+
+class ImportedImageStore:
+    # 가져온 .docx 의 이미지 파일. 내용 해시 이름으로 저장하고(같은 이미지는 한 번만) 디스크 LRU(파일 mtime 기준)로 관리한다.
+    # 총 바이트가 max_bytes 를 넘거나 마지막으로 쓴 뒤 ttl 초가 지난 파일부터 지운다. 읽거나 다시 저장하면 mtime 을 갱신한다.
+    def __init__(self, directory, max_bytes, ttl=0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._files = OrderedDict()  # 파일 이름 -> (크기, 마지막 사용 시각)
+        self._size = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        files = []
+        for name in os.listdir(directory):
+            if not IMPORTED_IMAGE_NAME_PATTERN.fullmatch(name): continue
+            try:
+                st = os.stat(os.path.join(directory, name))
+            except OSError:
+                continue
+            files.append((st.st_mtime, name, st.st_size))
+        with self._lock:
+            for mtime, name, size in sorted(files):
+                self._files[name] = (size, mtime)
+                self._size += size
+            evicted = self._evict()
+        self._remove(evicted)
+
+    def put(self, blob, ext):
+        # 파일 이름을 반환
+        name = f"{hashlib.sha256(blob).hexdigest()}.{ext}"
+        if self.path(name) is None:
+            os.makedirs(self.directory, exist_ok=True)  # 임시 디렉터리 정리로 지워졌을 수 있다
+            with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False) as f:
+                f.write(blob)
+            os.replace(f.name, os.path.join(self.directory, name))
+            with self._lock:
+                self._size += len(blob) - self._files.pop(name, (0, 0))[0]
+                self._files[name] = (len(blob), time.time())
+                evicted = self._evict()
+            self._remove(evicted)
+        return name
+
+    def path(self, name):
+        # 있으면 파일 경로, 없거나 기간이 지났으면 None. 다른 프로세스가 저장한 파일도 찾아서 센다.
+        if not IMPORTED_IMAGE_NAME_PATTERN.fullmatch(name): return None
+        path = os.path.join(self.directory, name)
+        now = time.time()
+        with self._lock:
+            entry = self._files.get(name)
+        try:
+            if entry is None:
+                st = os.stat(path)
+                entry = (st.st_size, st.st_mtime)
+            if self.ttl and now - entry[1] > self.ttl:
+                raise FileNotFoundError(path)
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                if name in self._files: self._size -= self._files.pop(name)[0]
+            self._remove([name])
+            return None
+        with self._lock:
+            self._size += entry[0] - self._files.pop(name, (0, 0))[0]
+            self._files[name] = (entry[0], now)
+            evicted = self._evict()
+        self._remove(evicted)
+        return path
+
+    def _evict(self):
+        # lock 을 잡은 채로 부른다. 지울 파일 이름 목록을 반환 (가장 최근 파일 하나는 남긴다).
+        now = time.time()
+        evicted = []
+        while len(self._files) > 1:
+            name, (size, used_at) = next(iter(self._files.items()))
+            if self._size <= self.max_bytes and not (self.ttl and now - used_at > self.ttl): break
+            del self._files[name]
+            self._size -= size
+            evicted.append(name)
+        return evicted
+
+    def _remove(self, names):
+        for name in names:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def stats_snapshot(self):
+        with self._lock:
+            return {"entries": len(self._files), "bytes": self._size}
+
+IMPORTED_IMAGES = ImportedImageStore(IMPORT_IMAGE_DIR, IMPORT_IMAGE_MAX_BYTES, IMPORT_IMAGE_TTL)
+
+def read_imported_image(image_url_or_id):
+    # .../imported-images/<해시>.<확장자> 참조는 이 서버에 파일이 있으면 내려받지 않고 바로 읽는다.
+    match = IMPORTED_IMAGE_REF_PATTERN.search(image_url_or_id)
+    if not match: return None
+    path = IMPORTED_IMAGES.path(match.group(1))
+    if path is None: return None
+    try:
+        with open(path, 'rb') as f: return f.read()
+    except OSError:
+        return None
+
+def collect_image_refs(text_content):
+    refs = []
+    for match in IMAGE_MARKER_PATTERN.finditer(text_content):
+        ref = match.group(1).strip()
+        if ref not in refs: refs.append(ref)
+    return refs
+
+def encode_embedded_image(blob, target_px):
+    # 표시 폭 target_px 에 맞춘 새 이미지 bytes. 이득이 없으면 None (원본 사용).
+    with Image.open(io.BytesIO(blob)) as img:
+        if getattr(img, 'is_animated', False): return None
+        source_format = img.format
+        icc_profile = img.info.get('icc_profile')
+        has_alpha = img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+        if has_alpha:
+            rgba = img.convert('RGBA')
+            has_alpha = rgba.getchannel('A').getextrema()[0] < 255
+        resized = img.width > target_px
+        if resized:
+            out = img.convert('RGBA' if has_alpha else ('RGB' if img.mode not in ('RGB', 'L', 'CMYK') else img.mode))
+            out = out.resize((target_px, max(1, round(img.height * target_px / img.width))), Image.LANCZOS)
+        else:
+            out = img.convert('RGBA' if has_alpha else 'RGB') if img.mode not in ('RGB', 'L', 'CMYK') else img.copy()
+    dpi = (IMAGE_EMBED_DPI, IMAGE_EMBED_DPI)
+    candidates = []
+    if not has_alpha:
+        buf = io.BytesIO()
+        out.save(buf, 'JPEG', quality=IMAGE_JPEG_QUALITY, optimize=True, dpi=dpi, icc_profile=icc_profile)
+        candidates.append(buf.getvalue())
+    if has_alpha or source_format != 'JPEG':
+        # 스크린샷/도형처럼 색이 적은 이미지는 PNG 가 더 작고 선명하다. JPEG 가 절반 이하일 때만 JPEG.
+        buf = io.BytesIO()
+        (out if out.mode != 'CMYK' else out.convert('RGB')).save(buf, 'PNG', optimize=True, dpi=dpi, icc_profile=icc_profile)
+        png = buf.getvalue()
+        if not candidates or len(candidates[0]) * 2 > len(png): candidates = [png]
+    data = candidates[0]
+    # 크기를 줄이지 않은 이미지는 재압축 손실을 감수할 만큼 작아질 때만 교체한다.
+    if len(data) >= len(blob) * (1 if resized else 0.75): return None
+    return data
+
+class EmbeddedImageCache:
+    # (원본 sha1, 목표 px) → 최적화된 docx 이미지. 같은 로고가 반복되면 한 번만 인코딩하고,
+    # 결과 bytes 가 같으므로 패키지에도 이미지 파트 하나로 들어간다 (두 백엔드 모두 sha1 로 중복 제거).
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, image, display_cx):
+        if not IMAGE_OPTIMIZE: return image
+        target_px = max(1, -(-display_cx * IMAGE_EMBED_DPI // 914400))
+        key = (image.sha1, target_px)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key] or image
+        try:
+            data = encode_embedded_image(image.blob, target_px)
+            optimized = DocxImage.from_blob(data) if data is not None else None
+        except Exception as e:
+            print(f"!!! 이미지 최적화 실패, 원본 사용: {e}")
+            optimized = None
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = optimized
+                self.total_bytes += len(optimized.blob) if optimized else 0
+                while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                    _, old = self._entries.popitem(last=False)
+                    self.total_bytes -= len(old.blob) if old else 0
+        return optimized or image
+
+EMBEDDED_IMAGES = EmbeddedImageCache(IMAGE_OPTIMIZE_CACHE_MAX_BYTES)
+
+def picture_extent(image, max_width_emu):
+    # 그림의 표시 크기 (cx, cy) EMU: 원본 폭(96dpi 기준)이 본문 폭보다 넓으면 본문 폭에 맞춘다.
+    if image.px_width * 9525 > max_width_emu:
+        return image.scaled_dimensions(max_width_emu)
+    return image.scaled_dimensions()
+
+def prefetch_images(text_content):
+    # 본문의 모든 {그림:...} 참조를 병렬로 받아 {참조: bytes 또는 Exception} 으로 반환
+    refs = collect_image_refs(text_content)
+    images = {}
+    with timed_stage('prefetch'):
+        futures = {ref: IMAGE_FETCH_EXECUTOR.submit(fetch_image_bytes, ref) for ref in refs}
+        for ref, future in futures.items():
+            try:
+                images[ref] = future.result()
+            except Exception as e:
+                images[ref] = e
+    return images
+
+# ==============================================================================
+# 2.6 사용자 목록 캐시 (/check-user)
+# ==============================================================================
+class UserDirectory:
+    # 시트의 사용자 목록을 (사용자이름, 이메일) → 승인 여부 dict 스냅샷으로 메모리에 둔다.
+    # 갱신은 단일 백그라운드 스레드에서만 하며, 시트가 느리거나 실패하면 마지막 스냅샷으로 응답한다.
+    def __init__(self):
+        self._users = None
+        self._worksheet = None
+        self._pending = None
+        self._watcher = None
+        self._lock = threading.Lock()
+        self._refresher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='user-directory')
+        self.loaded_at = 0.0
+        self.last_modified = None
+        self.last_error = None
+        self.stats = {'hits': 0, 'misses': 0, 'refreshes': 0, 'refresh_errors': 0}
+
+    def _count(self, name):
+        with self._lock: self.stats[name] += 1
+
+    def _modified_time(self):
+        # Drive 메타데이터의 최종 수정 시각 (확인할 수 없으면 None)
+        try:
+            spreadsheet = self._worksheet.spreadsheet
+            getter = getattr(spreadsheet, 'get_lastUpdateTime', None)
+            return SHEETS_UPSTREAM.call(getter or (lambda: spreadsheet.lastUpdateTime))
+        except Exception:
+            return None
+
+    def _load(self):
+        try:
+            if self._worksheet is None:
+                self._worksheet = SHEETS_UPSTREAM.call(
+                    lambda: get_sheet_client().open_by_key(USER_SHEET_KEY).worksheet(USER_SHEET_NAME))
+            modified = self._modified_time()
+            users = {}
+            records = SHEETS_UPSTREAM.call(self._worksheet.get_all_records)
+            for user_record in records:
+                # 시트의 헤더 이름과 정확히 일치해야 함
+                key = (user_record.get('사용자이름'), user_record.get('이메일'))
+                users[key] = users.get(key, False) or str(user_record.get('상태')).strip() == '1'
+        except Exception as e:
+            self._worksheet = None
+            self.last_error = f"{e.__class__.__name__}: {e}"
+            self._count('refresh_errors')
+            print(f"!!! 사용자 목록 갱신 오류: {self.last_error}")
+            raise
+        with self._lock:
+            self._users = users
+            self.loaded_at = time.time()
+            self.last_modified = modified
+            self.last_error = None
+            self.stats['refreshes'] += 1
+        return users
+
+    def refresh(self, wait=None):
+        # 진행 중인 갱신이 있으면 그것을 공유한다. wait 초 안에 끝나지 않으면 TimeoutError.
+        with self._lock:
+            if self._pending is None or self._pending.done():
+                self._pending = self._refresher.submit(self._load)
+            pending = self._pending
+        if wait is not None: pending.result(timeout=wait)
+        return pending
+
+    def _watch(self):
+        while True:
+            time.sleep(USER_DIRECTORY_CHECK_INTERVAL)
+            if self._users is None: continue
+            stale = time.time() - self.loaded_at > USER_DIRECTORY_MAX_AGE
+            if not stale and self._worksheet is not None:
+                modified = self._modified_time()
+                stale = modified is not None and modified != self.last_modified
+            if stale: self.refresh()
+
+    def _ensure_watcher(self):
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name='user-directory-watch', daemon=True)
+                self._watcher.start()
+
+    def is_authorized(self, name, email):
+        self._ensure_watcher()
+        if self._users is None:
+            self.refresh(wait=USER_DIRECTORY_LOAD_TIMEOUT)
+        if self._users.get((name, email), False):
+            self._count('hits')
+            return True
+        self._count('misses')
+        # 방금 시트에 추가된 사용자일 수 있으므로, 스냅샷이 오래됐으면 잠깐 기다리며 다시 읽어 본다.
+        if time.time() - self.loaded_at > USER_DIRECTORY_MISS_REFRESH:
+            try:
+                self.refresh(wait=USER_DIRECTORY_MISS_WAIT)
+            except Exception:
+                pass
+        return self._users.get((name, email), False)
+
+    def stats_snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        stats.update({
+            "loaded": self._users is not None,
+            "users": len(self._users or {}),
+            "age_seconds": round(time.time() - self.loaded_at, 1) if self._users is not None else None,
+            "hit_rate": round(stats['hits'] / lookups, 4) if lookups else None,
+            "last_modified": self.last_modified,
+            "last_error": self.last_error,
+        })
+        return stats
+
+USER_DIRECTORY = UserDirectory()
 
 # ==============================================================================
 # 3. 워드 문서 생성 헬퍼 함수 (변경 없음)
@@ -71,20 +976,6 @@ def create_page_number_field(paragraph, field_text):
     run = paragraph.add_run(); t = docx.oxml.shared.OxmlElement('w:t'); t.text = '1'; run._r.append(t)
     run = paragraph.add_run(); fldChar_end = docx.oxml.shared.OxmlElement('w:fldChar'); fldChar_end.set(docx.oxml.ns.qn('w:fldCharType'), 'end'); run._r.append(fldChar_end)
 
-def set_cell_border(cell, **kwargs):
-    tcPr = cell._tc.get_or_add_tcPr()
-    tcBorders = tcPr.first_child_found_in("w:tcBorders")
-    if tcBorders is None:
-        tcBorders = OxmlElement('w:tcBorders')
-        tcPr.append(tcBorders)
-    for border_name, border_attrs in kwargs.items():
-        for border in tcBorders.findall(qn(f'w:{border_name}')):
-            tcBorders.remove(border)
-        border_element = OxmlElement(f'w:{border_name}')
-        for attr_name, attr_val in border_attrs.items():
-            border_element.set(qn(f'w:{attr_name}'), str(attr_val))
-        tcBorders.append(border_element)
-
 def add_image_border(run, border_width_pt=0, border_color='000000'):
     border_width_emu = int(border_width_pt * 12700)
     r = run._r
@@ -102,35 +993,25 @@ def add_image_border(run, border_width_pt=0, border_color='000000'):
     miter = OxmlElement('a:miter'); miter.set('lim', '800000'); ln.append(miter)
     spPr.append(ln)
 
-def insert_image_to_paragraph(p, image_url_or_id, section):
+def insert_image_to_paragraph(p, image_url_or_id, section, images=None):
     try:
-        drive_match = re.search(r'/file/d/([a-zA-Z0-9_-]+)', image_url_or_id)
-        image_url = f'https://drive.google.com/uc?export=download&id={drive_match.group(1)}' if drive_match else image_url_or_id
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        response = requests.get(image_url, stream=True, headers=headers)
-        response.raise_for_status()
-        image_stream = io.BytesIO(response.content)
-        with Image.open(image_stream) as img:
-            native_width_px, _ = img.size
+        image_data = images.get(image_url_or_id) if images is not None else None
+        if image_data is None: image_data = fetch_image_bytes(image_url_or_id)
+        if isinstance(image_data, Exception): raise image_data
+        with Image.open(io.BytesIO(image_data)):
+            pass  # 이미지가 아니면 run 을 추가하기 전에 여기서 실패한다
         max_width_emu = section.page_width - section.left_margin - section.right_margin
         if p.style.name.startswith('Table'): max_width_emu -= Cm(0.5)
-        native_width_emu = native_width_px * 9525
-        image_stream.seek(0)
         run = p.add_run()
-        if native_width_emu > max_width_emu:
-            run.add_picture(image_stream, width=max_width_emu)
-        else:
-            run.add_picture(image_stream)
+        # 표시 크기는 원본 기준으로 정하고, 삽입하는 bytes 는 그 크기에 맞게 줄인 이미지를 쓴다.
+        image = DocxImage.from_blob(image_data)
+        cx, cy = picture_extent(image, max_width_emu)
+        run.add_picture(io.BytesIO(EMBEDDED_IMAGES.get(image, cx).blob), width=cx, height=cy)
         add_image_border(run)
     except Exception as e:
         p.add_run(f"[이미지 로드 오류: {e}]")
 
-def merge_empty_cells_in_table(table):
-    for row in table.rows:
-        for i in range(len(row.cells) - 1, 0, -1):
-            if row.cells[i].text.strip() == '':
-                left_cell = row.cells[i-1]
-                left_cell.merge(row.cells[i])
+COLUMN_MARKER_PATTERN = re.compile(r'^(.*?)\s*\{([\d]+|-)\}\s*$')
 
 def parse_complex_table_data(raw_lines, num_cols=24):
     final_table_data = []
@@ -139,7 +1020,7 @@ def parse_complex_table_data(raw_lines, num_cols=24):
         segments = line.split('|')
         current_parse_col = 0
         for segment in segments:
-            match = re.search(r'^(.*?)\s*\{([\d]+|-)\}\s*$', segment)
+            match = COLUMN_MARKER_PATTERN.search(segment)
             if match:
                 text_content, col_indicator = match.group(1).strip(), match.group(2)
                 target_col = num_cols - 1 if col_indicator == '-' else int(col_indicator) - 1
@@ -164,7 +1045,278 @@ def generate_dynamic_filename(title):
         filename = f"{title}.docx"
     return filename
 
-def create_word_document(text_content, settings):
+# ==============================================================================
+# 3.1 SaeRo 마크업 파서 (문서 AST)
+# ==============================================================================
+# 마크업을 한 번만 읽어 python-docx 와 무관한 AST 로 변환한다. 태그는 이 단계에서 모두 제거된다.
+TAG_PATTERN = re.compile(r'\{[^}]+\}')
+TABLE_PARAMS_PATTERN = re.compile(r'\{표시작\d([^}]*)\}')
+TABLE_FONT_PARAM_PATTERN = re.compile(r'글꼴=([^,}]*)')
+TABLE_SIZE_PARAM_PATTERN = re.compile(r'크기=([\d.]+)')
+INDENT_TAG_PATTERN = re.compile(r'들여쓰기,1번줄:([0-9]+(?:\.[0-9]+)?),2번줄이하:([0-9]+(?:\.[0-9]+)?)')
+LINE_SPACING_TAG_PATTERN = re.compile(r'(\d+(?:\.\d+)?)줄')
+TITLE_TAG_PATTERN = re.compile(r'제목(\d)\.(\d)')
+FONT_SIZE_TAG_PATTERN = re.compile(r'([\d.]+)pt')
+IMAGE_TAG_PATTERN = re.compile(r'그림:([^}]+)')
+TABLE_END_LINES = ("{표끝1}", "{표끝2}")
+ALIGNMENT_TAGS = {'왼쪽': 'LEFT', '가운데': 'CENTER', '오른쪽': 'RIGHT', '양쪽': 'JUSTIFY', '균등': 'DISTRIBUTE'}
+TITLE_FONT_SIZES = {1: 18, 2: 16, 3: 14}
+TITLE_ALIGNMENTS = {1: 'LEFT', 2: 'CENTER', 3: 'RIGHT'}
+COMPLEX_TABLE_COLS = 24
+
+@dataclass
+class TextRun:
+    text: str
+    bold: bool = False
+    underline: bool = False
+    size: float = None
+
+@dataclass
+class LineBreak:
+    pass
+
+@dataclass
+class InlineImage:
+    ref: str
+
+@dataclass
+class Paragraph:
+    runs: list = field(default_factory=list)
+    alignment: str = None
+    left_indent_cm: float = None
+    first_line_indent_cm: float = None
+    line_spacing: float = None
+
+@dataclass
+class PageBreak:
+    pass
+
+@dataclass
+class TableCell:
+    text: str = ''
+    image: str = None
+    blank: bool = False
+
+@dataclass
+class TableRow:
+    cells: list
+    gray: bool = False
+    navy: bool = False
+
+@dataclass
+class Table:
+    rows: list
+    num_cols: int
+    borderless: bool = False
+    font_name: str = None
+    font_size: float = None
+    header_rows: int = 0
+
+def tokenize_line(line):
+    # 한 줄을 (원문, 태그 본문) 토큰으로 분해한다. 일반 텍스트는 태그 본문이 None.
+    tokens = []
+    pos = 0
+    for match in TAG_PATTERN.finditer(line):
+        if match.start() > pos: tokens.append((line[pos:match.start()], None))
+        tokens.append((match.group(0), match.group(0)[1:-1]))
+        pos = match.end()
+    if pos < len(line): tokens.append((line[pos:], None))
+    return tokens
+
+def parse_paragraph_line(line):
+    tokens = tokenize_line(line)
+    para = Paragraph()
+    alignments = set()
+    title = image = font_size = None
+    for _, tag in tokens:
+        if tag is None: continue
+        if tag in ALIGNMENT_TAGS:
+            alignments.add(ALIGNMENT_TAGS[tag])
+            continue
+        match = INDENT_TAG_PATTERN.fullmatch(tag)
+        if match and para.left_indent_cm is None:
+            first_line_cm, hanging_cm = float(match.group(1)), float(match.group(2))
+            para.left_indent_cm, para.first_line_indent_cm = hanging_cm, first_line_cm - hanging_cm
+            continue
+        match = LINE_SPACING_TAG_PATTERN.fullmatch(tag)
+        if match and para.line_spacing is None:
+            para.line_spacing = float(match.group(1))
+            continue
+        match = TITLE_TAG_PATTERN.fullmatch(tag)
+        if match and title is None:
+            title = (int(match.group(1)), int(match.group(2)))
+            continue
+        match = IMAGE_TAG_PATTERN.fullmatch(tag)
+        if match and image is None:
+            image = match.group(1).strip()
+            continue
+        match = FONT_SIZE_TAG_PATTERN.fullmatch(tag)
+        if match and font_size is None:
+            font_size = float(match.group(1))
+    for alignment in ('LEFT', 'CENTER', 'RIGHT', 'JUSTIFY', 'DISTRIBUTE'):
+        if alignment in alignments:
+            para.alignment = alignment
+            break
+
+    if title:
+        level, align_num = title
+        para.alignment = TITLE_ALIGNMENTS.get(align_num, 'LEFT')
+        clean_line = ''.join(text for text, tag in tokens if tag is None)
+        para.runs.append(TextRun(clean_line, bold=True, size=TITLE_FONT_SIZES.get(level, 12)))
+        return [para]
+    if image:
+        para.runs.append(InlineImage(image))
+        return [para]
+
+    # {>>}/{<<}/{탭}/{줄바꿈}/{문단바꿈} 사이의 구간마다 하나의 run 을 만든다.
+    paragraphs = [para]
+    in_bold_underline = False
+    segment = None
+    for text, tag in tokens + [('', '')]:
+        if tag not in ('>>', '<<', '탭', '줄바꿈', '문단바꿈', ''):
+            if segment is None: segment = []
+            if tag is None: segment.append(text)
+            continue
+        if segment is not None:
+            paragraphs[-1].runs.append(TextRun(''.join(segment), bold=in_bold_underline, underline=in_bold_underline, size=font_size))
+            segment = None
+        if tag == '>>': in_bold_underline = True
+        elif tag == '<<': in_bold_underline = False
+        elif tag == '문단바꿈': paragraphs.append(Paragraph())
+        elif tag == '줄바꿈': paragraphs[-1].runs.append(LineBreak())
+        elif tag == '탭': paragraphs[-1].runs.append(TextRun('\t'))
+    return paragraphs
+
+def parse_table_cell(raw_text):
+    image_match = IMAGE_MARKER_PATTERN.search(raw_text.strip())
+    if image_match:
+        return TableCell(image=image_match.group(1).strip())
+    return TableCell(text=TAG_PATTERN.sub('', raw_text), blank=raw_text.strip() == '')
+
+def parse_table(start_line, table_lines):
+    table = Table(rows=[], num_cols=0)
+    params_match = TABLE_PARAMS_PATTERN.search(start_line)
+    if params_match:
+        params_str = params_match.group(1)
+        if "테두리없음" in params_str: table.borderless = True
+        font_match = TABLE_FONT_PARAM_PATTERN.search(params_str)
+        if font_match: table.font_name = font_match.group(1).strip()
+        size_match = TABLE_SIZE_PARAM_PATTERN.search(params_str)
+        if size_match: table.font_size = float(size_match.group(1).strip())
+    if start_line.strip().startswith("{표시작1"):
+        table_data = [l.split('|') for l in table_lines]
+        table.num_cols = max((len(row) for row in table_data), default=0)
+        for row in table_data:
+            row.extend([''] * (table.num_cols - len(row)))
+    else:
+        table.num_cols = COMPLEX_TABLE_COLS
+        table_data = parse_complex_table_data(table_lines, COMPLEX_TABLE_COLS)
+    for r_idx, row_data in enumerate(table_data):
+        first_cell_text = str(row_data[0]) if row_data else ""
+        table.rows.append(TableRow(cells=[parse_table_cell(str(cell_text)) for cell_text in row_data],
+                                   gray="{회색}" in first_cell_text, navy="{남색}" in first_cell_text))
+        if r_idx < 5 and "{제목행}" in first_cell_text: table.header_rows = r_idx + 1
+    return table
+
+def parse_markup(text_content):
+    nodes = []
+    lines = text_content.split('\n')
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+        if stripped == "{페이지바꿈}":
+            nodes.append(PageBreak())
+        elif stripped.startswith("{표시작1") or stripped.startswith("{표시작2"):
+            table_lines = []
+            i += 1
+            while i < len(lines) and lines[i].strip() not in TABLE_END_LINES:
+                table_lines.append(lines[i])
+                i += 1
+            table = parse_table(line, table_lines)
+            if table.rows and table.num_cols > 0: nodes.append(table)
+        elif not stripped:
+            nodes.append(Paragraph())
+        else:
+            nodes.extend(parse_paragraph_line(line))
+        i += 1
+    return nodes
+
+def iter_markup_segments(lines):
+    # 줄 묶음을 {페이지바꿈} 줄, 표 하나({표시작}~{표끝}), 그 사이의 문단 묶음(최대 DOCX_SEGMENT_MAX_LINES 줄)으로 나눠 차례로 내보낸다.
+    # 파서는 표 밖에서는 줄 단위이므로, 구간별 parse_markup 결과를 이어 붙이면 전체를 한 번에 파싱한 것과 같다.
+    # 줄을 하나씩만 보므로 NDJSON 스트리밍 입력처럼 본문 전체가 메모리에 없어도 된다.
+    current, in_table = [], False
+    for line in lines:
+        stripped = line.strip()
+        if in_table:
+            current.append(line)
+            if stripped in TABLE_END_LINES:
+                yield '\n'.join(current)
+                current, in_table = [], False
+        elif stripped == "{페이지바꿈}" or stripped.startswith("{표시작1") or stripped.startswith("{표시작2"):
+            if current: yield '\n'.join(current)
+            current = [line]
+            if stripped == "{페이지바꿈}":
+                yield line
+                current = []
+            else:
+                in_table = True
+        else:
+            current.append(line)
+            if len(current) >= DOCX_SEGMENT_MAX_LINES:
+                yield '\n'.join(current)
+                current = []
+    if current: yield '\n'.join(current)
+
+def split_markup_segments(text_content):
+    return list(iter_markup_segments(text_content.split('\n')))
+
+# ==============================================================================
+# 3.2 문서 AST → python-docx 렌더러
+# ==============================================================================
+ALIGNMENT_VALUES = {
+    'LEFT': WD_ALIGN_PARAGRAPH.LEFT, 'CENTER': WD_ALIGN_PARAGRAPH.CENTER, 'RIGHT': WD_ALIGN_PARAGRAPH.RIGHT,
+    'JUSTIFY': WD_ALIGN_PARAGRAPH.JUSTIFY, 'DISTRIBUTE': WD_ALIGN_PARAGRAPH.DISTRIBUTE,
+}
+
+def render_paragraph(doc, section, node, images):
+    p = doc.add_paragraph()
+    para_format = p.paragraph_format
+    if node.alignment: para_format.alignment = ALIGNMENT_VALUES[node.alignment]
+    if node.left_indent_cm is not None:
+        para_format.left_indent = Cm(node.left_indent_cm)
+        para_format.first_line_indent = Cm(node.first_line_indent_cm)
+    if node.line_spacing is not None: para_format.line_spacing = node.line_spacing
+    for item in node.runs:
+        if isinstance(item, InlineImage):
+            insert_image_to_paragraph(p, item.ref, section, images)
+        elif isinstance(item, LineBreak):
+            p.add_run().add_break(WD_BREAK.LINE)
+        else:
+            run = p.add_run(item.text)
+            if item.bold: run.font.bold = True
+            if item.underline: run.font.underline = True
+            if item.size: run.font.size = Pt(item.size)
+
+def render_table(doc, section, node, images):
+    layout = table_layout_for(doc, section)
+    pictures = DocumentPictures(doc.part, images, layout.block_width)
+    xml = table_xml(node, plan_table(node, layout, pictures), layout)
+    doc.element.body._insert_tbl(parse_xml(xml.replace('<w:tbl>', f'<w:tbl {nsdecls("w", "wp", "r")}>', 1)))
+
+def report_progress(progress, done, total):
+    # progress(0~1) 콜백은 PROGRESS_REPORT_EVERY 노드마다 한 번 호출된다.
+    if progress and done % PROGRESS_REPORT_EVERY == 0: progress(done / total)
+
+def render_nodes(doc, section, nodes, images, progress=None):
+    for idx, node in enumerate(nodes):
+        report_progress(progress, idx, len(nodes))
+        if isinstance(node, PageBreak): doc.add_page_break()
+        elif isinstance(node, Table): render_table(doc, section, node, images)
+        else: render_paragraph(doc, section, node, images)
+
+def create_base_document(settings):
     doc = Document()
     style = doc.styles['Normal']
     font = style.font
@@ -200,179 +1352,1608 @@ def create_word_document(text_content, settings):
     section.bottom_margin = Cm(settings.get('margin_bottom', 2.0))
     section.left_margin = Cm(settings.get('margin_left', 2.5))
     section.right_margin = Cm(settings.get('margin_right', 2.5))
+    return doc, section
 
-    lines = text_content.split('\n')
-    i = 0
-    while i < len(lines):
-        line = lines[i]
-        if line.strip() == "{페이지바꿈}":
-            doc.add_page_break()
-            i += 1
-            continue
-        table_type = None
-        if line.strip().startswith("{표시작1"):
-            table_type = "simple"
-        elif line.strip().startswith("{표시작2"):
-            table_type = "complex"
-        if table_type:
-            table_settings = {}
-            match = re.search(r'\{표시작\d([^}]*)\}', line)
-            if match:
-                params_str = match.group(1)
-                if "테두리없음" in params_str: table_settings['borderless'] = True
-                font_match = re.search(r'글꼴=([^,}]*)', params_str)
-                if font_match: table_settings['font_name'] = font_match.group(1).strip()
-                size_match = re.search(r'크기=([\d.]+)', params_str)
-                if size_match: table_settings['font_size'] = float(size_match.group(1).strip())
-            table_lines = []
-            i += 1
-            while i < len(lines) and not (lines[i].strip() == "{표끝1}" or lines[i].strip() == "{표끝2}"):
-                table_lines.append(lines[i])
-                i += 1
-            table_data = []
-            num_cols = 0
-            if table_type == "simple":
-                table_data = [l.split('|') for l in table_lines]
-                if table_data:
-                    num_cols = max(len(row) for row in table_data) if table_data else 0
-                for row in table_data:
-                    row.extend([''] * (num_cols - len(row)))
-            elif table_type == "complex":
-                num_cols = 24
-                table_data = parse_complex_table_data(table_lines, num_cols)
-            if len(table_data) > 0 and num_cols > 0:
-                table = doc.add_table(rows=len(table_data), cols=num_cols)
-                table.style = 'Table Grid'
-                for r_idx, row_data in enumerate(table_data):
-                    row_cells = table.rows[r_idx].cells
-                    first_cell_text = str(row_data[0]) if row_data else ""
-                    for c_idx, cell_text in enumerate(row_data):
-                        if c_idx < len(row_cells):
-                            cell = row_cells[c_idx]
-                            cell_p = cell.paragraphs[0]
-                            if not table_settings.get('borderless'):
-                                cell_p.paragraph_format.space_after = Pt(0)
-                                cell_p.paragraph_format.line_spacing = 1.5
-                            cell_p.clear()
-                            image_match_in_cell = re.search(r'\{그림:([^}]+)\}', cell_text.strip())
-                            if image_match_in_cell:
-                                image_url_or_id = image_match_in_cell.group(1).strip()
-                                cell_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                                cell.vertical_alignment = docx.enum.table.WD_ALIGN_VERTICAL.CENTER
-                                insert_image_to_paragraph(cell_p, image_url_or_id, section)
-                            else:
-                                run = cell_p.add_run(str(cell_text))
-                                if not table_settings.get('borderless'):
-                                    run.font.name = doc.styles['Normal'].font.name
-                                    run.font.size = Pt(10)
-                                    run._r.rPr.rFonts.set(qn('w:eastAsia'), doc.styles['Normal'].element.rPr.rFonts.get(qn('w:eastAsia')))
-                    if "{회색}" in first_cell_text:
-                        for cell in row_cells:
-                            shd = OxmlElement('w:shd'); shd.set(qn('w:fill'), 'D9D9D9'); cell._tc.get_or_add_tcPr().append(shd)
-                            for para in cell.paragraphs:
-                                for run in para.runs: run.font.bold = True
-                    if "{남색}" in first_cell_text:
-                        for cell in row_cells:
-                            shd = OxmlElement('w:shd'); shd.set(qn('w:fill'), '000080'); cell._tc.get_or_add_tcPr().append(shd)
-                            for para in cell.paragraphs:
-                                for run in para.runs: run.font.bold = True; run.font.color.rgb = RGBColor.from_string('FFFFFF')
-                        for idx in range(len(row_cells) - 1):
-                            left_cell, right_cell = row_cells[idx], row_cells[idx + 1]
-                            set_cell_border(left_cell, right={'val': 'single', 'sz': '4', 'color': 'FFFFFF'})
-                            set_cell_border(right_cell, left={'val': 'single', 'sz': '4', 'color': 'FFFFFF'})
-                if table_settings.get('borderless'):
-                    border_attrs = {"val": "nil"}
-                    for row in table.rows:
-                        for cell in row.cells: set_cell_border(cell, top=border_attrs, bottom=border_attrs, left=border_attrs, right=border_attrs)
-                merge_empty_cells_in_table(table)
-                header_count = 0
-                for idx in range(min(5, len(table.rows))):
-                    if "{제목행}" in table.rows[idx].cells[0].text: header_count = idx + 1
-                if header_count:
-                    for idx in range(header_count):
-                        tr = table.rows[idx]._tr
-                        trPr = tr.get_or_add_trPr()
-                        tblHeader = OxmlElement('w:tblHeader'); trPr.append(tblHeader)
-            i += 1
-            continue
-        if not line.strip():
-            doc.add_paragraph()
-            i += 1
-            continue
-        p = doc.add_paragraph()
-        para_format = p.paragraph_format
-        if "{왼쪽}" in line: para_format.alignment = WD_ALIGN_PARAGRAPH.LEFT
-        elif "{가운데}" in line: para_format.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        elif "{오른쪽}" in line: para_format.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-        elif "{양쪽}" in line: para_format.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-        elif "{균등}" in line: para_format.alignment = WD_ALIGN_PARAGRAPH.DISTRIBUTE
-        indent_match = re.search(r'\{들여쓰기,1번줄:([0-9]+(?:\.[0-9]+)?),2번줄이하:([0-9]+(?:\.[0-9]+)?)\}', line)
-        if indent_match:
-            first_line_cm = float(indent_match.group(1))
-            hanging_cm = float(indent_match.group(2))
-            para_format.left_indent = Cm(hanging_cm)
-            para_format.first_line_indent = Cm(first_line_cm - hanging_cm)
-        line_spacing_match = re.search(r'\{(\d+(?:\.\d+)?)줄\}', line)
-        if line_spacing_match:
-            para_format.line_spacing = float(line_spacing_match.group(1))
-        title_match = re.search(r'\{제목(\d)\.(\d)\}', line)
-        image_match = re.search(r'\{그림:([^}]+)\}', line)
-        if title_match:
-            level, align_num = int(title_match.group(1)), int(title_match.group(2))
-            font_sizes = {1: 18, 2: 16, 3: 14}; alignments = {1: WD_ALIGN_PARAGRAPH.LEFT, 2: WD_ALIGN_PARAGRAPH.CENTER, 3: WD_ALIGN_PARAGRAPH.RIGHT}
-            clean_line = re.sub(r'\{[^}]+\}', '', line); run = p.add_run(clean_line); run.bold = True
-            run.font.size = Pt(font_sizes.get(level, 12)); para_format.alignment = alignments.get(align_num, WD_ALIGN_PARAGRAPH.LEFT)
-        elif image_match:
-            image_url_or_id = image_match.group(1).strip()
-            p.clear()
-            insert_image_to_paragraph(p, image_url_or_id, section)
+# ==============================================================================
+# 3.3 표/그림 XML 빌더 (두 출력 백엔드 공용)
+# ==============================================================================
+# 표는 최종 격자(gridSpan 병합, 음영, 테두리, 제목행)를 먼저 순수 파이썬 데이터로 계산한 뒤
+# w:tbl 하나를 한 번에 직렬화한다. 셀 수에 비례하는 비용으로 만들어지며, 결과 XML 은
+# python-docx 로 셀을 하나씩 채우고 병합하던 방식과 동일하다.
+XML_INVALID_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+RUN_SPECIAL_CHARS = re.compile(r'([\t\r\n])')
+PICTURE_XML = (
+    '<w:drawing><wp:inline xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+    'xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture"><wp:extent cx="{cx}" cy="{cy}"/>'
+    '<wp:docPr id="{shape_id}" name="Picture {shape_id}"/><wp:cNvGraphicFramePr><a:graphicFrameLocks noChangeAspect="1"/>'
+    '</wp:cNvGraphicFramePr><a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+    '<pic:pic><pic:nvPicPr><pic:cNvPr id="0" name="{filename}"/><pic:cNvPicPr/></pic:nvPicPr><pic:blipFill>'
+    '<a:blip r:embed="{rId}"/><a:stretch><a:fillRect/></a:stretch></pic:blipFill><pic:spPr><a:xfrm><a:off x="0" y="0"/>'
+    '<a:ext cx="{cx}" cy="{cy}"/></a:xfrm><a:prstGeom prst="rect"/><a:ln w="0" cap="flat" cmpd="sng"><a:solidFill>'
+    '<a:srgbClr val="000000"/></a:solidFill><a:prstDash val="solid"/><a:miter lim="800000"/></a:ln></pic:spPr></pic:pic>'
+    '</a:graphicData></a:graphic></wp:inline></w:drawing>'
+)
+CELL_SPACING_XML = '<w:spacing w:after="0" w:line="360" w:lineRule="auto"/>'
+NAVY_BORDER = 'w:val="single" w:sz="4" w:color="FFFFFF"'
+# gridSpan 은 python-docx 와 같은 규칙으로, 아래 순서로 처음 발견되는 요소 앞에 들어간다.
+GRID_SPAN_SUCCESSORS = ('hMerge', 'vMerge', 'tcBorders', 'shd', 'noWrap', 'tcMar', 'textDirection', 'tcFitText', 'vAlign', 'hideMark')
+
+def xml_text(value):
+    if XML_INVALID_CHARS.search(value):
+        raise ValueError("All strings must be XML compatible: Unicode or ASCII, no NULL bytes or control characters")
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def xml_attr(value):
+    return xml_text(value).replace('"', '&quot;').replace('\t', '&#9;').replace('\n', '&#10;').replace('\r', '&#13;')
+
+def twips(length):
+    return Emu(length).twips
+
+def run_xml(text='', bold=False, color=None, size=None, underline=False, font=None, content=None):
+    rpr = ''
+    if font: rpr += f'<w:rFonts w:ascii="{xml_attr(font[0])}" w:hAnsi="{xml_attr(font[0])}" w:eastAsia="{xml_attr(font[1])}"/>'
+    if bold: rpr += '<w:b/>'
+    if color: rpr += f'<w:color w:val="{color}"/>'
+    if size: rpr += f'<w:sz w:val="{int(Pt(size).pt * 2)}"/>'
+    if underline: rpr += '<w:u w:val="single"/>'
+    if content is None:
+        content = ''
+        for piece in RUN_SPECIAL_CHARS.split(text):
+            if piece == '\t': content += '<w:tab/>'
+            elif piece in ('\r', '\n'): content += '<w:br/>'
+            elif piece:
+                preserve = ' xml:space="preserve"' if len(piece.strip()) < len(piece) else ''
+                content += f'<w:t{preserve}>{xml_text(piece)}</w:t>'
+    if rpr: rpr = f'<w:rPr>{rpr}</w:rPr>'
+    if not rpr and not content: return '<w:r/>'
+    return f'<w:r>{rpr}{content}</w:r>'
+
+def paragraph_xml(runs, ppr=''):
+    if ppr: ppr = f'<w:pPr>{ppr}</w:pPr>'
+    if not ppr and not runs: return '<w:p/>'
+    return f'<w:p>{ppr}{"".join(runs)}</w:p>'
+
+@dataclass
+class TableLayout:
+    block_width: int
+    font_name: str
+    east_asia_font: str
+    table_style_id: str
+
+def table_layout_for(doc, section):
+    normal = doc.styles['Normal']
+    return TableLayout(block_width=Emu(section.page_width - section.left_margin - section.right_margin),
+                       font_name=normal.font.name, east_asia_font=normal.element.rPr.rFonts.get(qn('w:eastAsia')),
+                       table_style_id=doc.styles['Table Grid'].style_id)
+
+class PictureRuns:
+    # {그림:...} 참조를 그림 run XML 로 만든다. 이미지 파트 연결(relate_image)은 백엔드별로 구현한다.
+    def __init__(self, images, max_width_emu, first_shape_id):
+        self.images = images
+        self.max_width_emu = max_width_emu
+        self.next_shape_id = first_shape_id
+        self._pictures = {}
+
+    def relate_image(self, image):
+        raise NotImplementedError
+
+    def allocate_shape_id(self):
+        shape_id = self.next_shape_id
+        self.next_shape_id += 1
+        return shape_id
+
+    def _load_picture(self, ref):
+        # (docx 이미지, 원본 가로 px, None) 또는 실패 시 (None, 빈 run 선행 여부, 예외)
+        if ref in self._pictures: return self._pictures[ref]
+        image_data = self.images.get(ref) if self.images is not None else None
+        try:
+            if image_data is None: image_data = fetch_image_bytes(ref)
+            if isinstance(image_data, Exception): raise image_data
+            with Image.open(io.BytesIO(image_data)) as img:
+                native_width_px, _ = img.size
+        except Exception as e:
+            result = (None, False, e)
         else:
-            font_size_match = re.search(r'\{([\d.]+)pt\}', line)
-            tokens = re.split(r'(\{>>\}|\{<<\}|\{탭\}|\{줄바꿈\}|\{문단바꿈\})', line)
-            in_bold_underline = False
-            for token in tokens:
-                if not token: continue
-                if token == '{>>}': in_bold_underline = True
-                elif token == '{<<}': in_bold_underline = False
-                elif token == '{문단바꿈}': p = doc.add_paragraph()
-                elif token == '{줄바꿈}': p.add_run().add_break(WD_BREAK.LINE)
-                elif token == '{탭}': p.add_run('\t')
-                else:
-                    clean_token = re.sub(r'\{[^}]+\}', '', token)
-                    run = p.add_run(clean_token)
-                    if in_bold_underline: run.font.bold = True; run.font.underline = True
-                    if font_size_match: run.font.size = Pt(float(font_size_match.group(1)))
-        i += 1
-    # 최종 후처리
-    for table in doc.tables:
-        for c in table._tbl.tblPr.getchildren():
-            if c.tag.endswith('tblLayout'): table._tbl.tblPr.remove(c)
-        tbl_layout = OxmlElement('w:tblLayout'); tbl_layout.set(qn('w:type'), 'fixed'); table._tbl.tblPr.append(tbl_layout)
-        tbl_w = OxmlElement('w:tblW'); tbl_w.set(qn('w:w'), '5000'); tbl_w.set(qn('w:type'), 'pct'); table._tbl.tblPr.append(tbl_w)
-    for paragraph in doc.paragraphs:
-        for run in paragraph.runs:
-            if run.element.find(qn('w:br')) is not None and run.element.find(qn('w:br')).get(qn('w:type')) == 'page': continue
-            if run.element.find(qn('w:drawing')) is not None: continue
-            run.text = re.sub(r'\{[^}]+\}', '', run.text)
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                for paragraph in cell.paragraphs:
-                    for run in paragraph.runs:
-                        if run.element.find(qn('w:drawing')) is not None: continue
-                        run.text = re.sub(r'\{[^}]+\}', '', run.text)
+            try:
+                result = (DocxImage.from_blob(image_data), native_width_px, None)
+            except Exception as e:
+                # insert_image_to_paragraph 는 빈 run 을 추가한 뒤 add_picture 에서 실패한다.
+                result = (None, True, e)
+        self._pictures[ref] = result
+        return result
+
+    def __call__(self, ref, bold=False, color=None):
+        # (run XML 목록, 그림 삽입 성공 여부)
+        image, native_width_px, error = self._load_picture(ref)
+        if image is None:
+            runs = [run_xml(bold=bold, color=color)] if native_width_px else []
+            runs.append(run_xml(f"[이미지 로드 오류: {error}]", bold=bold, color=color))
+            return runs, False
+        cx, cy = picture_extent(image, self.max_width_emu)
+        image = EMBEDDED_IMAGES.get(image, cx)
+        rId = self.relate_image(image)
+        shape_id = self.allocate_shape_id()
+        drawing = PICTURE_XML.format(cx=cx, cy=cy, shape_id=shape_id, filename=xml_attr(image.filename), rId=rId)
+        return [run_xml(bold=bold, color=color, content=drawing)], True
+
+class DocumentPictures(PictureRuns):
+    # python-docx 문서 파트에 이미지를 연결한다 (python-docx 백엔드에서 표를 한 번에 만들 때 사용).
+    def __init__(self, part, images, max_width_emu):
+        super().__init__(images, max_width_emu, part.next_id)
+        self.part = part
+
+    def relate_image(self, image):
+        rId, _ = self.part.get_or_add_image(io.BytesIO(image.blob))
+        return rId
+
+@dataclass
+class CellPlan:
+    span: int
+    paragraphs: list
+    properties: list = field(default_factory=list)  # tcW 뒤에 올 (태그, XML) 목록
+
+@dataclass
+class RowPlan:
+    cells: list
+    header: bool = False
+
+def plan_table(node, layout, pictures):
+    cell_font = None if node.borderless else (layout.font_name, layout.east_asia_font)
+    spacing = '' if node.borderless else CELL_SPACING_XML
+    size = None if node.borderless else 10
+    rows = []
+    for r_idx, row in enumerate(node.rows):
+        bold = row.gray or row.navy
+        color = 'FFFFFF' if row.navy else None
+        last = len(row.cells) - 1
+        cells = []
+        for c_idx, cell in enumerate(row.cells):
+            properties = []
+            if cell.image:
+                runs, blank = pictures(cell.image, bold, color)
+                properties.append(('vAlign', '<w:vAlign w:val="center"/>'))
+                paragraph = paragraph_xml(runs, spacing + '<w:jc w:val="center"/>')
+            else:
+                paragraph = paragraph_xml([run_xml(cell.text, bold=bold, color=color, size=size, font=cell_font)], spacing)
+                blank = cell.blank
+            if row.gray: properties.append(('shd', '<w:shd w:fill="D9D9D9"/>'))
+            if row.navy: properties.append(('shd', '<w:shd w:fill="000080"/>'))
+            borders = {}
+            if row.navy:
+                if c_idx > 0: borders['left'] = f'<w:left {NAVY_BORDER}/>'
+                if c_idx < last: borders['right'] = f'<w:right {NAVY_BORDER}/>'
+            if node.borderless:
+                for name in ('top', 'bottom', 'left', 'right'):
+                    borders.pop(name, None)
+                    borders[name] = f'<w:{name} w:val="nil"/>'
+            if borders: properties.append(('tcBorders', f'<w:tcBorders>{"".join(borders.values())}</w:tcBorders>'))
+            # 빈 셀은 왼쪽 셀에 병합된다 (첫 셀은 항상 병합 시작점).
+            if c_idx > 0 and blank:
+                cells[-1].span += 1
+                cells[-1].paragraphs.append(paragraph)
+            else:
+                cells.append(CellPlan(span=1, paragraphs=[paragraph], properties=properties))
+        rows.append(RowPlan(cells=cells, header=r_idx < node.header_rows))
+    return rows
+
+def table_xml(node, rows, layout):
+    col_twips = twips(Emu(layout.block_width // node.num_cols))
+    parts = [f'<w:tbl><w:tblPr><w:tblStyle w:val="{xml_attr(layout.table_style_id)}"/><w:tblW w:type="auto" w:w="0"/>'
+             '<w:tblLook w:firstColumn="1" w:firstRow="1" w:lastColumn="0" w:lastRow="0" w:noHBand="0" w:noVBand="1" w:val="04A0"/>'
+             '<w:tblLayout w:type="fixed"/><w:tblW w:w="5000" w:type="pct"/></w:tblPr><w:tblGrid>',
+             f'<w:gridCol w:w="{col_twips}"/>' * node.num_cols, '</w:tblGrid>']
+    for row in rows:
+        parts.append('<w:tr><w:trPr><w:tblHeader/></w:trPr>' if row.header else '<w:tr>')
+        for cell in row.cells:
+            properties = cell.properties
+            if cell.span > 1:
+                tags = [tag for tag, _ in properties]
+                position = next((tags.index(tag) for tag in GRID_SPAN_SUCCESSORS if tag in tags), len(tags))
+                properties = properties[:position] + [('gridSpan', f'<w:gridSpan w:val="{cell.span}"/>')] + properties[position:]
+            parts.append(f'<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="{col_twips * cell.span}"/>{"".join(xml for _, xml in properties)}</w:tcPr>')
+            parts.extend(cell.paragraphs)
+            parts.append('</w:tc>')
+        parts.append('</w:tr>')
+    parts.append('</w:tbl>')
+    return ''.join(parts)
+
+# ==============================================================================
+# 3.4 WordprocessingML 직접 출력 백엔드 (settings['docx_writer'] == 'stream')
+# ==============================================================================
+# 스타일/설정/바닥글 등은 설정별로 한 번 만든 기본 템플릿을 재사용하고, document.xml 본문은
+# python-docx 프록시 객체 없이 문자열로 직렬화해 zip 스트림에 바로 쓴다.
+# 출력 XML 은 python-docx 렌더러(3.2)와 동일하도록 맞춰져 있다.
+TEMPLATE_SETTING_KEYS = ('font_family_east_asia', 'font_size', 'line_spacing', 'para_spacing_after', 'page_orientation',
+                         'margin_top', 'margin_bottom', 'margin_left', 'margin_right')
+DEFAULT_PATTERN = re.compile(r'<Default Extension="([^"]+)" ContentType="([^"]+)"/>')
+OVERRIDE_PATTERN = re.compile(r'<Override PartName="([^"]+)" ContentType="([^"]+)"/>')
+JC_VALUES = {'LEFT': 'left', 'CENTER': 'center', 'RIGHT': 'right', 'JUSTIFY': 'both', 'DISTRIBUTE': 'distribute'}
+RT_IMAGE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image'
+STREAM_FLUSH_BYTES = 64 * 1024
+
+def docx_template_key(settings):
+    return json.dumps([settings.get(k) for k in TEMPLATE_SETTING_KEYS], ensure_ascii=False)
+
+class DocxTemplate:
+    # 설정별 기본 문서 패키지. document.xml 본문을 제외한 모든 파트를 바이트로 보관한다.
+    def __init__(self, settings):
+        self.key = docx_template_key(settings)
+        doc, section = create_base_document(settings)
+        buffer = io.BytesIO()
+        doc.save(buffer)
+        with zipfile.ZipFile(buffer) as zf:
+            self.parts = {info.filename: zf.read(info) for info in zf.infolist()}
+        document_xml = self.parts.pop('word/document.xml')
+        split = document_xml.rindex(b'<w:sectPr')
+        self.document_prefix, self.document_suffix = document_xml[:split], document_xml[split:]
+        self.rels_xml = self.parts.pop('word/_rels/document.xml.rels').decode('utf-8')
+        self.rel_ids = set(re.findall(r'Id="(rId\d+)"', self.rels_xml))
+        content_types = self.parts.pop('[Content_Types].xml').decode('utf-8')
+        self.content_defaults = dict(DEFAULT_PATTERN.findall(content_types))
+        self.content_overrides = dict(OVERRIDE_PATTERN.findall(content_types))
+        used_ids = [int(v) for v in re.findall(rb'\sid="(\d+)"', document_xml)]
+        self.first_shape_id = max(used_ids) + 1 if used_ids else 1
+        self.layout = table_layout_for(doc, section)
+
+DOCX_TEMPLATE_CACHE = OrderedDict()
+DOCX_TEMPLATE_LOCK = threading.Lock()
+
+def get_docx_template(settings):
+    key = docx_template_key(settings)
+    with DOCX_TEMPLATE_LOCK:
+        template = DOCX_TEMPLATE_CACHE.get(key)
+        if template is not None:
+            DOCX_TEMPLATE_CACHE.move_to_end(key)
+            return template
+    template = DocxTemplate(settings)
+    with DOCX_TEMPLATE_LOCK:
+        DOCX_TEMPLATE_CACHE[key] = template
+        while len(DOCX_TEMPLATE_CACHE) > DOCX_TEMPLATE_CACHE_SIZE:
+            DOCX_TEMPLATE_CACHE.popitem(last=False)
+    return template
+
+class PackagePictures(PictureRuns):
+    # 스트림 백엔드용: 이미지 파트와 관계(rId)를 직접 관리한다.
+    def __init__(self, template, images):
+        super().__init__(images, template.layout.block_width, template.first_shape_id)
+        self.media = OrderedDict()  # sha1 -> (rId, partname, content_type, blob)
+        self.rel_ids = set(template.rel_ids)
+
+    def relate_image(self, image):
+        entry = self.media.get(image.sha1)
+        if entry is None:
+            n = 1
+            while f"rId{n}" in self.rel_ids: n += 1
+            rId = f"rId{n}"
+            self.rel_ids.add(rId)
+            entry = (rId, f"word/media/image{len(self.media) + 1}.{image.ext}", image.content_type, image.blob)
+            self.media[image.sha1] = entry
+        return entry[0]
+
+class SegmentPictures(PictureRuns):
+    # 구간 조각용: rId 와 그림 id 를 자리표시자로 남기고, 사용한 이미지를 호출 순서대로 기록한다.
+    # 문서에 이어 붙일 때(DocxStreamWriter.stitch) 실제 값으로 바꾼다. (\x00 은 본문 XML 에 나올 수 없다)
+    def __init__(self, images, max_width_emu):
+        super().__init__(images, max_width_emu, 0)
+        self.placed = []
+
+    def relate_image(self, image):
+        self.placed.append(image)
+        return f"\x00R{len(self.placed) - 1}\x00"
+
+    def allocate_shape_id(self):
+        return f"\x00S{len(self.placed) - 1}\x00"
+
+SEGMENT_PLACEHOLDER_PATTERN = re.compile('\x00([RS])(\\d+)\x00')
+
+class SegmentCache:
+    # 구간 해시 → (본문 XML 조각, 사용한 이미지 목록). 총 바이트 기준 LRU.
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    @staticmethod
+    def entry_size(fragment):
+        xml, placed = fragment
+        return len(xml) + sum(len(image.blob) for image in placed)
+
+    def get(self, key):
+        with self._lock:
+            fragment = self._entries.get(key)
+            if fragment is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return fragment
+
+    def put(self, key, fragment):
+        size = self.entry_size(fragment)
+        if size > self.max_bytes: return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None: self._size -= self.entry_size(old)
+            self._entries[key] = fragment
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= self.entry_size(evicted)
+
+    def stats_snapshot(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), bytes=self._size)
+
+DOCX_SEGMENT_CACHE = SegmentCache(DOCX_SEGMENT_CACHE_MAX_BYTES)
+
+class DocxStreamWriter:
+    def __init__(self, template, images):
+        self.template = template
+        self.pictures = PackagePictures(template, images)
+        self.media = self.pictures.media
+
+    def paragraph_xml(self, node, pictures=None):
+        pictures = pictures or self.pictures
+        ppr = ''
+        if node.line_spacing is not None:
+            ppr += f'<w:spacing w:line="{twips(Emu(node.line_spacing * Twips(240)))}" w:lineRule="auto"/>'
+        if node.left_indent_cm is not None:
+            first_line = Cm(node.first_line_indent_cm)
+            first_attr = f'w:hanging="{twips(-first_line)}"' if first_line < 0 else f'w:firstLine="{twips(first_line)}"'
+            ppr += f'<w:ind w:left="{twips(Cm(node.left_indent_cm))}" {first_attr}/>'
+        if node.alignment: ppr += f'<w:jc w:val="{JC_VALUES[node.alignment]}"/>'
+        runs = []
+        for item in node.runs:
+            if isinstance(item, InlineImage): runs.extend(pictures(item.ref)[0])
+            elif isinstance(item, LineBreak): runs.append('<w:r><w:br/></w:r>')
+            else: runs.append(run_xml(item.text, bold=item.bold, underline=item.underline, size=item.size))
+        return paragraph_xml(runs, ppr)
+
+    def node_xml(self, node, pictures=None):
+        pictures = pictures or self.pictures
+        if isinstance(node, PageBreak): return '<w:p><w:r><w:br w:type="page"/></w:r></w:p>'
+        if isinstance(node, Table):
+            layout = self.template.layout
+            return table_xml(node, plan_table(node, layout, pictures), layout)
+        return self.paragraph_xml(node, pictures)
+
+    def segment_key(self, segment):
+        # 설정(템플릿) + 이미지 최적화 설정 + 구간 본문 + 구간이 쓰는 이미지 내용의 해시. 이미지 실패 구간은 캐시하지 않는다.
+        digest = hashlib.sha256(json.dumps([self.template.key, IMAGE_OPTIMIZE, IMAGE_EMBED_DPI, IMAGE_JPEG_QUALITY, segment],
+                                           ensure_ascii=False).encode('utf-8'))
+        for ref in collect_image_refs(segment):
+            data = self.pictures.images.get(ref) if self.pictures.images is not None else None
+            if data is None or isinstance(data, Exception): return None
+            digest.update(f"\0{ref}\0{hashlib.sha1(data).hexdigest()}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def segment_fragment(self, segment):
+        key = self.segment_key(segment)
+        fragment = DOCX_SEGMENT_CACHE.get(key) if key is not None else None
+        if fragment is None:
+            pictures = SegmentPictures(self.pictures.images, self.pictures.max_width_emu)
+            fragment = (''.join(self.node_xml(node, pictures) for node in parse_markup(segment)), pictures.placed)
+            if key is not None: DOCX_SEGMENT_CACHE.put(key, fragment)
+        return fragment
+
+    def stitch(self, fragment):
+        # 조각의 자리표시자를 이 문서의 rId / 그림 id 로 바꾼다. 전체를 한 번에 만들 때와 같은 순서로 할당한다.
+        xml, placed = fragment
+        if not placed: return xml
+        ids = []
+        for image in placed:
+            rId = self.pictures.relate_image(image)
+            ids.append((rId, self.pictures.allocate_shape_id()))
+        return SEGMENT_PLACEHOLDER_PATTERN.sub(lambda m: str(ids[int(m.group(2))][m.group(1) == 'S']), xml)
+
+    def rels_xml(self):
+        rels = ''.join(f'<Relationship Id="{rId}" Type="{RT_IMAGE}" Target="{partname[len("word/"):]}"/>'
+                       for rId, partname, _, _ in self.media.values())
+        return self.template.rels_xml.replace('</Relationships>', rels + '</Relationships>')
+
+    def content_types_xml(self):
+        defaults = dict(self.template.content_defaults)
+        overrides = dict(self.template.content_overrides)
+        for _, partname, content_type, _ in self.media.values():
+            ext = partname.rsplit('.', 1)[1]
+            if (ext.lower(), content_type) in default_content_types: defaults[ext] = content_type
+            else: overrides['/' + partname] = content_type
+        return ("<?xml version='1.0' encoding='UTF-8' standalone='yes'?>\n"
+                '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                + ''.join(f'<Default Extension="{ext}" ContentType="{defaults[ext]}"/>' for ext in sorted(defaults))
+                + ''.join(f'<Override PartName="{name}" ContentType="{overrides[name]}"/>' for name in sorted(overrides))
+                + '</Types>')
+
+    def write(self, nodes, file_stream, progress=None):
+        return self.write_fragments((self.node_xml(node) for node in nodes), len(nodes), file_stream, progress)
+
+    def write_segments(self, text_content, file_stream, progress=None):
+        segments = split_markup_segments(text_content)
+        return self.write_fragments((self.stitch(self.segment_fragment(segment)) for segment in segments),
+                                    len(segments), file_stream, progress)
+
+    def write_fragments(self, fragments, total, file_stream, progress=None):
+        with zipfile.ZipFile(file_stream, 'w', zipfile.ZIP_DEFLATED) as zf:
+            with zf.open('word/document.xml', 'w', force_zip64=True) as part:
+                part.write(self.template.document_prefix)
+                chunk, chunk_size = [], 0
+                for idx, xml in enumerate(fragments):
+                    report_progress(progress, idx, total)
+                    chunk.append(xml)
+                    chunk_size += len(xml)
+                    if chunk_size >= STREAM_FLUSH_BYTES:
+                        part.write(''.join(chunk).encode('utf-8'))
+                        chunk, chunk_size = [], 0
+                part.write(''.join(chunk).encode('utf-8'))
+                part.write(self.template.document_suffix)
+            self.write_parts(zf)
+        return file_stream
+
+    def write_parts(self, zf):
+        # document.xml 을 뺀 나머지 파트 (이미지, 관계, 콘텐츠 형식, 템플릿 파트)
+        for _, partname, _, blob in self.media.values():
+            zf.writestr(partname, blob)
+        zf.writestr('word/_rels/document.xml.rels', self.rels_xml())
+        zf.writestr('[Content_Types].xml', self.content_types_xml())
+        for name, blob in self.template.parts.items():
+            zf.writestr(name, blob)
+
+    def stream_package(self, body_file):
+        # 미리 이어 붙여 둔 본문 XML(body_file, utf-8)로 .docx 를 만들면서, 압축된 바이트를 만들어지는 대로 내보낸다.
+        buffer = ZipStreamBuffer()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+            with zf.open('word/document.xml', 'w', force_zip64=True) as part:
+                part.write(self.template.document_prefix)
+                for chunk in iter(lambda: body_file.read(STREAM_FLUSH_BYTES), b''):
+                    part.write(chunk)
+                    data = buffer.take()
+                    if data: yield data
+                part.write(self.template.document_suffix)
+            self.write_parts(zf)
+            data = buffer.take()
+            if data: yield data
+        yield buffer.take()
+
+class DocxResultCache:
+    # 생성된 .docx bytes 의 메모리 LRU(총 바이트 제한) + 선택적 디스크 LRU(파일 mtime 기준).
+    def __init__(self, max_bytes, disk_dir="", disk_max_bytes=0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._disk = OrderedDict()  # key -> 파일 크기
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'uncacheable': 0, 'not_modified': 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            files = []
+            for name in os.listdir(disk_dir):
+                if name.endswith('.docx'):
+                    st = os.stat(os.path.join(disk_dir, name))
+                    files.append((st.st_mtime, name[:-5], st.st_size))
+            for _, key, size in sorted(files):
+                self._disk[key] = size
+                self._disk_size += size
+
+    def count(self, name):
+        with self._lock: self.stats[name] += 1
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return data
+        if self.disk_dir:
+            path = os.path.join(self.disk_dir, key + '.docx')
+            try:
+                with open(path, 'rb') as f: data = f.read()
+                os.utime(path)
+            except OSError:
+                data = None
+            if data is not None:
+                with self._lock:
+                    if key in self._disk: self._disk.move_to_end(key)
+                    self.stats['disk_hits'] += 1
+                self._store(key, data)
+                return data
+        self.count('misses')
+        return None
+
+    def put(self, key, data):
+        self._store(key, data)
+        if not self.disk_dir or len(data) > self.disk_max_bytes: return
+        path = os.path.join(self.disk_dir, key + '.docx')
+        try:
+            with tempfile.NamedTemporaryFile(dir=self.disk_dir, suffix='.tmp', delete=False) as f:
+                f.write(data)
+            os.replace(f.name, path)
+        except OSError as e:
+            print(f"!!! 문서 디스크 캐시 저장 오류: {e}")
+            return
+        with self._lock:
+            self._disk_size += len(data) - self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+            evicted = []
+            while self._disk_size > self.disk_max_bytes:
+                old_key, size = self._disk.popitem(last=False)
+                self._disk_size -= size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(os.path.join(self.disk_dir, old_key + '.docx'))
+            except OSError:
+                pass
+
+    def _store(self, key, data):
+        if len(data) > self.max_bytes: return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None: self._size -= len(old)
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def stats_snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats.update({"entries": len(self._entries), "bytes": self._size,
+                          "disk_entries": len(self._disk), "disk_bytes": self._disk_size})
+        lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+        stats["hit_rate"] = round((stats['hits'] + stats['disk_hits']) / lookups, 4) if lookups else None
+        return stats
+
+DOCX_RESULT_CACHE = DocxResultCache(DOCX_CACHE_MAX_BYTES, DOCX_CACHE_DIR, DOCX_CACHE_DISK_MAX_BYTES)
+
+def check_docx_settings(settings):
+    # 요청을 읽을 때 한 번 확인한다. 잘못되면 ValueError (→ 400). docx_writer 는 측정 라벨로도 쓰이므로 정해진 값만 받는다.
+    if not isinstance(settings, dict): raise ValueError("'settings' must be an object")
+    writer = settings.get('docx_writer', DOCX_WRITER)
+    if writer not in DOCX_WRITERS:
+        raise ValueError(f"Unknown docx_writer {str(writer)[:40]!r} (one of {', '.join(DOCX_WRITERS)})")
+
+def document_cache_key(text_content, settings, images):
+    # 본문 + 설정 + 출력에 영향을 주는 서버 설정 + 이미지별 실제 내용(sha1)의 해시.
+    # 이미지 하나라도 받지 못했으면 (일시적 오류일 수 있으므로) 캐시하지 않는다 → None
+    if any(isinstance(data, Exception) for data in images.values()): return None
+    digest = hashlib.sha256(json.dumps({
+        'content': text_content, 'settings': settings, 'writer': settings.get('docx_writer', DOCX_WRITER),
+        'images': [IMAGE_OPTIMIZE, IMAGE_EMBED_DPI, IMAGE_JPEG_QUALITY],
+    }, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+    for ref in sorted(images):
+        digest.update(f"\0{ref}\0{hashlib.sha1(images[ref]).hexdigest()}".encode('utf-8'))
+    return digest.hexdigest()
+
+def create_word_document(text_content, settings, progress=None, images=None):
+    if images is None: images = prefetch_images(text_content)
+    cache_key = document_cache_key(text_content, settings, images)
+    if cache_key is None:
+        DOCX_RESULT_CACHE.count('uncacheable')
+    else:
+        with timed_stage('cache'):
+            cached = DOCX_RESULT_CACHE.get(cache_key)
+        if cached is not None:
+            METRICS.inc('saero_docx_generated_bytes_total', len(cached), writer='cache')
+            if progress: progress(1.0)
+            return io.BytesIO(cached)
+    writer = settings.get('docx_writer', DOCX_WRITER)
     file_stream = io.BytesIO()
-    doc.save(file_stream)
+    # 스트림 백엔드는 본문을 만들면서 바로 zip 에 쓰므로 render 에 패키징이 포함된다.
+    if writer == 'incremental':
+        with timed_stage('base'): template = get_docx_template(settings)
+        with timed_stage('render'):
+            DocxStreamWriter(template, images).write_segments(text_content, file_stream, progress)
+    elif writer == 'stream':
+        with timed_stage('parse'): nodes = parse_markup(text_content)
+        with timed_stage('base'): template = get_docx_template(settings)
+        with timed_stage('render'): DocxStreamWriter(template, images).write(nodes, file_stream, progress)
+    else:
+        with timed_stage('parse'): nodes = parse_markup(text_content)
+        with timed_stage('base'): doc, section = create_base_document(settings)
+        with timed_stage('render'): render_nodes(doc, section, nodes, images, progress)
+        with timed_stage('package'): doc.save(file_stream)
+    METRICS.inc('saero_docx_generated_bytes_total', file_stream.tell(), writer=writer)
+    if cache_key is not None: DOCX_RESULT_CACHE.put(cache_key, file_stream.getvalue())
+    if progress: progress(1.0)
     file_stream.seek(0)
     return file_stream
 
 # ==============================================================================
-# 3.5: Google Sheet 로깅 헬퍼 함수 (다음 단계에서 사용 예정)
+# 3.5: Google Sheet 사용량 로깅 (배치, 비동기)
+# ==============================================================================
+class UsageLogPipeline:
+    # 요청 스레드는 log()로 큐에 넣고 바로 돌아간다. 플러시 스레드가 배치 크기나 시간 기준으로
+    # append_rows를 호출하고, 실패하면 백오프 재시도 후 로컬 파일(NDJSON)에 남겨 두었다가 다음에 다시 보낸다.
+    # 파일에 남은 행은 앞에서부터 배치 크기씩 다시 보내고, 보낸 만큼만 파일에서 지운다.
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=USAGE_LOG_QUEUE_MAX)
+        self._worksheet = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self.stats = {'queued': 0, 'written': 0, 'spilled': 0, 'batches': 0, 'errors': 0}
+
+    def count(self, name, n=1):
+        with self._lock: self.stats[name] += n
+
+    def stats_snapshot(self):
+        with self._lock:
+            return dict(self.stats, queue_size=self._queue.qsize())
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='usage-log-flush', daemon=True)
+                self._thread.start()
+
+    def log(self, row):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(row)
+            self.count('queued')
+        except queue.Full:
+            # 큐가 가득 차면 요청을 막지 않고 바로 파일로 넘긴다.
+            self._spill([row])
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + USAGE_LOG_FLUSH_INTERVAL
+            while len(batch) < USAGE_LOG_BATCH_SIZE:
+                remaining = deadline - time.time()
+                if remaining <= 0: break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.flush(batch)
+
+    def _append(self, rows):
+        client = get_sheet_client()
+        if client is None: raise RuntimeError("Google Sheets service is not available")
+        # 재시도/파일 저장은 이 파이프라인이 직접 하므로 외부 호출 계층에서는 재시도하지 않는다.
+        try:
+            if self._worksheet is None:
+                self._worksheet = SHEETS_UPSTREAM.call(
+                    lambda: client.open_by_key(USAGE_LOG_SHEET_KEY).worksheet(USAGE_LOG_SHEET_NAME), retries=0)
+            SHEETS_UPSTREAM.call(self._worksheet.append_rows, rows, value_input_option='RAW', retries=0)
+        except Exception:
+            self._worksheet = None
+            raise
+
+    def _append_with_retry(self, rows, retries=USAGE_LOG_MAX_RETRIES):
+        for attempt in range(retries + 1):
+            try:
+                self._append(rows)
+                return True
+            except Exception as e:
+                self.count('errors')
+                print(f"!!! 사용량 로그 기록 오류 ({attempt + 1}/{retries + 1}): {e}")
+                if attempt < retries:
+                    time.sleep(min(60, 2 ** attempt) * (0.5 + random.random()))
+        return False
+
+    def flush(self, rows, retries=USAGE_LOG_MAX_RETRIES):
+        # 이전에 못 보낸 행을 먼저 보낸다. 다 보내지 못했으면 새 행은 파일 뒤에 쌓는다 (순서 유지).
+        if not self._replay_spilled(retries):
+            if rows: self._spill(rows)
+            return
+        for start in range(0, len(rows), USAGE_LOG_BATCH_SIZE):
+            if not self._send(rows[start:start + USAGE_LOG_BATCH_SIZE], retries):
+                self._spill(rows[start:])
+                return
+
+    def _send(self, rows, retries):
+        if not self._append_with_retry(rows, retries): return False
+        with self._lock:
+            self.stats['written'] += len(rows)
+            self.stats['batches'] += 1
+        return True
+
+    def _replay_spilled(self, retries):
+        # 파일의 앞 USAGE_LOG_BATCH_SIZE 줄씩 보내고 지운다. 남은 행이 없으면 True.
+        # 다른 스레드가 보내는 중이면 끼어들지 않고 False (새 행이 앞지르지 않도록).
+        if not self._replay_lock.acquire(blocking=False): return False
+        try:
+            while True:
+                lines, rows = self._read_spilled(USAGE_LOG_BATCH_SIZE)
+                if not lines: return True
+                if rows and not self._send(rows, retries): return False
+                self._drop_spilled(lines, len(rows))
+        finally:
+            self._replay_lock.release()
+
+    def _spill(self, rows):
+        try:
+            with self._spill_lock, open(USAGE_LOG_SPILL_FILE, 'a', encoding='utf-8') as f:
+                for row in rows: f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            self.count('spilled', len(rows))
+        except OSError as e:
+            print(f"!!! 사용량 로그 파일 저장 오류 ({len(rows)}건 유실): {e}")
+
+    def _read_spilled(self, limit):
+        # 파일 앞에서 limit 줄을 읽어 (줄 수, 행 목록) 반환. 읽을 수 없는 줄은 건너뛴다 (지울 때는 센다).
+        rows = []
+        with self._spill_lock:
+            try:
+                with open(USAGE_LOG_SPILL_FILE, encoding='utf-8') as f:
+                    lines = list(itertools.islice(f, limit))
+            except OSError:
+                return 0, []
+        for line in lines:
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                print(f"!!! 사용량 로그 파일의 잘못된 줄을 건너뜀: {line[:100]!r}")
+        return len(lines), rows
+
+    def _drop_spilled(self, lines, rows):
+        # 보낸 앞 lines 줄을 파일에서 지운다. 그 사이에 _spill 이 덧붙인 줄은 뒤에 그대로 남는다.
+        with self._spill_lock:
+            try:
+                with open(USAGE_LOG_SPILL_FILE, encoding='utf-8') as f:
+                    rest = list(itertools.islice(f, lines, None))
+                if rest:
+                    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=os.path.dirname(USAGE_LOG_SPILL_FILE),
+                                                     suffix='.tmp', delete=False) as out:
+                        out.writelines(rest)
+                    os.replace(out.name, USAGE_LOG_SPILL_FILE)
+                else:
+                    os.remove(USAGE_LOG_SPILL_FILE)
+            except OSError as e:
+                print(f"!!! 사용량 로그 파일 정리 오류 (다시 보낼 수 있음): {e}")
+            self.count('spilled', -rows)
+
+    def drain(self):
+        # 종료 시 큐에 남은 행을 재시도 없이 한 번에 보낸다. (실패하면 파일로)
+        rows = []
+        while True:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if rows: self.flush(rows, retries=0)
+
+USAGE_LOG = UsageLogPipeline()
+atexit.register(USAGE_LOG.drain)
+
+def usage_token_counts(usage):
+    # response.usage_metadata → (입력, 출력, 합계) 토큰 수
+    if usage is None: return 0, 0, 0
+    return (getattr(usage, 'prompt_token_count', 0) or 0, getattr(usage, 'candidates_token_count', 0) or 0,
+            getattr(usage, 'total_token_count', 0) or 0)
+
+def log_to_gemini_usage_sheet(request_text, response_text, usage=None):
+    prompt_tokens, reply_tokens, total_tokens = usage_token_counts(usage)
+    USAGE_LOG.log([datetime.now().strftime('%Y-%m-%d %H:%M:%S'), str(request_text)[:USAGE_LOG_CELL_LIMIT],
+                   str(response_text)[:USAGE_LOG_CELL_LIMIT], prompt_tokens, reply_tokens, total_tokens])
+
+# ==============================================================================
+# 3.6 문서 생성 작업 (비동기)
+# ==============================================================================
+# 큰 문서는 요청 스레드 대신 프로세스 풀에서 만든다. 결과 파일과 진행률 파일은 DOCX_JOB_DIR 에
+# 저장되며, 완료 후 DOCX_JOB_TTL 초가 지나면 삭제된다. 작업 목록은 프로세스 메모리에만 있다.
+DOCX_JOBS = {}
+DOCX_JOBS_LOCK = threading.Lock()
+DOCX_JOB_EXECUTOR = None
+DOCX_JOB_LAST_SWEEP = 0.0
+
+def get_docx_job_executor():
+    global DOCX_JOB_EXECUTOR
+    with DOCX_JOBS_LOCK:
+        if DOCX_JOB_EXECUTOR is None:
+            # fork 는 이미지 다운로드 스레드 풀 상태까지 복제하므로 spawn 을 사용한다.
+            DOCX_JOB_EXECUTOR = ProcessPoolExecutor(max_workers=DOCX_JOB_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return DOCX_JOB_EXECUTOR
+
+def run_docx_job(job_id, text_content, settings, job_dir):
+    # 작업 프로세스에서 실행된다. 진행률은 <job_id>.progress 파일로 부모 프로세스에 전달한다.
+    progress_path = os.path.join(job_dir, f"{job_id}.progress")
+    last_report = [0.0]
+
+    def report(fraction):
+        now = time.time()
+        if fraction < 1 and now - last_report[0] < 0.5: return
+        last_report[0] = now
+        with open(progress_path + '.tmp', 'w', encoding='utf-8') as f: json.dump({'progress': round(fraction, 3)}, f)
+        os.replace(progress_path + '.tmp', progress_path)
+
+    file_stream = create_word_document(text_content, settings, progress=report)
+    result_path = os.path.join(job_dir, f"{job_id}.docx")
+    with open(result_path + '.tmp', 'wb') as f: f.write(file_stream.getbuffer())
+    os.replace(result_path + '.tmp', result_path)
+    return result_path
+
+def remove_docx_job_files(job_id):
+    for suffix in ('.docx', '.docx.tmp', '.progress', '.progress.tmp'):
+        try:
+            os.remove(os.path.join(DOCX_JOB_DIR, job_id + suffix))
+        except OSError:
+            pass
+
+def sweep_docx_jobs(force=False):
+    # 만료된 작업과 (이전 인스턴스가 남긴 것을 포함한) 오래된 결과 파일을 정리한다.
+    global DOCX_JOB_LAST_SWEEP
+    now = time.time()
+    if not force and now - DOCX_JOB_LAST_SWEEP < 60: return
+    DOCX_JOB_LAST_SWEEP = now
+    with DOCX_JOBS_LOCK:
+        expired = [job_id for job_id, job in DOCX_JOBS.items() if job['finished_at'] and now - job['finished_at'] > DOCX_JOB_TTL]
+        for job_id in expired: del DOCX_JOBS[job_id]
+        active = set(DOCX_JOBS)
+    for job_id in expired: remove_docx_job_files(job_id)
+    try:
+        for name in os.listdir(DOCX_JOB_DIR):
+            path = os.path.join(DOCX_JOB_DIR, name)
+            if name.split('.', 1)[0] not in active and now - os.path.getmtime(path) > DOCX_JOB_TTL:
+                os.remove(path)
+    except OSError:
+        pass
+
+def finish_docx_job(job, future):
+    # 작업 프로세스의 완료 콜백 스레드에서 불린다. 상태/경로/완료 시각은 잠금 안에서 한 번에 바꾼다.
+    try:
+        update = {'path': future.result(), 'status': 'done'}
+    except Exception as e:
+        update = {'status': 'failed', 'error': str(e) or e.__class__.__name__}
+        print(f"!!! 문서 생성 작업 {job['id']} 실패: {update['error']}")
+    with DOCX_JOBS_LOCK:
+        job.update(update, finished_at=time.time())
+
+def get_docx_job(job_id):
+    # 요청 처리용 작업 정보 사본 (완료 콜백이 도중에 바꿔도 한 시점의 값만 본다)
+    with DOCX_JOBS_LOCK:
+        job = DOCX_JOBS.get(job_id)
+        return dict(job) if job is not None else None
+
+def submit_docx_job(text_content, settings, title):
+    global DOCX_JOB_EXECUTOR
+    sweep_docx_jobs()
+    with DOCX_JOBS_LOCK:
+        pending = sum(1 for job in DOCX_JOBS.values() if not job['finished_at'])
+    if pending >= DOCX_JOB_MAX_PENDING: return None
+    os.makedirs(DOCX_JOB_DIR, exist_ok=True)
+    job_id = uuid.uuid4().hex
+    job = {'id': job_id, 'status': 'queued', 'created_at': time.time(), 'finished_at': None,
+           'filename': generate_dynamic_filename(title), 'error': None, 'path': None}
+    try:
+        future = get_docx_job_executor().submit(run_docx_job, job_id, text_content, settings, DOCX_JOB_DIR)
+    except BrokenProcessPool:
+        # 작업 프로세스가 비정상 종료(OOM 등)되면 풀을 새로 만든다.
+        with DOCX_JOBS_LOCK: DOCX_JOB_EXECUTOR = None
+        future = get_docx_job_executor().submit(run_docx_job, job_id, text_content, settings, DOCX_JOB_DIR)
+    job['future'] = future
+    with DOCX_JOBS_LOCK: DOCX_JOBS[job_id] = job
+    future.add_done_callback(lambda f: finish_docx_job(job, f))
+    return job
+
+def docx_job_status(job):
+    status = job['status']
+    if status == 'queued' and job['future'].running(): status = 'running'
+    progress = 1.0 if status == 'done' else 0.0
+    if status == 'running':
+        try:
+            with open(os.path.join(DOCX_JOB_DIR, f"{job['id']}.progress"), encoding='utf-8') as f:
+                progress = json.load(f).get('progress', 0.0)
+        except (OSError, ValueError):
+            pass
+    result = {"job_id": job['id'], "status": status, "progress": progress, "filename": job['filename'],
+              "status_url": f"/docx-jobs/{job['id']}", "download_url": f"/docx-jobs/{job['id']}/download"}
+    if job['error']: result["error"] = job['error']
+    return result
+
+# ==============================================================================
+# 3.7 Gemini 대화 세션 저장소
 # ==============================================================================
-def log_to_gemini_usage_sheet(request_text, response_text, token_count):
-    print(f"Logging to Gemini Usage Sheet (skipping for now): Request='{request_text}', Response='{response_text}', Tokens={token_count}")
+@dataclass
+class ChatSessionEntry:
+    chat: object
+    last_used: float
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+class ChatSessionStore:
+    # session_id → ChatSession. 최대 개수를 넘으면 가장 오래 안 쓴 세션부터, TTL이 지나면 만료로 지운다.
+    def __init__(self, max_sessions, ttl):
+        self.max_sessions, self.ttl = max_sessions, ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self, now):
+        while self._sessions:
+            session_id, entry = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - entry.last_used <= self.ttl: break
+            del self._sessions[session_id]
+
+    def get(self, session_id, history=None):
+        # 없는(또는 만료된) 세션이면 전달받은 history로 새로 시작한다. (entry, 새로 만들었는지)
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            entry = self._sessions.get(session_id)
+            created = entry is None
+            if created:
+                entry = ChatSessionEntry(get_gemini_model().start_chat(history=history or []), now)
+                self._sessions[session_id] = entry
+            entry.last_used = now
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+        return entry, created
+
+    def discard(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self):
+        return len(self._sessions)
+
+CHAT_SESSIONS = ChatSessionStore(CHAT_SESSION_MAX, CHAT_SESSION_TTL)
+
+def normalize_prompt_text(text):
+    # 의미가 같은 입력이 같은 키가 되도록: 유니코드 NFC, 줄바꿈 통일, 줄 끝 공백과 앞뒤 공백 제거
+    text = unicodedata.normalize('NFC', str(text)).replace('\r\n', '\n').replace('\r', '\n')
+    return '\n'.join(line.rstrip() for line in text.split('\n')).strip()
+
+def gemini_cache_key(chat, user_message):
+    # 대화 기록(세션이든 요청의 history 든 chat.history 로 읽는다)과 메시지의 해시. 글이 아닌 부분이 있으면 캐시하지 않는다.
+    try:
+        turns = []
+        for content in chat.history:
+            if any(not part.text for part in content.parts): return None
+            turns.append([content.role or 'user', [normalize_prompt_text(part.text) for part in content.parts]])
+    except Exception:
+        return None
+    model_name = getattr(getattr(chat, 'model', None), 'model_name', '')
+    return hashlib.sha256(json.dumps([model_name, turns, normalize_prompt_text(user_message)],
+                                     ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def record_cached_turn(chat, user_message, reply):
+    # 캐시된 답변도 대화 기록에 남겨 세션의 다음 메시지가 이어지게 한다.
+    chat.history = [*chat.history, {'role': 'user', 'parts': [user_message]}, {'role': 'model', 'parts': [reply]}]
+
+class GeminiResponseCache:
+    # 키 → (답변, 만료 시각). 개수/총 바이트를 넘으면 오래 안 쓴 것부터 지운다.
+    # 진행 중인 요청은 Future 로 두고, 같은 키로 온 요청은 새로 호출하지 않고 그 결과를 기다린다.
+    def __init__(self, max_entries, max_bytes, ttl):
+        self.max_entries, self.max_bytes, self.ttl = max_entries, max_bytes, ttl
+        self._entries = OrderedDict()
+        self._size = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0}
+
+    def claim(self, key):
+        # ('hit', 답변) / ('wait', Future) / ('lead', Future). 'lead' 를 받으면 반드시 finish() 로 끝낸다.
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return 'hit', entry[0]
+            if entry is not None: self._discard(key)
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.stats['coalesced'] += 1
+                return 'wait', future
+            future = self._in_flight[key] = Future()
+            self.stats['misses'] += 1
+            return 'lead', future
+
+    def finish(self, key, future, reply=None, error=None):
+        with self._lock:
+            if self._in_flight.get(key) is future: del self._in_flight[key]
+            if error is None: self._store(key, reply)
+        # 앞선 요청이 중간에 끊겼으면(클라이언트 종료) 기다리던 요청이 직접 다시 호출한다.
+        if isinstance(error, GeneratorExit): future.cancel()
+        elif error is not None: future.set_exception(error)
+        else: future.set_result(reply)
+
+    def get_or_call(self, key, call):
+        # (답변, 캐시/다른 요청의 결과인지)
+        while True:
+            kind, value = self.claim(key)
+            if kind == 'hit': return value, True
+            if kind == 'wait':
+                try:
+                    return value.result(), True
+                except CancelledError:
+                    continue
+            try:
+                reply = call()
+            except BaseException as e:
+                self.finish(key, value, error=e)
+                raise
+            self.finish(key, value, reply)
+            return reply, False
+
+    def _store(self, key, reply):
+        size = len(reply.encode('utf-8'))
+        if size > self.max_bytes: return
+        if key in self._entries: self._discard(key)
+        self._entries[key] = (reply, time.time() + self.ttl, size)
+        self._size += size
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            self._discard(next(iter(self._entries)))
+            self.stats['evictions'] += 1
+
+    def _discard(self, key):
+        self._size -= self._entries.pop(key)[2]
+
+    def stats_snapshot(self):
+        with self._lock:
+            stats = dict(self.stats, entries=len(self._entries), bytes=self._size, in_flight=len(self._in_flight))
+        lookups = stats['hits'] + stats['coalesced'] + stats['misses']
+        stats["hit_rate"] = round((stats['hits'] + stats['coalesced']) / lookups, 4) if lookups else None
+        return stats
+
+GEMINI_CACHE = GeminiResponseCache(GEMINI_CACHE_MAX_ENTRIES, GEMINI_CACHE_MAX_BYTES, GEMINI_CACHE_TTL)
+
+def sse_event(data, event=None):
+    return (f"event: {event}\n" if event else "") + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def stream_chat_reply(chat, lock, user_message, session_id, use_cache=False):
+    # Gemini 응답 조각을 받는 대로 SSE로 흘려보낸다. 캐시된(또는 같은 요청을 기다려 받은) 답변은 한 번에 보낸다.
+    # 중간에 끊기면(오류/클라이언트 종료) 반쪽 응답이 대화 기록에 남지 않도록 마지막 턴을 되돌린다.
+    with lock:
+        sent = completed = False
+        cache_key = gemini_cache_key(chat, user_message) if use_cache else None
+        future = None
+        try:
+            while cache_key is not None:
+                kind, value = GEMINI_CACHE.claim(cache_key)
+                if kind == 'lead':
+                    future = value
+                    break
+                try:
+                    reply = value.result() if kind == 'wait' else value
+                except CancelledError:
+                    continue
+                record_cached_turn(chat, user_message, reply)
+                completed = True
+                log_to_gemini_usage_sheet(user_message, reply)
+                yield sse_event({"text": reply})
+                yield sse_event({"session_id": session_id, "cached": True}, event='done')
+                return
+            with GEMINI_UPSTREAM.slot():
+                response = chat.send_message(user_message, stream=True,
+                                             request_options={'timeout': GEMINI_UPSTREAM.timeout})
+                sent = True
+                for chunk in response:
+                    text = getattr(chunk, 'text', '')
+                    if text: yield sse_event({"text": text})
+            completed = True
+            if future is not None: GEMINI_CACHE.finish(cache_key, future, response.text)
+            log_to_gemini_usage_sheet(user_message, response.text, response.usage_metadata)
+            yield sse_event({"session_id": session_id}, event='done')
+        except Exception as e:
+            error_message = f"AI 통신 오류: {str(e)}"
+            if future is not None and not future.done(): GEMINI_CACHE.finish(cache_key, future, error=e)
+            log_to_gemini_usage_sheet(user_message, error_message)
+            print(f"!!! Gemini API 스트리밍 오류: {e}")
+            yield sse_event({"error": error_message}, event='error')
+        finally:
+            if future is not None and not future.done(): GEMINI_CACHE.finish(cache_key, future, error=GeneratorExit())
+            # 보내지도 못한 경우(슬롯 대기 실패 등)에는 되돌릴 턴이 없다. 직전의 정상 턴을 지우지 않는다.
+            if sent and not completed and chat.last is not None:
+                chat.rewind()
+
+# ==============================================================================
+# 3.8 일괄 문서 생성 (zip 스트리밍)
+# ==============================================================================
+TEMPLATE_VARIABLE_PATTERN = re.compile(r'\{\{\s*([^{}]+?)\s*\}\}')
+ZIP_PATH_INVALID_CHARS = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+
+def fill_template(template, variables):
+    # {{이름}} 을 변수 값으로 바꾼다. 없는 변수는 빈 문자열 (남겨 두면 마크업 태그로 잘못 읽힌다).
+    return TEMPLATE_VARIABLE_PATTERN.sub(lambda m: str(variables.get(m.group(1), '')), template)
+
+def batch_items(data):
+    # 요청 본문 → [(본문, 설정, 제목)]. 형식이 잘못되면 ValueError.
+    base_settings = data.get('settings') or {}
+    if not isinstance(base_settings, dict): raise ValueError("'settings' must be an object")
+    items = []
+    if 'documents' in data:
+        documents = data['documents']
+        if not isinstance(documents, list): raise ValueError("'documents' must be a list")
+        for index, doc in enumerate(documents):
+            if not isinstance(doc, dict) or not isinstance(doc.get('content'), str):
+                raise ValueError(f"documents[{index}] needs a 'content' string")
+            settings = doc.get('settings') or {}
+            if not isinstance(settings, dict): raise ValueError(f"documents[{index}].settings must be an object")
+            items.append((doc['content'], dict(base_settings, **settings), str(doc.get('title', '')).strip()))
+    elif 'template' in data:
+        template, variable_sets = data['template'], data.get('variables')
+        if not isinstance(template, str) or not isinstance(variable_sets, list):
+            raise ValueError("'template' must be a string and 'variables' a list")
+        title_template = str(data.get('title', ''))
+        for variables in variable_sets:
+            if not isinstance(variables, dict): raise ValueError("each variable set must be an object")
+            items.append((fill_template(template, variables), dict(base_settings),
+                          fill_template(title_template, variables).strip()))
+    else:
+        raise ValueError("Missing 'documents' or 'template' in request body")
+    if not items: raise ValueError("No documents to generate")
+    if len(items) > DOCX_BATCH_MAX_ITEMS: raise ValueError(f"Too many documents (max {DOCX_BATCH_MAX_ITEMS})")
+    for _, settings, _ in items:
+        settings.setdefault('docx_writer', DOCX_BATCH_WRITER)
+        check_docx_settings(settings)
+    return items
+
+class ZipStreamBuffer:
+    # zipfile 이 쓰는 바이트를 모아 두었다가 take() 로 꺼내 응답에 흘려보낸다 (seek 불가 스트림으로 동작).
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def render_batch_item(text_content, settings, images):
+    # 작업 프로세스에서 실행된다. 이미지는 부모가 한 번에 받아 둔 것을 쓴다.
+    return create_word_document(text_content, settings, images=images).getvalue()
+
+def submit_batch_item(text_content, settings, images):
+    global DOCX_JOB_EXECUTOR
+    try:
+        return get_docx_job_executor().submit(render_batch_item, text_content, settings, images)
+    except BrokenProcessPool:
+        with DOCX_JOBS_LOCK: DOCX_JOB_EXECUTOR = None
+        return get_docx_job_executor().submit(render_batch_item, text_content, settings, images)
+
+def stream_batch_zip(items):
+    # 모든 문서의 이미지를 한 번에 받아(공유 캐시) 항목별로 필요한 것만 넘긴다.
+    # 실패한 이미지는 작업 프로세스로 넘길 수 있게 메시지만 남긴다 (문서의 오류 문구는 같다).
+    images = {ref: RuntimeError(str(data)) if isinstance(data, Exception) else data
+              for ref, data in prefetch_images('\n'.join(content for content, _, _ in items)).items()}
+    buffer = ZipStreamBuffer()
+    manifest, pending, next_idx = [], {}, 0
+    max_in_flight = DOCX_JOB_WORKERS * 2
+    try:
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+            while next_idx < len(items) or pending:
+                while next_idx < len(items) and len(pending) < max_in_flight:
+                    content, settings, _ = items[next_idx]
+                    item_images = {ref: images[ref] for ref in collect_image_refs(content)}
+                    pending[submit_batch_item(content, settings, item_images)] = next_idx
+                    next_idx += 1
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in sorted(done, key=pending.get):
+                    idx = pending.pop(future)
+                    name = f"{idx + 1:04d}_{ZIP_PATH_INVALID_CHARS.sub('_', generate_dynamic_filename(items[idx][2]))}"
+                    try:
+                        data = future.result()
+                    except Exception as e:
+                        error = str(e) or e.__class__.__name__
+                        print(f"!!! 일괄 문서 생성 {idx + 1}번 실패: {error}")
+                        zf.writestr(name + '.error.txt', error)
+                        manifest.append({"index": idx + 1, "file": name + '.error.txt', "status": "failed", "error": error})
+                    else:
+                        # .docx 는 이미 압축되어 있으므로 다시 압축하지 않는다.
+                        zf.writestr(name, data, compress_type=zipfile.ZIP_STORED)
+                        METRICS.inc('saero_docx_generated_bytes_total', len(data), writer='batch')
+                        manifest.append({"index": idx + 1, "file": name, "status": "done", "bytes": len(data)})
+                chunk = buffer.take()
+                if chunk: yield chunk
+            manifest.sort(key=lambda entry: entry['index'])
+            zf.writestr('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2))
+        yield buffer.take()
+    finally:
+        # 클라이언트가 중간에 끊으면 아직 시작하지 않은 항목은 취소한다.
+        for future in pending: future.cancel()
+
+# ==============================================================================
+# 3.9 대용량 요청 (NDJSON 스트리밍 입력) 및 동시 생성 제한
+# ==============================================================================
+class DocxBusyError(Exception):
     pass
 
+DOCX_SLOTS = threading.BoundedSemaphore(DOCX_MAX_CONCURRENT)
+
+def acquire_docx_slot():
+    # 동시에 만드는 문서 수를 제한한다. DOCX_QUEUE_TIMEOUT 초까지 기다렸다가 그래도 자리가 없으면 DocxBusyError.
+    with timed_stage('queue'):
+        acquired = DOCX_SLOTS.acquire(timeout=DOCX_QUEUE_TIMEOUT)
+    if not acquired:
+        METRICS.inc('saero_requests_rejected_total', reason='busy')
+        raise DocxBusyError("문서 생성 요청이 많아 처리할 수 없습니다. 잠시 후 다시 시도해주세요.")
+
+@contextmanager
+def docx_slot():
+    acquire_docx_slot()
+    try:
+        yield
+    finally:
+        DOCX_SLOTS.release()
+
+def hold_docx_slot(response):
+    # 스트리밍 응답은 본문을 다 보낼(또는 연결이 끊길) 때까지 자리를 잡고 있다가 닫힐 때 돌려준다.
+    response.call_on_close(DOCX_SLOTS.release)
+    return response
+
+def attachment_disposition(filename):
+    # send_file 과 같은 형식 (한글 파일명은 filename* 로 보낸다)
+    fallback = filename.encode('ascii', 'ignore').decode('ascii').replace('"', '') or 'download'
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+def read_ndjson_records(stream):
+    # 요청 본문을 한 줄씩 읽어 (줄 번호, JSON 값) 으로 내보낸다. 빈 줄은 건너뛴다.
+    for number, raw in enumerate(iter(lambda: stream.readline(DOCX_STREAM_MAX_LINE_BYTES + 1), b''), 1):
+        if len(raw) > DOCX_STREAM_MAX_LINE_BYTES:
+            raise ValueError(f"NDJSON line {number} is too long (max {DOCX_STREAM_MAX_LINE_BYTES} bytes)")
+        if not raw.strip(): continue
+        try:
+            yield number, json.loads(raw)
+        except ValueError:
+            raise ValueError(f"NDJSON line {number} is not valid JSON")
+
+def ndjson_markup_lines(records):
+    # {"content": "..."} (또는 문자열) 조각을 이어 붙여 마크업 줄 단위로 내보낸다. 조각은 줄 중간에서 끊겨도 된다.
+    pending = ''
+    for number, record in records:
+        chunk = record.get('content') if isinstance(record, dict) else record
+        if not isinstance(chunk, str):
+            raise ValueError(f"NDJSON line {number} must be a string or an object with a 'content' string")
+        pending += chunk
+        if '\n' in pending:
+            *lines, pending = pending.split('\n')
+            yield from lines
+        if len(pending) > DOCX_STREAM_MAX_LINE_BYTES:
+            raise ValueError(f"Markup line ending at NDJSON line {number} is too long (max {DOCX_STREAM_MAX_LINE_BYTES} bytes)")
+    yield pending
+
+def render_ndjson_document(records, settings):
+    # 구간(3.4 증분 백엔드와 같은 단위)마다 이미지를 받고 본문 XML 을 만들어 임시 파일에 이어 쓴다.
+    # 본문 전체도, 완성된 .docx 도 메모리에 두지 않는다. 반환한 writer.stream_package(body) 로 zip 을 내보낸다.
+    with timed_stage('base'): writer = DocxStreamWriter(get_docx_template(settings), {})
+    body = tempfile.SpooledTemporaryFile(max_size=DOCX_STREAM_SPOOL_BYTES)
+    try:
+        with timed_stage('render'):
+            for segment in iter_markup_segments(ndjson_markup_lines(records)):
+                if '{그림:' in segment: writer.pictures.images.update(prefetch_images(segment))
+                body.write(writer.stitch(writer.segment_fragment(segment)).encode('utf-8'))
+        body.seek(0)
+    except BaseException:
+        body.close()
+        raise
+    return writer, body
+
+# ==============================================================================
+# 3.10 Word 파일 가져오기 (.docx → SaeRo 마크업)
+# ==============================================================================
+# document.xml 을 iterparse 로 본문 최상위 요소(문단/표) 단위로 읽고, 처리한 요소는 바로 지워 큰 파일도 메모리를 적게 쓴다.
+# 직접 지정된 서식만 옮긴다 (문자 스타일로 준 굵게/크기 등은 제목 스타일을 빼고 무시).
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+R_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+DRAWING_NS = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+VML_NS = 'urn:schemas-microsoft-com:vml'
+MC_NS = 'http://schemas.openxmlformats.org/markup-compatibility/2006'
+IMPORT_XML_PARSER = etree.XMLParser(resolve_entities=False, no_network=True, huge_tree=True)
+IMPORT_ALIGNMENTS = {value: key for key, value in JC_VALUES.items()}
+IMPORT_ALIGNMENTS.update({'start': 'LEFT', 'end': 'RIGHT'})
+IMPORT_ALIGNMENT_TAGS = {value: key for key, value in ALIGNMENT_TAGS.items()}
+TITLE_ALIGNMENT_NUMBERS = {value: key for key, value in TITLE_ALIGNMENTS.items()}
+TITLE_LEVELS_BY_SIZE = {value: key for key, value in TITLE_FONT_SIZES.items()}
+HEADING_STYLE_NAME_PATTERN = re.compile(r'heading\s*(\d)')
+EMPTY_CELL_TAG = "{빈칸}"  # 표의 빈 셀은 왼쪽 셀에 병합되므로, 병합하지 않을 빈 셀에는 (파서가 지우는) 태그를 넣는다.
+SKIPPED_RUN_CONTAINERS = {f'{{{W_NS}}}del', f'{{{W_NS}}}moveFrom', f'{{{W_NS}}}pPr', f'{{{MC_NS}}}Fallback'}
+TWIPS_PER_CM = 1440 / 2.54
+
+def w_tag(name):
+    return f'{{{W_NS}}}{name}'
+
+def w_val(element, default=None):
+    return default if element is None else element.get(w_tag('val'), default)
+
+def w_on(element):
+    # <w:b/>, <w:b w:val="1"/> 는 켜짐, <w:b w:val="0"/> 은 꺼짐
+    return element is not None and w_val(element, 'true') not in ('0', 'false', 'off', 'none')
+
+def w_number(value, default=None):
+    # 숫자 속성값. 비어 있거나 '1in' 처럼 읽을 수 없는 값이면 default
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+def w_size(element):
+    # <w:sz w:val="반 포인트"/> → pt, 없거나 잘못된 값이면 None
+    half_points = w_number(w_val(element))
+    return half_points / 2 if half_points else None
+
+def format_number(value):
+    return f"{round(value, 2):g}"
+
+def escape_markup_text(text, in_table=False):
+    # 본문의 중괄호(와 표 안의 |)가 마크업으로 읽히지 않도록 전각 문자로 바꾼다.
+    text = text.replace('{', '｛').replace('}', '｝')
+    return text.replace('|', '｜') if in_table else text
+
+class DocxImporter:
+    def __init__(self, zf, image_base_url):
+        self.zf = zf
+        self.image_base_url = image_base_url
+        self.document_part = self._main_part()
+        self.rels, self.external_rels = self._rels(self.document_part)
+        self.heading_styles, self.default_size = self._styles()
+        self.images = {}  # 파트 이름 → {그림:} 참조 (같은 이미지를 여러 번 저장하지 않는다)
+        self.warnings = []
+        self.stats = {'paragraphs': 0, 'tables': 0, 'images': 0}
+
+    def _read_xml(self, name):
+        try:
+            return etree.fromstring(self.zf.read(name), IMPORT_XML_PARSER)
+        except KeyError:
+            return None
+
+    def _main_part(self):
+        root = self._read_xml('_rels/.rels')
+        for rel in (root if root is not None else []):
+            if rel.get('Type', '').endswith('/officeDocument'): return rel.get('Target', '').lstrip('/')
+        return 'word/document.xml'
+
+    def _rels(self, partname):
+        folder, name = posixpath.split(partname)
+        root = self._read_xml(posixpath.join(folder, '_rels', name + '.rels'))
+        rels, external = {}, {}
+        for rel in (root if root is not None else []):
+            if rel.get('TargetMode') == 'External': external[rel.get('Id')] = rel.get('Target')
+            else: rels[rel.get('Id')] = posixpath.normpath(posixpath.join(folder, rel.get('Target', ''))).lstrip('/')
+        return rels, external
+
+    def _styles(self):
+        # 제목 스타일 id → 수준, 문서 기본 글자 크기(pt)
+        root = self._read_xml(posixpath.join(posixpath.dirname(self.document_part), 'styles.xml'))
+        if root is None: return {}, None
+        size = root.find(f'{w_tag("docDefaults")}/{w_tag("rPrDefault")}/{w_tag("rPr")}/{w_tag("sz")}')
+        default_size = w_size(size)
+        headings = {}
+        for style in root.iterfind(w_tag('style')):
+            if style.get(w_tag('type')) != 'paragraph': continue
+            name = w_val(style.find(w_tag('name')), '').lower()
+            match = HEADING_STYLE_NAME_PATTERN.fullmatch(name)
+            level = int(match.group(1)) if match else 1 if name == 'title' else None
+            outline = style.find(f'{w_tag("pPr")}/{w_tag("outlineLvl")}')
+            if level is None and outline is not None and w_val(outline, '9').isdigit() and int(w_val(outline)) < 9:
+                level = int(w_val(outline)) + 1
+            if level: headings[style.get(w_tag('styleId'))] = level
+            if style.get(w_tag('default')) in ('1', 'true'):
+                size = style.find(f'{w_tag("rPr")}/{w_tag("sz")}')
+                if w_size(size): default_size = w_size(size)
+        return headings, default_size
+
+    def title(self):
+        root = self._read_xml('docProps/core.xml')
+        if root is None: return ''
+        title = root.find('{http://purl.org/dc/elements/1.1/}title')
+        return (title.text or '').strip() if title is not None else ''
+
+    def image_ref(self, rid):
+        if rid in self.external_rels: return self.external_rels[rid]
+        partname = self.rels.get(rid)
+        if partname is None: return None
+        if partname not in self.images:
+            ext = posixpath.splitext(partname)[1].lstrip('.').lower() or 'bin'
+            if ext in ('emf', 'wmf'): self.warnings.append(f"{partname}: 지원하지 않는 이미지 형식({ext})입니다.")
+            name = IMPORTED_IMAGES.put(self.zf.read(partname), ext)
+            self.images[partname] = self.image_base_url + name
+            self.stats['images'] += 1
+        return self.images[partname]
+
+    def lines(self):
+        # 본문 최상위 문단/표를 끝나는 대로 마크업 줄로 바꾸고 지운다.
+        with self.zf.open(self.document_part) as f:
+            for _, element in etree.iterparse(f, events=('end',), tag=(w_tag('p'), w_tag('tbl'), w_tag('sdt')),
+                                              resolve_entities=False, no_network=True, huge_tree=True):
+                parent = element.getparent()
+                if parent is None or parent.tag != w_tag('body'): continue
+                yield from self.block_lines(element)
+                element.clear()
+                while element.getprevious() is not None: del parent[0]
+
+    def block_lines(self, element):
+        if element.tag == w_tag('p'):
+            self.stats['paragraphs'] += 1
+            yield from self.paragraph_lines(element)
+        elif element.tag == w_tag('tbl'):
+            self.stats['tables'] += 1
+            yield from self.table_lines(element)
+        elif element.tag == w_tag('sdt'):
+            for child in element.iterfind(f'{w_tag("sdtContent")}/*'): yield from self.block_lines(child)
+
+    def runs(self, element):
+        # 하이퍼링크/삽입/콘텐츠 컨트롤 안의 run 까지 문서 순서대로. 삭제된 내용과 대체 표현(Fallback)은 건너뛴다.
+        for child in element:
+            if child.tag == w_tag('r'): yield child
+            elif child.tag not in SKIPPED_RUN_CONTAINERS: yield from self.runs(child)
+
+    def pieces(self, paragraph):
+        # 문단 → [('text', 글자, 굵게, 밑줄, 크기) | ('tab',) | ('br',) | ('page',) | ('image', 참조)]
+        pieces = []
+        for run in self.runs(paragraph):
+            rpr = run.find(w_tag('rPr'))
+            bold = w_on(rpr.find(w_tag('b'))) if rpr is not None else False
+            underline = rpr is not None and w_val(rpr.find(w_tag('u')), 'none') != 'none'
+            size = w_size(rpr.find(w_tag('sz'))) if rpr is not None else None
+            self._run_content(run, pieces, bold, underline, size)
+        return pieces
+
+    def _run_content(self, element, pieces, bold, underline, size):
+        for child in element:
+            tag = child.tag
+            if tag == w_tag('t'): pieces.append(('text', child.text or '', bold, underline, size))
+            elif tag == w_tag('tab'): pieces.append(('tab',))
+            elif tag == w_tag('br'):
+                kind = child.get(w_tag('type'))
+                if kind == 'page': pieces.append(('page',))
+                elif kind != 'column': pieces.append(('br',))
+            elif tag == w_tag('cr'): pieces.append(('br',))
+            elif tag == w_tag('noBreakHyphen'): pieces.append(('text', '-', bold, underline, size))
+            elif tag in (w_tag('drawing'), w_tag('pict'), w_tag('object')):
+                blip = next(child.iter(f'{{{DRAWING_NS}}}blip', f'{{{VML_NS}}}imagedata'), None)
+                if blip is not None:
+                    rid = blip.get(f'{{{R_NS}}}embed') or blip.get(f'{{{R_NS}}}link') or blip.get(f'{{{R_NS}}}id')
+                    ref = self.image_ref(rid)
+                    if ref: pieces.append(('image', ref))
+            elif tag == f'{{{MC_NS}}}AlternateContent':
+                choice = child.find(f'{{{MC_NS}}}Choice')
+                if choice is not None: self._run_content(choice, pieces, bold, underline, size)
+
+    def paragraph_lines(self, paragraph):
+        ppr = paragraph.find(w_tag('pPr'))
+        find = (lambda name: ppr.find(w_tag(name))) if ppr is not None else (lambda name: None)
+        alignment = IMPORT_ALIGNMENTS.get(w_val(find('jc')))
+        level = self.heading_styles.get(w_val(find('pStyle')))
+        outline = find('outlineLvl')
+        if level is None and outline is not None and w_val(outline, '9').isdigit() and int(w_val(outline)) < 9:
+            level = int(w_val(outline)) + 1
+        tags = f"{{{IMPORT_ALIGNMENT_TAGS[alignment]}}}" if alignment else ''
+        ind = find('ind')
+        if ind is not None:
+            left = ind.get(w_tag('left')) or ind.get(w_tag('start'))
+            first = w_number(ind.get(w_tag('firstLine')), 0) - w_number(ind.get(w_tag('hanging')), 0)
+            if left is not None or first:
+                left_cm = max(0.0, w_number(left, 0) / TWIPS_PER_CM)
+                first_cm = max(0.0, left_cm + first / TWIPS_PER_CM)
+                tags += f"{{들여쓰기,1번줄:{format_number(first_cm)},2번줄이하:{format_number(left_cm)}}}"
+        spacing = find('spacing')
+        line = w_number(spacing.get(w_tag('line'))) if spacing is not None else None
+        if line and spacing.get(w_tag('lineRule'), 'auto') == 'auto':
+            tags += f"{{{format_number(line / 240)}줄}}"
+
+        lines = ['{페이지바꿈}'] if w_on(find('pageBreakBefore')) else []
+        group = []
+        for piece in self.pieces(paragraph) + [('end',)]:
+            if piece[0] not in ('page', 'image', 'end'):
+                group.append(piece)
+                continue
+            # 그림과 페이지 나누기는 마크업에서 한 줄을 차지하므로, 그 앞뒤 글은 같은 서식의 별도 줄로 나눈다.
+            if any(p[0] == 'text' and p[1].strip() for p in group) or (piece[0] == 'end' and not lines):
+                lines.append(self.text_line(group, tags, level, alignment))
+            group = []
+            if piece[0] == 'page': lines.append('{페이지바꿈}')
+            elif piece[0] == 'image': lines.append(f"{tags}{{그림:{piece[1]}}}")
+        return lines
+
+    def text_line(self, pieces, tags, level, alignment):
+        texts = [p for p in pieces if p[0] == 'text' and p[1].strip()]
+        if not texts: return ''
+        sizes = {p[4] for p in texts}
+        # 제목 스타일이거나, 이 프로그램이 만든 제목처럼 전부 굵게(밑줄 없이) + 제목 크기인 문단은 {제목X.Y} 로 옮긴다.
+        if level is None and all(p[2] and not p[3] for p in texts) and len(sizes) == 1:
+            level = TITLE_LEVELS_BY_SIZE.get(next(iter(sizes)))
+        if level is not None:
+            text = ''.join(p[1] if p[0] == 'text' else ' ' for p in pieces).strip()
+            return f"{{제목{min(level, 9)}.{TITLE_ALIGNMENT_NUMBERS.get(alignment, 1)}}}{escape_markup_text(text)}"
+        size = next(iter(sizes)) if len(sizes) == 1 else None
+        if size is not None and size != self.default_size: tags += f"{{{format_number(size)}pt}}"
+        parts, emphasized = [tags], False
+        for piece in pieces:
+            if piece[0] == 'tab': parts.append('{탭}')
+            elif piece[0] == 'br': parts.append('{줄바꿈}')
+            else:
+                # {>>}…{<<} 는 굵게+밑줄이다. 둘 중 하나만 있어도 강조로 옮긴다 (공백만 있는 run 은 앞 상태를 따른다).
+                on = piece[2] or piece[3]
+                if piece[1].strip() and on != emphasized:
+                    parts.append('{>>}' if on else '{<<}')
+                    emphasized = on
+                parts.append(escape_markup_text(piece[1]))
+        if emphasized: parts.append('{<<}')
+        return ''.join(parts)
+
+    def cell_content(self, cell):
+        # 셀은 글 한 줄 또는 그림 하나다. 둘 다 있으면 글을 남긴다.
+        texts, images = [], []
+        for paragraph in cell.iter(w_tag('p')):
+            pieces = self.pieces(paragraph)
+            images.extend(p[1] for p in pieces if p[0] == 'image')
+            text = ''.join(p[1] if p[0] == 'text' else ' ' for p in pieces if p[0] in ('text', 'tab', 'br')).strip()
+            if text: texts.append(text)
+        if not texts: return f"{{그림:{images[0]}}}" if images else ''
+        if images: self.warnings.append(f"글과 그림이 함께 있는 표 셀의 그림은 옮기지 못했습니다: {images[0]}")
+        return escape_markup_text(' '.join(texts), in_table=True)
+
+    def table_lines(self, table):
+        tblpr = table.find(w_tag('tblPr'))
+        borders = tblpr.find(w_tag('tblBorders')) if tblpr is not None else None
+        borderless = borders is not None and len(borders) > 0 and all(w_val(b) in ('nil', 'none') for b in borders)
+        grid = [w_number(col.get(w_tag('w')), 0) for col in table.iterfind(f'{w_tag("tblGrid")}/{w_tag("gridCol")}')]
+        rows = []
+        for tr in table.iterfind(w_tag('tr')):
+            trpr = tr.find(w_tag('trPr'))
+            before = int(w_number(w_val(trpr.find(w_tag('gridBefore'))), 0)) if trpr is not None else 0
+            cells = []
+            for tc in tr.iterfind(w_tag('tc')):
+                tcpr = tc.find(w_tag('tcPr'))
+                find = (lambda name: tcpr.find(w_tag(name))) if tcpr is not None else (lambda name: None)
+                vmerge = find('vMerge')
+                continued = vmerge is not None and w_val(vmerge) != 'restart'
+                tc_borders = find('tcBorders')
+                cells.append({'span': max(1, int(w_number(w_val(find('gridSpan')), 1))),
+                              'content': '' if continued else self.cell_content(tc),
+                              'fill': ((find('shd').get(w_tag('fill')) if find('shd') is not None else None) or '').upper(),
+                              'nil_borders': tc_borders is not None and sum(w_val(b) == 'nil' for b in tc_borders) >= 4})
+            rows.append({'before': before, 'header': trpr is not None and trpr.find(w_tag('tblHeader')) is not None,
+                         'cells': cells})
+        rows = [row for row in rows if row['cells']]
+        if not rows: return []
+        borderless = borderless or all(cell['nil_borders'] for row in rows for cell in row['cells'])
+        # 가로 병합은 뒤에 빈 칸을 두면 {표시작1} 로 나타낼 수 있다. 행마다 칸 수가 다르거나
+        # 24칸 격자에서 병합한 표({표시작2} 로 만든 표)는 {N} 위치를 붙인 {표시작2} 로 옮긴다.
+        widths = {row['before'] + sum(cell['span'] for cell in row['cells']) for row in rows}
+        merged = any(cell['span'] > 1 for row in rows for cell in row['cells'])
+        simple = (all(row['before'] == 0 for row in rows) and len(widths) == 1
+                  and not (merged and widths == {COMPLEX_TABLE_COLS}))
+        kind = '1' if simple else '2'
+        lines = [f"{{표시작{kind}{',테두리없음' if borderless else ''}}}"]
+        for r_idx, row in enumerate(rows):
+            prefix = '{제목행}' if row['header'] and r_idx < 5 else ''
+            fill = row['cells'][0]['fill']
+            if fill == 'D9D9D9': prefix += '{회색}'
+            elif fill == '000080': prefix += '{남색}'
+            contents = [cell['content'] or EMPTY_CELL_TAG for cell in row['cells']]
+            contents[0] = prefix + contents[0]
+            if simple:
+                lines.append('|'.join(part for cell, content in zip(row['cells'], contents)
+                                      for part in [content] + [''] * (cell['span'] - 1)))
+            else:
+                lines.append(self.grid_row(row, contents, grid))
+        lines.append(f"{{표끝{kind}}}")
+        return lines
+
+    def grid_row(self, row, contents, grid):
+        # 원래 표의 열 너비 비율대로 셀 시작 위치를 24칸 중 하나로 옮긴다. 뒤따르는 빈 칸은 파서가 병합한다.
+        total_cols = max(len(grid), row['before'] + sum(cell['span'] for cell in row['cells']))
+        widths = grid + [max(grid, default=1) or 1] * (total_cols - len(grid))
+        if not any(widths): widths = [1] * total_cols
+        edges = [0.0]
+        for width in widths: edges.append(edges[-1] + width)
+        segments, col, next_free = [], row['before'], 0
+        for cell, content in zip(row['cells'], contents):
+            position = max(next_free, round(edges[col] / edges[-1] * COMPLEX_TABLE_COLS))
+            col += cell['span']
+            if position >= COMPLEX_TABLE_COLS:
+                self.warnings.append(f"표의 열이 {COMPLEX_TABLE_COLS}칸을 넘어 일부 셀을 옮기지 못했습니다.")
+                break
+            segments.append(f"{content} {{{position + 1}}}")
+            next_free = max(position + 1, round(edges[min(col, total_cols)] / edges[-1] * COMPLEX_TABLE_COLS))
+        return '|'.join(segments)
+
 # ==============================================================================
 # 4. Flask API 엔드포인트
 # ==============================================================================
@@ -384,7 +2965,7 @@ def index():
 
 @app.route('/check-user', methods=['POST'])
 def handle_check_user():
-    if not SHEET_CLIENT:
+    if get_sheet_client() is None:
         return jsonify({"error": "Google Sheets service is not available"}), 503
 
     try:
@@ -398,55 +2979,228 @@ def handle_check_user():
         if not name or not email:
             return jsonify({"error": "Name and email are required"}), 400
 
-        # 구글 시트 열기
-        spreadsheet = SHEET_CLIENT.open_by_key("10FWgDt04ox83Fc2iDM66seswL1k2W-rfhOE1GHrjZtI")
-        worksheet = spreadsheet.worksheet("시트1")
-
-        # 모든 데이터 가져오기 (헤더 포함)
-        all_users = worksheet.get_all_records()
-
-        is_authorized = False
-        for user_record in all_users:
-            # 시트의 헤더 이름과 정확히 일치해야 함
-            if (user_record.get('사용자이름') == name and
-                user_record.get('이메일') == email and
-                str(user_record.get('상태')).strip() == '1'):
-                is_authorized = True
-                break
+        # 구글 시트 대신 메모리의 사용자 목록 스냅샷에서 확인 (백그라운드 갱신)
+        with timed_stage('user_lookup'):
+            is_authorized = USER_DIRECTORY.is_authorized(name, email)
 
         return jsonify({"authorized": is_authorized})
 
-    except gspread.exceptions.SpreadsheetNotFound:
-         print("Error: Spreadsheet not found. Check the key and sharing settings.")
-         return jsonify({"error": "Could not access the user list spreadsheet."}), 500
     except Exception as e:
+        # gspread 는 시트 클라이언트를 만들 때 임포트되므로, 시트 오류라면 이미 로드되어 있다.
+        from gspread.exceptions import SpreadsheetNotFound
+        if isinstance(e, SpreadsheetNotFound):
+            print("Error: Spreadsheet not found. Check the key and sharing settings.")
+            return jsonify({"error": "Could not access the user list spreadsheet."}), 500
         print(f"Error in /check-user: {e}")
         return jsonify({"error": "An internal server error occurred"}), 500
 
 
+@app.route('/check-user/stats', methods=['GET'])
+def handle_check_user_stats():
+    return jsonify(USER_DIRECTORY.stats_snapshot())
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def handle_request_too_large(e):
+    METRICS.inc('saero_requests_rejected_total', reason='too_large')
+    return jsonify({"error": f"요청 본문이 너무 큽니다 (최대 {request.max_content_length} bytes). "
+                             f"큰 문서는 /create-docx 에 application/x-ndjson 으로만 받습니다 (최대 {DOCX_STREAM_MAX_BYTES} bytes)."}), 413
+
+@app.errorhandler(DocxBusyError)
+def handle_docx_busy(e):
+    response = jsonify({"error": str(e)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(max(1, int(DOCX_QUEUE_TIMEOUT)))
+    return response
+
 @app.route('/create-docx', methods=['POST'])
 def handle_create_docx():
+    if request.mimetype == 'application/x-ndjson': return handle_create_docx_ndjson()
     try:
         if not request.is_json: return jsonify({"error": "Missing JSON in request"}), 400
         data = request.get_json()
         if 'content' not in data or 'settings' not in data:
             return jsonify({"error": "Missing 'content' or 'settings' in request body"}), 400
-        file_stream = create_word_document(data['content'], data['settings'])
+        try:
+            check_docx_settings(data['settings'])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         title = data.get('title', '').strip()
+        # 큰 문서(또는 async 요청)는 작업으로 넘기고 바로 202 + 작업 id 를 반환한다.
+        if data.get('async') or len(data['content']) > DOCX_ASYNC_THRESHOLD:
+            job = submit_docx_job(data['content'], data['settings'], title)
+            if job is None:
+                return jsonify({"error": "문서 생성 작업 대기열이 가득 찼습니다. 잠시 후 다시 시도해주세요."}), 503
+            return jsonify(docx_job_status(job)), 202
+        # 이미지까지 확인한 캐시 키를 ETag 로 쓴다. 내용이 그대로면 문서를 다시 보내지 않는다(304).
+        images = prefetch_images(data['content'])
+        etag = document_cache_key(data['content'], data['settings'], images)
+        if etag is not None and etag in request.if_none_match:
+            DOCX_RESULT_CACHE.count('not_modified')
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+        # 결과는 메모리(BytesIO)에 만든다. 입력이 MAX_REQUEST_BYTES 로 묶여 있어 크지 않다 (큰 문서는 NDJSON 으로).
+        with docx_slot():
+            file_stream = create_word_document(data['content'], data['settings'], images=images)
         filename = generate_dynamic_filename(title)
-        return send_file(
+        response = send_file(
             file_stream,
             as_attachment=True,
             download_name=filename,
             mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
         )
+        if etag is not None:
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    except (RequestEntityTooLarge, DocxBusyError):
+        raise
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+def handle_create_docx_ndjson():
+    # 첫 줄: {"settings": {...}, "title": "..."}, 다음 줄부터: {"content": "본문 조각"} 또는 "본문 조각"
+    # 본문을 다 받은 뒤(입력을 끝까지 읽어야 클라이언트가 응답을 기다린다) 결과 zip 을 만들어지는 대로 보낸다.
+    request.max_content_length = DOCX_STREAM_MAX_BYTES
+    records = read_ndjson_records(request.stream)
+    try:
+        _, header = next(records, (0, None))
+        if not isinstance(header, dict) or not isinstance(header.get('settings'), dict):
+            return jsonify({"error": "The first NDJSON line must be an object with 'settings'"}), 400
+        check_docx_settings(header['settings'])
+        acquire_docx_slot()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        writer, body = render_ndjson_document(records, header['settings'])
+    except ValueError as e:
+        DOCX_SLOTS.release()
+        return jsonify({"error": str(e)}), 400
+    except BaseException:
+        DOCX_SLOTS.release()
+        raise
+    response = Response(stream_with_context(writer.stream_package(body)),
+                        mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+                        headers={"Content-Disposition": attachment_disposition(
+                            generate_dynamic_filename(str(header.get('title', '')).strip()))})
+    response.call_on_close(body.close)
+    return hold_docx_slot(response)
+
+@app.route('/import-docx', methods=['POST'])
+def handle_import_docx():
+    # multipart 의 'file' 또는 본문 그대로(.docx) 를 받아 마크업으로 돌려준다.
+    request.max_content_length = IMPORT_MAX_BYTES
+    upload = request.files.get('file')
+    if upload is not None:
+        source, filename = upload.stream, upload.filename or ''
+    elif request.mimetype in ('application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'application/octet-stream'):
+        source, filename = tempfile.SpooledTemporaryFile(max_size=DOCX_STREAM_SPOOL_BYTES), request.args.get('filename', '')
+        for chunk in iter(lambda: request.stream.read(STREAM_FLUSH_BYTES), b''): source.write(chunk)
+        source.seek(0)
+    else:
+        return jsonify({"error": "Upload a .docx as multipart 'file' or as the request body"}), 400
+    image_base_url = IMPORT_IMAGE_BASE_URL or request.url_root + 'imported-images/'
+    try:
+        with docx_slot(), zipfile.ZipFile(source) as zf, timed_stage('import'):
+            importer = DocxImporter(zf, image_base_url)
+            content = '\n'.join(importer.lines())
+            title = importer.title() or os.path.splitext(os.path.basename(filename))[0]
+    except (zipfile.BadZipFile, KeyError, ValueError, etree.XMLSyntaxError) as e:
+        return jsonify({"error": f"올바른 .docx 파일이 아닙니다: {e}"}), 400
+    finally:
+        source.close()
+    return jsonify(dict(importer.stats, content=content, title=title, warnings=importer.warnings))
+
+@app.route('/imported-images/<name>', methods=['GET'])
+def handle_imported_image(name):
+    path = IMPORTED_IMAGES.path(name)
+    if path is None:
+        return jsonify({"error": "Image not found"}), 404
+    # 내용 해시가 이름이므로 바뀌지 않는다.
+    return send_file(path, max_age=365 * 24 * 3600)
+
+@app.route('/metrics', methods=['GET'])
+def handle_metrics():
+    # 캐시/큐 상태는 요청 시점에 읽어 gauge 로 덧붙인다.
+    docx_cache = DOCX_RESULT_CACHE.stats_snapshot()
+    segment_cache = DOCX_SEGMENT_CACHE.stats_snapshot()
+    users = USER_DIRECTORY.stats_snapshot()
+    gemini_cache = GEMINI_CACHE.stats_snapshot()
+    usage_log = USAGE_LOG.stats_snapshot()
+    with DOCX_JOBS_LOCK:
+        job_counts = {}
+        for job in DOCX_JOBS.values(): job_counts[job['status']] = job_counts.get(job['status'], 0) + 1
+    extra = [('saero_docx_cache_lookups_total', 'counter', "문서 캐시 조회 수", {'result': result}, docx_cache[key])
+             for key, result in (('hits', 'hit'), ('disk_hits', 'disk_hit'), ('misses', 'miss'), ('uncacheable', 'uncacheable'))]
+    extra += [
+        ('saero_docx_cache_bytes', 'gauge', "문서 캐시 메모리 사용량", {}, docx_cache['bytes']),
+        ('saero_docx_segment_cache_lookups_total', 'counter', "구간 캐시 조회 수", {'result': 'hit'}, segment_cache['hits']),
+        ('saero_docx_segment_cache_lookups_total', 'counter', "구간 캐시 조회 수", {'result': 'miss'}, segment_cache['misses']),
+        ('saero_image_cache_bytes', 'gauge', "이미지 캐시 메모리 사용량", {}, IMAGE_CACHE._size),
+        ('saero_imported_images_bytes', 'gauge', "가져온 문서에서 저장한 이미지 총량", {}, IMPORTED_IMAGES.stats_snapshot()['bytes']),
+        ('saero_user_directory_age_seconds', 'gauge', "사용자 목록 스냅샷 나이", {}, users['age_seconds']),
+        ('saero_user_directory_lookups_total', 'counter', "사용자 확인 수", {'result': 'hit'}, users['hits']),
+        ('saero_user_directory_lookups_total', 'counter', "사용자 확인 수", {'result': 'miss'}, users['misses']),
+        ('saero_chat_sessions', 'gauge', "보관 중인 Gemini 대화 세션 수", {}, len(CHAT_SESSIONS)),
+        ('saero_gemini_cache_bytes', 'gauge', "Gemini 응답 캐시 메모리 사용량", {}, gemini_cache['bytes']),
+        ('saero_usage_log_queue_size', 'gauge', "기록 대기 중인 사용량 로그 수", {}, usage_log['queue_size']),
+        ('saero_usage_log_spilled_rows', 'gauge', "파일로 넘긴 사용량 로그 수", {}, usage_log['spilled']),
+        ('saero_startup_seconds', 'gauge', "모듈 로드 시작부터의 시작 단계 소요 시간", {'phase': 'import'}, STARTUP_REPORT['import_seconds']),
+        ('saero_startup_seconds', 'gauge', "모듈 로드 시작부터의 시작 단계 소요 시간", {'phase': 'ready'}, STARTUP_REPORT['ready_seconds']),
+    ]
+    extra += [('saero_gemini_cache_lookups_total', 'counter', "Gemini 응답 캐시 조회 수", {'result': result}, gemini_cache[key])
+              for key, result in (('hits', 'hit'), ('coalesced', 'coalesced'), ('misses', 'miss'))]
+    extra += [('saero_upstream_circuit_open', 'gauge', "서킷 브레이커가 열려 있는지 (1: 호출 차단)", {'upstream': policy.name},
+               int(policy.stats_snapshot()['circuit_open'])) for policy in (GEMINI_UPSTREAM, SHEETS_UPSTREAM)]
+    extra += [('saero_docx_jobs', 'gauge', "상태별 문서 생성 작업 수", {'status': status}, count)
+              for status, count in sorted(job_counts.items())]
+    return Response(METRICS.render(extra), mimetype='text/plain; version=0.0.4')
+
+@app.route('/create-docx/stats', methods=['GET'])
+def handle_create_docx_stats():
+    return jsonify(dict(DOCX_RESULT_CACHE.stats_snapshot(), segments=DOCX_SEGMENT_CACHE.stats_snapshot()))
+
+@app.route('/create-docx/batch', methods=['POST'])
+def handle_create_docx_batch():
+    # {"template": "...{{이름}}...", "variables": [{...}, ...], "title": "{{이름}}_안내문", "settings": {...}}
+    # 또는 {"documents": [{"content": ..., "title": ..., "settings": {...}}, ...], "settings": {...}}
+    if not request.is_json: return jsonify({"error": "Missing JSON in request"}), 400
+    try:
+        items = batch_items(request.get_json())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    acquire_docx_slot()
+    filename = f"saero-batch-{datetime.now(timezone(timedelta(hours=9))).strftime('%y%m%d_%H%M%S')}.zip"
+    return hold_docx_slot(Response(stream_with_context(stream_batch_zip(items)), mimetype='application/zip',
+                                   headers={"Content-Disposition": attachment_disposition(filename),
+                                            "X-Batch-Items": str(len(items))}))
+
+@app.route('/docx-jobs/<job_id>', methods=['GET'])
+def handle_docx_job_status(job_id):
+    sweep_docx_jobs()
+    job = get_docx_job(job_id)
+    if job is None: return jsonify({"error": "Unknown or expired job"}), 404
+    return jsonify(docx_job_status(job))
+
+@app.route('/docx-jobs/<job_id>/download', methods=['GET'])
+def handle_docx_job_download(job_id):
+    job = get_docx_job(job_id)
+    if job is None: return jsonify({"error": "Unknown or expired job"}), 404
+    if job['status'] != 'done':
+        return jsonify(docx_job_status(job)), 409
+    return send_file(
+        job['path'],
+        as_attachment=True,
+        download_name=job['filename'],
+        mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+    )
+
 @app.route('/chat-gemini', methods=['POST'])
 def handle_chat():
+    model = get_gemini_model()
     if model is None:
         return jsonify({"error": "Gemini API 모델이 초기화되지 않았습니다."}), 503
     try:
@@ -456,6 +3210,9 @@ def handle_chat():
         data = request.get_json()
         user_message = data.get('message')
         chat_history = data.get('history', [])
+        session_id = data.get('session_id')
+        stream = bool(data.get('stream'))
+        use_cache = GEMINI_CACHE_TTL > 0 and data.get('cache', True) is not False
 
         if not user_message:
             return jsonify({"error": "'message' 필드가 요청에 포함되지 않았습니다."}), 400
@@ -465,22 +3222,111 @@ def handle_chat():
         return jsonify({"error": "요청 데이터를 파싱하는 중 오류가 발생했습니다."}), 400
 
     try:
-        chat_session = model.start_chat(history=chat_history)
-        response = chat_session.send_message(user_message)
+        # session_id가 있으면 서버에 보관한 대화를 이어 가고, 없으면 기존처럼 history로 일회성 대화를 만든다.
+        if session_id:
+            entry, _ = CHAT_SESSIONS.get(str(session_id), chat_history)
+            chat_session, lock = entry.chat, entry.lock
+        else:
+            chat_session, lock = model.start_chat(history=chat_history), threading.Lock()
+    except Exception as e:
+        print(f"!!! Gemini 대화 세션 생성 오류: {e}")
+        return jsonify({"error": f"대화 기록을 불러오지 못했습니다: {str(e)}"}), 400
+
+    if stream:
+        return Response(stream_with_context(stream_chat_reply(chat_session, lock, user_message, session_id, use_cache)),
+                        mimetype='text/event-stream',
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-        # 다음 단계에서 토큰 계산 및 로깅 구현 예정
-        # total_tokens = response.usage_metadata.total_token_count
-        # log_to_gemini_usage_sheet(user_message, response.text, total_tokens)
+    def send():
+        with timed_stage('gemini'):
+            response = GEMINI_UPSTREAM.call(chat_session.send_message, user_message,
+                                            request_options={'timeout': GEMINI_UPSTREAM.timeout})
+        log_to_gemini_usage_sheet(user_message, response.text, response.usage_metadata)
+        return response.text
 
-        return jsonify({"reply": response.text})
+    try:
+        with lock:
+            # 같은 기록 + 같은 메시지면 캐시된 답변(또는 진행 중인 같은 요청의 결과)을 쓴다.
+            cache_key = gemini_cache_key(chat_session, user_message) if use_cache else None
+            if cache_key is None:
+                reply, cached = send(), False
+            else:
+                reply, cached = GEMINI_CACHE.get_or_call(cache_key, send)
+            if cached:
+                record_cached_turn(chat_session, user_message, reply)
+                log_to_gemini_usage_sheet(user_message, reply)
+
+        result = {"reply": reply}
+        if session_id: result["session_id"] = session_id
+        if cached: result["cached"] = True
+        return jsonify(result)
 
     except Exception as e:
         error_message = f"AI 통신 오류: {str(e)}"
-        # 다음 단계에서 오류 로깅 구현 예정
-        # log_to_gemini_usage_sheet(user_message, error_message, 0)
+        log_to_gemini_usage_sheet(user_message, error_message)
 
         print(f"!!! Gemini API 호출 오류: {e}")
+        # 할당량 초과나 호출 제한은 서버 오류(500)가 아니라 잠시 후 다시 시도할 수 있는 응답으로 돌려준다.
+        if isinstance(e, UpstreamUnavailable) or upstream_status(e) == 429:
+            response = jsonify({"error": error_message})
+            response.status_code = 503 if isinstance(e, UpstreamUnavailable) else 429
+            response.headers['Retry-After'] = str(int(getattr(e, 'retry_after', UPSTREAM_BACKOFF_MAX)))
+            return response
         return jsonify({"error": error_message}), 500
 
+
+@app.route('/chat-gemini/stats', methods=['GET'])
+def handle_chat_stats():
+    return jsonify(dict(GEMINI_CACHE.stats_snapshot(), sessions=len(CHAT_SESSIONS), upstream=GEMINI_UPSTREAM.stats_snapshot()))
+
+@app.route('/chat-gemini/sessions/<session_id>', methods=['DELETE'])
+def handle_chat_session_delete(session_id):
+    return jsonify({"deleted": CHAT_SESSIONS.discard(session_id)})
+
+# ==============================================================================
+# 5. 시작 예열 및 준비 상태
+# ==============================================================================
+# 임포트는 가볍게 끝내고(포트를 바로 열 수 있게), 외부 클라이언트와 기본 문서 템플릿은 백그라운드에서 준비한다.
+# 준비가 끝나면 /ready 가 200 을 반환하고, 단계별 소요 시간을 JSON 로그 한 줄로 남긴다.
+STARTUP_READY = threading.Event()
+
+def warm_component(name, fn):
+    started = time.perf_counter()
+    try:
+        fn()
+        error = None
+    except Exception as e:
+        error = str(e)
+    STARTUP_REPORT['components'].setdefault(name, {'ready': error is None, 'seconds': round(time.perf_counter() - started, 3),
+                                                   'error': error})
+
+def warm_user_directory():
+    if get_sheet_client() is None: return
+    warm_component('user_directory', lambda: USER_DIRECTORY.refresh(wait=USER_DIRECTORY_LOAD_TIMEOUT))
+
+def warm_up():
+    with ThreadPoolExecutor(max_workers=3, thread_name_prefix='warm-up') as executor:
+        executor.submit(warm_user_directory)
+        executor.submit(get_gemini_model)
+        executor.submit(warm_component, 'docx_template', lambda: (get_docx_template({}), create_base_document({})))
+    finish_startup()
+
+def finish_startup():
+    STARTUP_REPORT['ready_seconds'] = round(time.perf_counter() - MODULE_LOAD_STARTED, 3)
+    STARTUP_READY.set()
+    print(json.dumps({"severity": "INFO", "message": "startup", **STARTUP_REPORT}, ensure_ascii=False))
+
+@app.route('/ready', methods=['GET'])
+def handle_ready():
+    return jsonify(dict(STARTUP_REPORT, ready=STARTUP_READY.is_set())), 200 if STARTUP_READY.is_set() else 503
+
+STARTUP_REPORT['import_seconds'] = round(time.perf_counter() - MODULE_LOAD_STARTED, 3)
+# 작업 프로세스(spawn)도 이 모듈을 임포트하므로, 최상위 프로세스에서만 예열한다.
+if multiprocessing.parent_process() is None:
+    if STARTUP_WARMUP:
+        threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+    else:
+        finish_startup()
+
 if __name__ == "__main__":
     app.run(debug=True, host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
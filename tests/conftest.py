@@ -0,0 +1,17 @@
+# ==============================================================================
+# 테스트 공통 설정
+# ==============================================================================
+#   python -m pytest -q
+# 저장소 루트의 main.py 를 임포트한다. 시작 예열(Sheets/Gemini 연결)은 테스트에서 쓰지 않는다.
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("STARTUP_WARMUP", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+
+@pytest.fixture
+def client():
+    return main.app.test_client()
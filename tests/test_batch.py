@@ -0,0 +1,39 @@
+# ==============================================================================
+# 일괄 문서 생성 (/create-docx/batch → zip 스트리밍)
+# ==============================================================================
+import io
+import json
+import zipfile
+
+def read_zip(response):
+    with zipfile.ZipFile(io.BytesIO(response.data)) as zf:
+        return {name: zf.read(name) for name in zf.namelist()}
+
+def test_template_batch_returns_one_document_per_variable_set(client):
+    response = client.post('/create-docx/batch', json={
+        'template': '{{이름}} 님께 드리는 안내문', 'title': '{{이름}}_안내문',
+        'variables': [{'이름': '홍길동'}, {'이름': '김철수'}], 'settings': {}})
+    assert response.status_code == 200 and response.headers['X-Batch-Items'] == '2'
+    files = read_zip(response)
+    manifest = json.loads(files.pop('manifest.json'))
+    assert [entry['status'] for entry in manifest] == ['done', 'done']
+    assert sorted(files) == ['0001_홍길동_안내문.docx', '0002_김철수_안내문.docx']
+    with zipfile.ZipFile(io.BytesIO(files['0002_김철수_안내문.docx'])) as docx:
+        assert '김철수 님께 드리는 안내문' in docx.read('word/document.xml').decode('utf-8')
+
+def test_documents_batch_keeps_order(client):
+    documents = [{'content': f'{n}번 문서', 'title': f'문서{n}'} for n in range(1, 4)]
+    files = read_zip(client.post('/create-docx/batch', json={'documents': documents}))
+    manifest = json.loads(files['manifest.json'])
+    assert [entry['file'] for entry in manifest] == ['0001_문서1.docx', '0002_문서2.docx', '0003_문서3.docx']
+
+def test_invalid_batch_is_400(client):
+    assert client.post('/create-docx/batch', json={'template': '본문'}).status_code == 400
+    assert client.post('/create-docx/batch', json={'documents': [{'title': '본문 없음'}]}).status_code == 400
+    assert client.post('/create-docx/batch', json={}).status_code == 400
+
+def test_document_settings_must_be_an_object(client):
+    documents = [{'content': '첫 문서'}, {'content': '둘째 문서', 'settings': '굵게'}]
+    response = client.post('/create-docx/batch', json={'documents': documents})
+    assert response.status_code == 400
+    assert 'documents[1]' in response.get_json()['error']
@@ -0,0 +1,25 @@
+# ==============================================================================
+# 생성 문서 캐시와 조건부 응답 (ETag / If-None-Match → 304)
+# ==============================================================================
+import main
+
+def test_same_request_is_served_from_cache(client):
+    body = {'content': '캐시 확인용 문단', 'settings': {}}
+    first = client.post('/create-docx', json=body)
+    hits = main.DOCX_RESULT_CACHE.stats_snapshot()['hits']
+    second = client.post('/create-docx', json=body)
+    assert first.status_code == second.status_code == 200
+    assert second.data == first.data
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert main.DOCX_RESULT_CACHE.stats_snapshot()['hits'] == hits + 1
+
+def test_if_none_match_returns_304_until_content_changes(client):
+    body = {'content': 'ETag 확인용 문단', 'settings': {}}
+    etag = client.post('/create-docx', json=body).headers['ETag']
+    not_modified = client.post('/create-docx', json=body, headers={'If-None-Match': etag})
+    assert not_modified.status_code == 304 and not_modified.data == b''
+    assert not_modified.headers['ETag'] == etag
+    changed = client.post('/create-docx', json=dict(body, content='바뀐 문단'), headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+    resized = client.post('/create-docx', json=dict(body, settings={'font_size': 12}), headers={'If-None-Match': etag})
+    assert resized.status_code == 200 and resized.headers['ETag'] != etag
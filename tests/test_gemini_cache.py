@@ -0,0 +1,71 @@
+# ==============================================================================
+# Gemini 응답 캐시와 같은 요청 합치기
+# ==============================================================================
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+class FakeChat:
+    def __init__(self, model, history):
+        self.model, self.history = model, list(history)
+
+    def send_message(self, message, **kwargs):
+        self.model.calls.append(message)
+        time.sleep(self.model.delay)
+        return SimpleNamespace(text=f"답변: {message}", usage_metadata=None)
+
+class FakeModel:
+    model_name = 'fake-gemini'
+
+    def __init__(self, delay=0):
+        self.calls, self.delay = [], delay
+
+    def start_chat(self, history=None):
+        return FakeChat(self, history or [])
+
+@pytest.fixture
+def model(monkeypatch):
+    model = FakeModel()
+    monkeypatch.setattr(main, 'get_gemini_model', lambda: model)
+    monkeypatch.setattr(main, 'log_to_gemini_usage_sheet', lambda *args, **kwargs: None)
+    monkeypatch.setattr(main, 'GEMINI_CACHE', main.GeminiResponseCache(100, 1024 * 1024, 60))
+    return model
+
+def test_equivalent_messages_share_a_cache_key():
+    chat = FakeModel().start_chat()
+    assert main.gemini_cache_key(chat, '안녕하세요  \r\n') == main.gemini_cache_key(chat, '안녕하세요')
+    assert main.gemini_cache_key(chat, '안녕하세요') != main.gemini_cache_key(chat, '안녕히 가세요')
+
+def test_repeated_request_is_answered_from_cache(client, model):
+    first = client.post('/chat-gemini', json={'message': '요약해줘'}).get_json()
+    second = client.post('/chat-gemini', json={'message': '요약해줘 '}).get_json()
+    assert first == {'reply': '답변: 요약해줘'}
+    assert second == {'reply': '답변: 요약해줘', 'cached': True}
+    assert model.calls == ['요약해줘']
+    assert client.post('/chat-gemini', json={'message': '요약해줘', 'cache': False}).status_code == 200
+    assert len(model.calls) == 2
+
+def test_concurrent_identical_requests_are_coalesced(client, model):
+    model.delay = 0.3
+    results = []
+
+    def ask():
+        results.append(main.app.test_client().post('/chat-gemini', json={'message': '동시에 묻기'}).get_json())
+    threads = [threading.Thread(target=ask) for _ in range(4)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert model.calls == ['동시에 묻기']
+    assert {result['reply'] for result in results} == {'답변: 동시에 묻기'}
+    assert sum(bool(result.get('cached')) for result in results) == 3
+    assert main.GEMINI_CACHE.stats_snapshot()['coalesced'] == 3
+
+def test_failed_call_is_not_cached():
+    cache = main.GeminiResponseCache(10, 1024, 60)
+    with pytest.raises(RuntimeError):
+        cache.get_or_call('key', lambda: (_ for _ in ()).throw(RuntimeError('boom')))
+    assert cache.get_or_call('key', lambda: '성공') == ('성공', False)
+    assert cache.get_or_call('key', lambda: '다시 호출되면 안 됨') == ('성공', True)
@@ -0,0 +1,95 @@
+# ==============================================================================
+# {그림:} 이미지 미리 받기와 캐시
+# ==============================================================================
+import io
+import threading
+import zipfile
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+from PIL import Image
+
+import main
+
+def png_bytes(width=40, height=20):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), (30, 160, 90)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+class ImageServer(ThreadingHTTPServer):
+    # /<이름>.png 는 PNG 를, 그 밖의 경로는 404 를 돌려준다. ETag 가 같으면 304.
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), ImageHandler)
+        self.image, self.requests = png_bytes(), []
+
+class ImageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if not self.path.endswith('.png'):
+            self.send_error(404)
+        elif self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(self.server.image)))
+            self.send_header('ETag', '"v1"')
+            self.end_headers()
+            self.wfile.write(self.server.image)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(main, 'IMAGE_CACHE', main.ImageCache(1024 * 1024))
+    server = ImageServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.url = f'http://127.0.0.1:{server.server_port}'
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_each_image_is_fetched_once(server):
+    text = f'{{그림:{server.url}/a.png}}\n{{그림:{server.url}/b.png}}\n{{그림:{server.url}/a.png}}'
+    images = main.prefetch_images(text)
+    assert images == {f'{server.url}/a.png': server.image, f'{server.url}/b.png': server.image}
+    assert sorted(server.requests) == ['/a.png', '/b.png']
+    main.prefetch_images(text)
+    assert len(server.requests) == 2
+
+def test_stale_image_is_revalidated(server, monkeypatch):
+    ref = f'{server.url}/a.png'
+    main.prefetch_images(f'{{그림:{ref}}}')
+    monkeypatch.setattr(main, 'IMAGE_CACHE_TTL', 0)
+    assert main.prefetch_images(f'{{그림:{ref}}}') == {ref: server.image}
+    assert server.requests == ['/a.png', '/a.png']
+
+def test_missing_image_becomes_error_text(server):
+    ref = f'{server.url}/missing.gif'
+    assert isinstance(main.prefetch_images(f'{{그림:{ref}}}')[ref], Exception)
+    document = main.create_word_document(f'{{그림:{ref}}}', {})
+    assert '이미지 로드 오류' in zipfile.ZipFile(document).read('word/document.xml').decode('utf-8')
+
+def test_wide_image_is_downscaled_for_embedding():
+    blob = png_bytes(3000, 1500)
+    data = main.encode_embedded_image(blob, 600)
+    with Image.open(io.BytesIO(data)) as img:
+        assert img.size == (600, 300)
+    assert len(data) < len(blob)
+
+def test_small_image_is_kept_as_is():
+    assert main.encode_embedded_image(png_bytes(), 600) is None
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = main.ImageCache(1024 * 1024, str(tmp_path), 3000)
+    for n in range(5): cache.put(f'image-{n}', bytes(900), '"etag"')
+    assert len(list(tmp_path.iterdir())) == 6  # 이미지 + .json 세 쌍
+    # 다시 시작해도 남은 파일을 mtime 순서로 이어서 센다.
+    reloaded = main.ImageCache(1024 * 1024, str(tmp_path), 3000)
+    assert reloaded.get('image-0') is None
+    assert reloaded.get('image-4')[:2] == (bytes(900), '"etag"')
+    reloaded.get('image-2')
+    reloaded.put('image-5', bytes(900))
+    assert reloaded.get('image-3') is None and reloaded.get('image-2') is not None
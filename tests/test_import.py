@@ -0,0 +1,115 @@
+# ==============================================================================
+# Word 파일 가져오기 (/import-docx) 왕복: 마크업 → .docx → 마크업 → .docx
+# ==============================================================================
+import io
+import os
+import re
+import time
+import zipfile
+
+import pytest
+from PIL import Image
+
+import main
+
+IMAGE_REF = 'https://example.com/photo.png'
+SAMPLE = '\n'.join([
+    '{제목1.1}보고서 제목',
+    '{가운데}가운데 {>>}강조{<<} 문장',
+    '{들여쓰기,1번줄:1,2번줄이하:0.5}들여쓰기 문단',
+    '{오른쪽}{1.5줄}오른쪽',
+    '',
+    '{표시작1}',
+    '{제목행}{회색}가|나|다',
+    '1||3',
+    '{남색}a|b|c',
+    '{표끝1}',
+    '{페이지바꿈}',
+    '{표시작2}',
+    '처음{1}|중간{5}|끝{-}',
+    '{표끝2}',
+    f'{{그림:{IMAGE_REF}}}',
+    '마지막',
+])
+
+def png_bytes():
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 20), (30, 120, 200)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def render(text, images=None):
+    return main.create_word_document(text, {}, images=images).getvalue()
+
+def document_xml(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        return zf.read('word/document.xml')
+
+@pytest.fixture
+def import_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'IMPORTED_IMAGES', main.ImportedImageStore(str(tmp_path), 1024 * 1024))
+    monkeypatch.setattr(main, 'IMPORT_IMAGE_BASE_URL', '')
+    return tmp_path
+
+def test_import_round_trip(client, import_dir):
+    original = render(SAMPLE, {IMAGE_REF: png_bytes()})
+    response = client.post('/import-docx?filename=보고서.docx', data=original, content_type='application/octet-stream')
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result['title'] == '보고서' and result['warnings'] == []
+    # 그림은 서버에 저장되고, 같은 서버에서 문서를 만들 때는 저장된 파일을 바로 읽는다.
+    [image_name] = [path.name for path in import_dir.iterdir()]
+    assert f'{{그림:http://localhost/imported-images/{image_name}}}' in result['content']
+    assert client.get(f'/imported-images/{image_name}').status_code == 200
+    assert document_xml(render(result['content'])) == document_xml(original)
+
+def test_multipart_upload(client, import_dir):
+    data = {'file': (io.BytesIO(render('{가운데}업로드한 문단')), '업로드.docx')}
+    result = client.post('/import-docx', data=data, content_type='multipart/form-data').get_json()
+    assert result['content'] == '{가운데}업로드한 문단' and result['title'] == '업로드'
+
+def test_invalid_upload_is_400(client, import_dir):
+    assert client.post('/import-docx', data=b'not a zip', content_type='application/octet-stream').status_code == 400
+    assert client.post('/import-docx', json={'content': '본문'}).status_code == 400
+    assert client.get('/imported-images/../main.py').status_code == 404
+
+def rewrite_document(data, replace):
+    # document.xml 만 바꿔서 다시 묶는다.
+    source, output = zipfile.ZipFile(io.BytesIO(data)), io.BytesIO()
+    with zipfile.ZipFile(output, 'w') as zf:
+        for item in source.infolist():
+            part = source.read(item.filename)
+            zf.writestr(item, replace(part) if item.filename == 'word/document.xml' else part)
+    return output.getvalue()
+
+def test_malformed_numbers_are_ignored(client, import_dir):
+    original = render('{들여쓰기,1번줄:1,2번줄이하:0.5}{1.5줄}들여쓰기 문단')
+    def corrupt(xml):
+        xml = re.sub(rb'w:left="[^"]*"', b'w:left="1in"', xml)
+        xml = re.sub(rb'w:line="[^"]*"', b'w:line="abc"', xml)
+        return xml.replace(b'<w:r>', b'<w:r><w:rPr><w:sz w:val="big"/></w:rPr>', 1)
+    broken = rewrite_document(original, corrupt)
+    assert broken != original
+    response = client.post('/import-docx', data=broken, content_type='application/octet-stream')
+    assert response.status_code == 200
+    assert '들여쓰기 문단' in response.get_json()['content']
+
+def test_imported_images_are_evicted(tmp_path):
+    store = main.ImportedImageStore(str(tmp_path), 250, ttl=60)
+    first, second = store.put(bytes(100), 'png'), store.put(bytes([1]) * 100, 'png')
+    store.path(first)
+    # 총량을 넘으면 가장 오래 쓰지 않은 이미지부터 지운다.
+    third = store.put(bytes([2]) * 100, 'png')
+    assert store.path(second) is None
+    assert sorted(os.listdir(tmp_path)) == sorted([first, third])
+    # 마지막으로 쓴 뒤 ttl 이 지나면 지운다. 다시 시작해도 파일 mtime 으로 센다.
+    expired = time.time() - 120
+    os.utime(tmp_path / first, (expired, expired))
+    reloaded = main.ImportedImageStore(str(tmp_path), 250, ttl=60)
+    assert reloaded.path(first) is None and reloaded.path(third) is not None
+    assert os.listdir(tmp_path) == [third]
+
+def test_image_url_ignores_forwarded_host(client, import_dir):
+    original = render(f'{{그림:{IMAGE_REF}}}', {IMAGE_REF: png_bytes()})
+    response = client.post('/import-docx', data=original, content_type='application/octet-stream',
+                           headers={'X-Forwarded-Proto': 'https', 'X-Forwarded-Host': 'attacker.example'})
+    assert '{그림:https://localhost/imported-images/' in response.get_json()['content']
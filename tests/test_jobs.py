@@ -0,0 +1,39 @@
+# ==============================================================================
+# 비동기 문서 생성 작업 (/create-docx → 202, /docx-jobs/...)
+# ==============================================================================
+import io
+import time
+import zipfile
+
+import main
+
+def wait_for_job(client, job, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = client.get(job['status_url']).get_json()
+        if status['status'] in ('done', 'failed'): return status
+        time.sleep(0.2)
+    raise AssertionError(f"job {job['job_id']} did not finish")
+
+def test_large_document_is_generated_as_job(client, monkeypatch):
+    monkeypatch.setattr(main, 'DOCX_ASYNC_THRESHOLD', 10)
+    response = client.post('/create-docx', json={'content': '작업으로 만드는 문단\n' * 5, 'settings': {}, 'title': '작업'})
+    assert response.status_code == 202
+    job = response.get_json()
+    assert job['status'] in ('queued', 'running')
+    status = wait_for_job(client, job)
+    assert status['status'] == 'done' and status['progress'] == 1.0
+    download = client.get(job['download_url'])
+    assert download.status_code == 200
+    assert download.headers['Content-Disposition'].startswith('attachment')
+    with zipfile.ZipFile(io.BytesIO(download.data)) as zf:
+        assert '작업으로 만드는 문단' in zf.read('word/document.xml').decode('utf-8')
+
+def test_async_flag_forces_job(client):
+    response = client.post('/create-docx', json={'content': '짧은 문단', 'settings': {}, 'async': True})
+    assert response.status_code == 202
+    assert wait_for_job(client, response.get_json())['status'] == 'done'
+
+def test_unknown_job_is_404(client):
+    assert client.get('/docx-jobs/missing').status_code == 404
+    assert client.get('/docx-jobs/missing/download').status_code == 404
@@ -0,0 +1,137 @@
+# ==============================================================================
+# SaeRo 마크업 → .docx 변환 테스트
+# ==============================================================================
+# 네트워크 없이 돌도록 그림은 테스트 안에서 만든 PNG 를 돌려준다.
+import io
+import re
+import zipfile
+
+import pytest
+from PIL import Image
+from docx.shared import Cm
+
+import main
+
+WRITERS = ('python-docx', 'stream', 'incremental')
+IMAGE_REF = 'https://example.com/sample.png'
+
+def png_bytes(width=40, height=20):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 30, 30)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+@pytest.fixture(autouse=True)
+def local_images(monkeypatch):
+    monkeypatch.setattr(main, 'prefetch_images', lambda text: {IMAGE_REF: png_bytes()} if IMAGE_REF in text else {})
+
+def document_parts(text, writer, settings=None):
+    stream = main.create_word_document(text, dict(settings or {}, docx_writer=writer))
+    with zipfile.ZipFile(stream) as zf:
+        return {name: zf.read(name) for name in zf.namelist()}
+
+def document_xml(text, writer='python-docx'):
+    return document_parts(text, writer)['word/document.xml'].decode('utf-8')
+
+def body_paragraphs(xml):
+    body = xml[xml.index('<w:body>'):xml.rindex('<w:sectPr')]
+    return re.findall(r'<w:p>.*?</w:p>|<w:p/>', body)
+
+# ==============================================================================
+# 1. 문단 태그
+# ==============================================================================
+@pytest.mark.parametrize('tag, alignment, jc', [
+    ('{왼쪽}', 'LEFT', 'left'), ('{가운데}', 'CENTER', 'center'), ('{오른쪽}', 'RIGHT', 'right'),
+    ('{양쪽}', 'JUSTIFY', 'both'), ('{균등}', 'DISTRIBUTE', 'distribute'),
+])
+def test_alignment(tag, alignment, jc):
+    [para] = main.parse_markup(f'{tag}본문')
+    assert para.alignment == alignment
+    assert [run.text for run in para.runs] == ['본문']
+    assert f'<w:jc w:val="{jc}"/>' in document_xml(f'{tag}본문')
+
+def test_indent():
+    [para] = main.parse_markup('{들여쓰기,1번줄:1.0,2번줄이하:0.5}본문')
+    assert para.left_indent_cm == 0.5 and para.first_line_indent_cm == 0.5
+    [hanging] = main.parse_markup('{들여쓰기,1번줄:0,2번줄이하:1.0}본문')
+    assert hanging.left_indent_cm == 1.0 and hanging.first_line_indent_cm == -1.0
+    xml = document_xml('{들여쓰기,1번줄:0,2번줄이하:1.0}본문')
+    assert f'<w:ind w:left="{Cm(1.0).twips}" w:hanging="{Cm(1.0).twips}"/>' in xml
+
+def test_inline_bold_underline():
+    [para] = main.parse_markup('앞{>>}강조{<<}뒤')
+    assert [(run.text, run.bold, run.underline) for run in para.runs] == [
+        ('앞', False, False), ('강조', True, True), ('뒤', False, False)]
+    [paragraph] = body_paragraphs(document_xml('앞{>>}강조{<<}뒤'))
+    runs = re.findall(r'<w:r>.*?</w:r>', paragraph)
+    assert len(runs) == 3
+    assert '<w:b/>' in runs[1] and '<w:u w:val="single"/>' in runs[1]
+    assert '<w:b/>' not in runs[0] + runs[2]
+
+def test_image_marker():
+    [para] = main.parse_markup(f'{{그림:{IMAGE_REF}}}')
+    assert para.runs == [main.InlineImage(IMAGE_REF)]
+    xml = document_xml(f'{{그림:{IMAGE_REF}}}')
+    assert '<w:drawing>' in xml and '이미지 로드 오류' not in xml
+
+def test_page_break():
+    nodes = main.parse_markup('앞\n{페이지바꿈}\n뒤')
+    assert isinstance(nodes[1], main.PageBreak)
+    assert document_xml('앞\n{페이지바꿈}\n뒤').count('<w:br w:type="page"/>') == 1
+
+# ==============================================================================
+# 2. 표 (빈 칸은 왼쪽 셀에 병합)
+# ==============================================================================
+def grid_spans(xml):
+    # 행마다 셀별 gridSpan (없으면 1)
+    spans = []
+    for row in re.findall(r'<w:tr>.*?</w:tr>', xml):
+        properties = re.findall(r'<w:tcPr>.*?</w:tcPr>', row)
+        spans.append([int(re.search(r'<w:gridSpan w:val="(\d+)"/>', p).group(1)) if 'gridSpan' in p else 1 for p in properties])
+    return spans
+
+def test_simple_table_merges_blank_cells():
+    text = '{표시작1}\n{제목행}{회색}가|나|다|라\n1||3|\n{표끝1}'
+    [table] = main.parse_markup(text)
+    assert table.num_cols == 4 and table.header_rows == 1 and table.rows[0].gray
+    assert [cell.blank for cell in table.rows[1].cells] == [False, True, False, True]
+    xml = document_xml(text)
+    assert '<w:tblHeader/>' in xml
+    assert grid_spans(xml) == [[1, 1, 1, 1], [2, 2]]
+
+def test_complex_table_merges_blank_cells():
+    text = '{표시작2}\n처음{1}|중간{5}|끝{-}\n{표끝2}'
+    [table] = main.parse_markup(text)
+    assert table.num_cols == main.COMPLEX_TABLE_COLS
+    cells = table.rows[0].cells
+    assert (cells[0].text, cells[4].text, cells[23].text) == ('처음', '중간', '끝')
+    assert sum(not cell.blank for cell in cells) == 3
+    assert grid_spans(document_xml(text)) == [[4, 19, 1]]
+
+# ==============================================================================
+# 3. 백엔드 간 동일 출력
+# ==============================================================================
+SAMPLE = '\n'.join([
+    '{제목1.1}보고서 제목',
+    '{가운데}{1.5줄}가운데 정렬 {>>}굵은 밑줄{<<} 문장{줄바꿈}다음 줄',
+    '{들여쓰기,1번줄:1.0,2번줄이하:0.5}{11pt}들여쓰기 문단{탭}탭 뒤',
+    '',
+    f'{{그림:{IMAGE_REF}}}',
+    '{표시작1,테두리없음,글꼴=바탕,크기=9}',
+    '{제목행}{회색}항목|값|',
+    f'{{남색}}a||{{그림:{IMAGE_REF}}}',
+    '{표끝1}',
+    '{페이지바꿈}',
+    '{표시작2}',
+    '{제목행}구분{1}|내용{5}|비고{-}',
+    '가{1}|나{3}|다{10}|합계{-}',
+    '{표끝2}',
+    '{오른쪽}끝{문단바꿈}마지막',
+])
+
+@pytest.mark.parametrize('writer', WRITERS[1:])
+def test_writers_produce_identical_parts(writer):
+    expected = document_parts(SAMPLE, 'python-docx')
+    actual = document_parts(SAMPLE, writer)
+    assert sorted(actual) == sorted(expected)
+    for name in expected:
+        assert actual[name] == expected[name], name
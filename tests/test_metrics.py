@@ -0,0 +1,52 @@
+# ==============================================================================
+# 요청 측정과 /metrics
+# ==============================================================================
+import json
+import re
+
+def metric(client, name, **labels):
+    # /metrics 에서 이름과 라벨이 같은 한 줄의 값 (없으면 None)
+    text = client.get('/metrics').get_data(as_text=True)
+    for line in text.splitlines():
+        match = re.fullmatch(rf'{name}(?:\{{(.*)\}})? (\S+)', line)
+        if match and dict(re.findall(r'(\w+)="([^"]*)"', match.group(1) or '')) == labels:
+            return float(match.group(2))
+    return None
+
+def test_requests_and_stages_are_counted(client):
+    before = metric(client, 'saero_http_requests_total', method='POST', endpoint='/create-docx', status='200') or 0
+    assert client.post('/create-docx', json={'content': '측정 문단', 'settings': {}}).status_code == 200
+    assert metric(client, 'saero_http_requests_total', method='POST', endpoint='/create-docx', status='200') == before + 1
+    assert metric(client, 'saero_stage_duration_seconds_count', stage='render') >= 1
+    assert metric(client, 'saero_docx_generated_bytes_total', writer='python-docx') > 0
+
+def test_metrics_exposition_format(client):
+    client.get('/metrics')
+    response = client.get('/metrics')
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert '# TYPE saero_http_request_duration_seconds histogram' in text
+    assert 'saero_http_request_duration_seconds_bucket{endpoint="/metrics",le="+Inf"}' in text
+
+def test_in_flight_gauge_returns_to_zero(client):
+    # 스트리밍 응답(NDJSON)과 send_file 응답 모두 끝나면 한 번씩만 빠진다.
+    # 다른 테스트가 닫지 않은 응답이 남아 있을 수 있어 시작 값과 비교한다.
+    before = metric(client, 'saero_http_requests_in_flight', endpoint='/create-docx') or 0
+    body = b'{"settings": {}}\n{"content": "\\uc2a4\\ud2b8\\ub9ac\\ubc0d"}\n'
+    for _ in range(2):
+        response = client.post('/create-docx', data=body, content_type='application/x-ndjson')
+        assert response.status_code == 200 and response.data
+        response.close()
+    client.post('/create-docx', json={'content': '게이지 문단', 'settings': {}}).close()
+    assert metric(client, 'saero_http_requests_in_flight', endpoint='/create-docx') == before
+
+def test_unknown_writer_is_400_and_never_a_label(client):
+    settings = {'docx_writer': 'made-up'}
+    assert client.post('/create-docx', json={'content': '본문', 'settings': settings}).status_code == 400
+    assert client.post('/create-docx', json={'content': '본문', 'settings': settings, 'async': True}).status_code == 400
+    body = (json.dumps({'settings': settings}) + '\n"본문"\n').encode('utf-8')
+    assert client.post('/create-docx', data=body, content_type='application/x-ndjson').status_code == 400
+    batch = {'documents': [{'content': '본문', 'settings': settings}]}
+    assert client.post('/create-docx/batch', json=batch).status_code == 400
+    assert client.post('/create-docx', json={'content': '본문', 'settings': []}).status_code == 400
+    assert metric(client, 'saero_docx_generated_bytes_total', writer='made-up') is None
@@ -0,0 +1,58 @@
+# ==============================================================================
+# 대용량 입력 (NDJSON 스트리밍 /create-docx) 과 요청 크기 제한
+# ==============================================================================
+import io
+import json
+import zipfile
+
+import main
+
+NDJSON = 'application/x-ndjson'
+
+def ndjson(*records):
+    return ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records).encode('utf-8')
+
+def document_xml(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        return zf.read('word/document.xml')
+
+def test_ndjson_matches_json_document(client):
+    content = '{가운데}첫 문단\n{표시작1}\n가|나\n1|\n{표끝1}\n{페이지바꿈}\n{>>}마지막{<<} 문단'
+    # 조각은 줄 중간에서 끊겨도 된다.
+    body = ndjson({'settings': {}, 'title': '스트리밍'}, {'content': content[:7]}, content[7:20], {'content': content[20:]})
+    response = client.post('/create-docx', data=body, content_type=NDJSON)
+    assert response.status_code == 200
+    assert 'attachment' in response.headers['Content-Disposition']
+    expected = main.create_word_document(content, {'docx_writer': 'stream'}).getvalue()
+    assert document_xml(response.data) == document_xml(expected)
+
+def test_ndjson_errors_are_400(client):
+    assert client.post('/create-docx', data=ndjson({'content': '설정 없음'}), content_type=NDJSON).status_code == 400
+    assert client.post('/create-docx', data=b'{"settings": {}}\nnot json\n', content_type=NDJSON).status_code == 400
+    assert client.post('/create-docx', data=ndjson({'settings': {}}, {'content': 3}), content_type=NDJSON).status_code == 400
+
+def test_ndjson_line_limit_is_400(client, monkeypatch):
+    monkeypatch.setattr(main, 'DOCX_STREAM_MAX_LINE_BYTES', 64)
+    response = client.post('/create-docx', data=ndjson({'settings': {}}, {'content': '가' * 100}), content_type=NDJSON)
+    assert response.status_code == 400
+
+def test_oversized_ndjson_body_is_413(client, monkeypatch):
+    monkeypatch.setattr(main, 'DOCX_STREAM_MAX_BYTES', 256)
+    body = ndjson({'settings': {}}, *({'content': '문단\n'} for _ in range(50)))
+    assert client.post('/create-docx', data=body, content_type=NDJSON).status_code == 413
+
+def test_oversized_json_body_is_413(client, monkeypatch):
+    monkeypatch.setitem(main.app.config, 'MAX_CONTENT_LENGTH', 256)
+    response = client.post('/create-docx', json={'content': '문단\n' * 100, 'settings': {}})
+    assert response.status_code == 413
+    assert 'error' in response.get_json()
+
+def test_only_ndjson_raises_the_body_limit(client, monkeypatch):
+    # 전역 한도를 넘는 본문은 JSON 으로는 413, NDJSON 으로는 받는다.
+    monkeypatch.setitem(main.app.config, 'MAX_CONTENT_LENGTH', 256)
+    content = '문단\n' * 100
+    response = client.post('/create-docx', json={'content': content, 'settings': {}})
+    assert response.status_code == 413 and NDJSON in response.get_json()['error']
+    response = client.post('/create-docx', data=ndjson({'settings': {}}, {'content': content}), content_type=NDJSON)
+    assert response.status_code == 200
+    response.close()
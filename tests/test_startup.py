@@ -0,0 +1,26 @@
+# ==============================================================================
+# 시작 시간: 무거운 외부 서비스 라이브러리는 처음 쓸 때 임포트한다
+# ==============================================================================
+import os
+import subprocess
+import sys
+
+import main
+
+def test_import_does_not_load_service_libraries():
+    code = "import sys, main; print(sorted(m for m in ('gspread', 'google.generativeai') if m in sys.modules))"
+    env = dict(os.environ, STARTUP_WARMUP='0')
+    result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(main.__file__), env=env,
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip().splitlines()[-1] == '[]'
+
+def test_missing_user_sheet_is_reported(client, monkeypatch):
+    from gspread.exceptions import SpreadsheetNotFound
+
+    def not_found(name, email):
+        raise SpreadsheetNotFound("not found")
+    monkeypatch.setattr(main, 'get_sheet_client', lambda: object())
+    monkeypatch.setattr(main.USER_DIRECTORY, 'is_authorized', not_found)
+    response = client.post('/check-user', json={'name': '홍길동', 'email': 'hong@example.com'})
+    assert response.status_code == 500
+    assert response.get_json() == {"error": "Could not access the user list spreadsheet."}
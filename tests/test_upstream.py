@@ -0,0 +1,88 @@
+# ==============================================================================
+# 외부 호출 계층 (재시도, 서킷 브레이커, 호출 제한)
+# ==============================================================================
+import threading
+import time
+
+import pytest
+
+import main
+
+class Flaky:
+    # 처음 failures 번은 error 를 내고 그 뒤로는 성공한다.
+    def __init__(self, failures, error):
+        self.failures, self.error, self.calls = failures, error, 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures: raise self.error
+        return 'ok'
+
+class HttpError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+@pytest.fixture
+def policy(monkeypatch):
+    monkeypatch.setattr(main, 'UPSTREAM_BACKOFF_BASE', 0)
+    monkeypatch.setattr(main, 'UPSTREAM_BREAKER_FAILURES', 3)
+    monkeypatch.setattr(main, 'UPSTREAM_BREAKER_RESET', 60)
+    monkeypatch.setattr(main, 'UPSTREAM_QUEUE_TIMEOUT', 0.2)
+    return main.UpstreamPolicy('test', 2, 6000, 5)
+
+def test_retryable_errors_are_retried(policy):
+    call = Flaky(2, HttpError(503))
+    assert policy.call(call, retries=3) == 'ok'
+    assert call.calls == 3
+    assert policy.stats_snapshot() == {'circuit_open': False, 'consecutive_failures': 0}
+
+def test_client_errors_are_not_retried(policy):
+    call = Flaky(1, HttpError(400))
+    with pytest.raises(HttpError):
+        policy.call(call, retries=3)
+    assert call.calls == 1 and policy.stats_snapshot()['consecutive_failures'] == 0
+
+def test_circuit_opens_after_consecutive_failures(policy, monkeypatch):
+    call = Flaky(100, TimeoutError('timeout'))
+    with pytest.raises(TimeoutError):
+        policy.call(call, retries=2)
+    assert call.calls == 3 and policy.stats_snapshot()['circuit_open']
+    with pytest.raises(main.UpstreamUnavailable) as rejected:
+        policy.call(call)
+    assert call.calls == 3 and rejected.value.retry_after > 1
+    # 재설정 시간이 지나면 시험 호출 하나를 보내고, 성공하면 서킷을 닫는다.
+    monkeypatch.setattr(main, 'UPSTREAM_BREAKER_RESET', 0)
+    assert policy.call(lambda: 'ok') == 'ok'
+    assert policy.stats_snapshot() == {'circuit_open': False, 'consecutive_failures': 0}
+
+def test_concurrency_limit_rejects_when_queue_times_out(policy):
+    with policy.slot(), policy.slot():
+        with pytest.raises(main.UpstreamUnavailable):
+            with policy.slot(): pass
+
+def test_token_bucket_limits_burst():
+    bucket = main.TokenBucket(60, burst=2)
+    deadline = time.monotonic()
+    assert bucket.acquire(deadline) and bucket.acquire(deadline)
+    assert not bucket.acquire(deadline)
+
+def test_rejected_stream_keeps_previous_turn(monkeypatch):
+    # 호출 자리를 얻지 못해 보내지도 못했으면 직전의 정상 턴을 되돌리지 않는다.
+    class Chat:
+        history, last = ['이전 질문', '이전 답변'], '이전 답변'
+
+        def rewind(self):
+            self.history = self.history[:-2]
+
+        def send_message(self, *args, **kwargs):
+            raise AssertionError("must not be called")
+
+    def rejected_slot():
+        raise main.UpstreamUnavailable('busy', 1.0)
+    monkeypatch.setattr(main.GEMINI_UPSTREAM, 'slot', rejected_slot)
+    monkeypatch.setattr(main, 'log_to_gemini_usage_sheet', lambda *args, **kwargs: None)
+    chat = Chat()
+    events = list(main.stream_chat_reply(chat, threading.Lock(), '새 질문', 'session'))
+    assert events[-1].startswith('event: error')
+    assert chat.history == ['이전 질문', '이전 답변']
@@ -0,0 +1,71 @@
+# ==============================================================================
+# Gemini 사용량 로그 파이프라인 (배치 기록, 실패 시 파일에 남겼다가 다시 보내기)
+# ==============================================================================
+import json
+import os
+
+import pytest
+
+import main
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'USAGE_LOG_SPILL_FILE', str(tmp_path / 'usage.ndjson'))
+    pipeline = main.UsageLogPipeline()
+    pipeline.sent, pipeline.down, pipeline.limit = [], False, None
+
+    def append(rows):
+        # down 이면 모두 실패, limit 이 있으면 그만큼 보낸 뒤부터 실패
+        if pipeline.down or (pipeline.limit is not None and len(pipeline.sent) >= pipeline.limit):
+            raise RuntimeError("sheets down")
+        pipeline.sent.append([list(row) for row in rows])
+    monkeypatch.setattr(pipeline, '_append', append)
+    return pipeline
+
+def test_batch_is_written_once(pipeline):
+    pipeline.flush([['a', 1], ['b', 2]], retries=0)
+    assert pipeline.sent == [[['a', 1], ['b', 2]]]
+    assert pipeline.stats['written'] == 2 and pipeline.stats['batches'] == 1
+
+def test_failed_rows_are_spilled_and_replayed_in_order(pipeline):
+    pipeline.down = True
+    pipeline.flush([['a']], retries=0)
+    assert pipeline.sent == [] and pipeline.stats['errors'] == 1
+    assert pipeline.stats['spilled'] == 1 and os.path.exists(main.USAGE_LOG_SPILL_FILE)
+    pipeline.down = False
+    pipeline.flush([['b']], retries=0)
+    assert pipeline.sent == [[['a']], [['b']]]
+    assert pipeline.stats['spilled'] == 0 and not os.path.exists(main.USAGE_LOG_SPILL_FILE)
+
+def spilled_rows():
+    with open(main.USAGE_LOG_SPILL_FILE, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+def test_spill_is_replayed_in_batches(pipeline, monkeypatch):
+    monkeypatch.setattr(main, 'USAGE_LOG_BATCH_SIZE', 2)
+    pipeline.down = True
+    pipeline.flush([[n] for n in range(5)], retries=0)
+    assert spilled_rows() == [[0], [1], [2], [3], [4]]
+    # 한 배치만 보내고 실패하면 나머지는 파일에 남고, 새 행은 그 뒤에 쌓인다.
+    pipeline.down, pipeline.limit = False, 1
+    pipeline.flush([[5]], retries=0)
+    assert pipeline.sent == [[[0], [1]]]
+    assert spilled_rows() == [[2], [3], [4], [5]] and pipeline.stats['spilled'] == 4
+    pipeline.limit = None
+    pipeline.flush([], retries=0)
+    assert pipeline.sent[1:] == [[[2], [3]], [[4], [5]]]
+    assert pipeline.stats['spilled'] == 0 and not os.path.exists(main.USAGE_LOG_SPILL_FILE)
+
+def test_new_rows_wait_behind_a_replay_in_progress(pipeline):
+    pipeline.down = True
+    pipeline.flush([['a']], retries=0)
+    pipeline.down = False
+    with pipeline._replay_lock:
+        pipeline.flush([['b']], retries=0)
+    assert pipeline.sent == [] and spilled_rows() == [['a'], ['b']]
+
+def test_drain_flushes_queued_rows(pipeline, monkeypatch):
+    monkeypatch.setattr(pipeline, '_ensure_thread', lambda: None)
+    pipeline.log(['queued'])
+    pipeline.drain()
+    assert pipeline.sent == [[['queued']]]